@@ -0,0 +1,326 @@
+"""
+Per-stage benchmark of the SQL and MongoDB pipelines.
+
+Each question is run step by step with the same helpers the agents use, timing
+every stage separately:
+
+    schema_load -> prompt_build -> generation_llm -> extraction ->
+    db_execution -> serialization -> interpretation_llm
+
+The question->query and result caches are bypassed so every repetition
+measures the real database and model. Results (p50/p95/p99 per stage and per
+backend) are written to JSON; ``compare`` flags stages that got slower than a
+saved baseline.
+
+Usage:
+    python evaluation/benchmark.py run --repetitions 5 --output bench.json
+    python evaluation/benchmark.py run --backend sql --limit 3 --baseline baseline.json
+    python evaluation/benchmark.py compare baseline.json bench.json --threshold 15
+"""
+import sys
+import os
+
+# Ensure the root directory is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from tabulate import tabulate
+
+STAGES = [
+    "schema_load",
+    "prompt_build",
+    "generation_llm",
+    "extraction",
+    "db_execution",
+    "serialization",
+    "interpretation_llm",
+    "total",
+]
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of ``values`` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize_samples(samples):
+    """count/mean/min/max and percentiles of a list of durations in seconds."""
+    summary = {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else 0.0,
+        "min": min(samples) if samples else 0.0,
+        "max": max(samples) if samples else 0.0,
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}"] = percentile(samples, pct)
+    return {k: round(v, 6) if isinstance(v, float) else v for k, v in summary.items()}
+
+
+class StageTimer:
+    """Collects durations per stage for one backend."""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+
+def bench_sql_question(ctx, question, timer, cold_schema=False):
+    """Runs one SQL question stage by stage."""
+    from src.agents.sql_agent import build_generation_prompt, build_interpretation_prompt, extract_sql
+    from src.agents.example_store import get_example_store
+    from src.agents.result_compaction import compact_result
+    from src.agents.sql_context import format_rows
+
+    if cold_schema:
+        ctx.invalidate_schema()
+    with timer.stage("schema_load"):
+        table_context = ctx.get_schema_context(question)[0].text
+    with timer.stage("prompt_build"):
+        examples = get_example_store().search("postgres", question)
+        prompt = build_generation_prompt(table_context, question, examples)
+    with timer.stage("generation_llm"):
+        response = ctx.llm.invoke(prompt)
+    with timer.stage("extraction"):
+        content = response.content if hasattr(response, 'content') else str(response)
+        generated_sql = extract_sql(content)
+    if not generated_sql:
+        raise ValueError("SQL Extraction Failed")
+    with timer.stage("db_execution"):
+        rows, columns, more_rows = ctx.run(generated_sql)
+    with timer.stage("serialization"):
+        raw_result = format_rows(rows)
+        compacted = compact_result(rows, raw_result, format_rows, columns)
+    with timer.stage("interpretation_llm"):
+        ctx.llm.invoke(build_interpretation_prompt(question, generated_sql, compacted.text,
+                                                   compacted.truncated, more_rows))
+
+
+def bench_mongo_question(db, inferrer, llm, question, timer, cold_schema=False):
+    """Runs one MongoDB question stage by stage."""
+    from src.agents.result_compaction import compact_result
+    from src.agents.mongo_agent import build_generation_prompt, build_interpretation_prompt, prepare_spec
+    from src.agents.example_store import get_example_store
+    from src.agents.mongo_spec import execute_spec, spec_text, to_json
+
+    if cold_schema:
+        inferrer.invalidate()
+    with timer.stage("schema_load"):
+        schema_context, schema, _ = inferrer.snapshot()
+    with timer.stage("prompt_build"):
+        examples = get_example_store().search("mongo", question)
+        prompt = build_generation_prompt(schema_context, question, examples)
+    with timer.stage("generation_llm"):
+        response = llm.invoke(prompt)
+    with timer.stage("extraction"):
+        content = response.content if hasattr(response, 'content') else str(response)
+        spec = prepare_spec(content, schema)
+    with timer.stage("db_execution"):
+        raw_result, more_rows = execute_spec(db, spec)
+    with timer.stage("serialization"):
+        raw_result_str = to_json(raw_result)
+        compacted = compact_result(raw_result, raw_result_str, to_json)
+    with timer.stage("interpretation_llm"):
+        llm.invoke(build_interpretation_prompt(question, spec_text(spec), compacted.text,
+                                               compacted.truncated, more_rows))
+
+
+def run_backend(name, questions, repetitions, bench_question):
+    """Runs every question ``repetitions`` times; returns (StageTimer, error count)."""
+    timer = StageTimer()
+    errors = 0
+    for rep in range(repetitions):
+        for question in questions:
+            start = time.perf_counter()
+            try:
+                bench_question(question, timer)
+            except Exception as e:
+                errors += 1
+                print(f"  [{name}] ERROR ({rep + 1}/{repetitions}) {question}: {e}")
+                continue
+            timer.samples["total"].append(time.perf_counter() - start)
+            print(f"  [{name}] {rep + 1}/{repetitions} {time.perf_counter() - start:.2f}s {question}")
+    return timer, errors
+
+
+def run_benchmark(backends, repetitions, limit=None, cold_schema=False):
+    """Benchmarks the selected backends and returns the JSON-serializable report."""
+    from evaluation.evaluate import TEST_CASES_MONGO, TEST_CASES_SQL
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "repetitions": repetitions,
+        "cold_schema": cold_schema,
+        "backends": {},
+    }
+
+    if "sql" in backends:
+        from src.agents.sql_context import get_sql_context
+        ctx = get_sql_context(os.environ["POSTGRES_URI"])
+        questions = TEST_CASES_SQL[:limit] if limit else TEST_CASES_SQL
+        print(f"--- SQL: {len(questions)} preguntas x {repetitions} ---")
+        timer, errors = run_backend(
+            "SQL", questions, repetitions,
+            lambda q, t: bench_sql_question(ctx, q, t, cold_schema),
+        )
+        report["backends"]["sql"] = {
+            "questions": len(questions),
+            "errors": errors,
+            "stages": {stage: summarize_samples(timer.samples[stage]) for stage in STAGES},
+        }
+
+    if "mongo" in backends:
+        from src.agents.llm_context import get_llm
+        from src.agents.mongo_context import get_mongo_client
+        from src.agents.mongo_schema import get_schema_inferrer
+        mongo_uri = os.environ["MONGO_URI"]
+        db_name = os.environ["MONGO_DB_NAME"]
+        db = get_mongo_client(mongo_uri)[db_name]
+        inferrer = get_schema_inferrer(mongo_uri, db_name)
+        llm = get_llm()
+        questions = TEST_CASES_MONGO[:limit] if limit else TEST_CASES_MONGO
+        print(f"--- MongoDB: {len(questions)} preguntas x {repetitions} ---")
+        timer, errors = run_backend(
+            "MongoDB", questions, repetitions,
+            lambda q, t: bench_mongo_question(db, inferrer, llm, q, t, cold_schema),
+        )
+        report["backends"]["mongo"] = {
+            "questions": len(questions),
+            "errors": errors,
+            "stages": {stage: summarize_samples(timer.samples[stage]) for stage in STAGES},
+        }
+
+    return report
+
+
+def print_report(report):
+    for backend, data in report["backends"].items():
+        rows = [
+            [stage, s["count"], f"{s['p50'] * 1000:.1f}", f"{s['p95'] * 1000:.1f}",
+             f"{s['p99'] * 1000:.1f}", f"{s['mean'] * 1000:.1f}"]
+            for stage, s in data["stages"].items()
+        ]
+        print(f"\n{backend.upper()} ({data['questions']} preguntas, {data['errors']} errores)")
+        print(tabulate(rows, headers=["Stage", "N", "p50 ms", "p95 ms", "p99 ms", "mean ms"], tablefmt="simple"))
+
+
+def compare_reports(baseline, current, threshold_pct=10.0, min_delta_s=0.005):
+    """
+    Compares p50/p95 of every stage against the baseline.
+
+    Args:
+        baseline: Report loaded from the baseline JSON.
+        current: Report of the run being checked.
+        threshold_pct: Relative slowdown that counts as a regression.
+        min_delta_s: Absolute slowdown below which differences are ignored (noise).
+
+    Returns:
+        Tuple ``(rows, regressions)`` where each row is
+        ``[backend, stage, metric, baseline_s, current_s, change_pct, flag]``.
+    """
+    rows, regressions = [], []
+    for backend, data in current["backends"].items():
+        base_stages = baseline.get("backends", {}).get(backend, {}).get("stages", {})
+        for stage, summary in data["stages"].items():
+            base = base_stages.get(stage)
+            if not base or not base["count"] or not summary["count"]:
+                continue
+            for metric in ("p50", "p95"):
+                old, new = base[metric], summary[metric]
+                change = (new - old) / old * 100 if old else 0.0
+                regressed = change > threshold_pct and new - old > min_delta_s
+                row = [backend, stage, metric, old, new, round(change, 1), "REGRESIÓN" if regressed else ""]
+                rows.append(row)
+                if regressed:
+                    regressions.append(row)
+    return rows, regressions
+
+
+def print_comparison(rows, regressions, threshold_pct):
+    display = [
+        [b, s, m, f"{old * 1000:.1f}", f"{new * 1000:.1f}", f"{change:+.1f}%", flag]
+        for b, s, m, old, new, change, flag in rows
+    ]
+    print(tabulate(display, headers=["Backend", "Stage", "Metric", "Base ms", "Actual ms", "Cambio", ""],
+                   tablefmt="simple"))
+    if regressions:
+        print(f"\n{len(regressions)} regresiones por encima del {threshold_pct:.0f}%")
+    else:
+        print(f"\nSin regresiones por encima del {threshold_pct:.0f}%")
+
+
+def load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapas de los agentes SQL y MongoDB")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="Ejecuta el benchmark y guarda el resultado en JSON")
+    run_p.add_argument("--backend", choices=["sql", "mongo", "all"], default="all")
+    run_p.add_argument("--repetitions", "-n", type=int, default=5)
+    run_p.add_argument("--limit", type=int, default=None, help="Solo las primeras N preguntas de cada backend")
+    run_p.add_argument("--cold-schema", action="store_true", help="Invalida la caché de esquema en cada pregunta")
+    run_p.add_argument("--output", "-o", default="benchmark_results.json")
+    run_p.add_argument("--baseline", help="Compara con este baseline al terminar")
+    run_p.add_argument("--threshold", type=float, default=10.0, help="Porcentaje de empeoramiento tolerado")
+
+    cmp_p = sub.add_parser("compare", help="Compara un resultado con un baseline guardado")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("current")
+    cmp_p.add_argument("--threshold", type=float, default=10.0, help="Porcentaje de empeoramiento tolerado")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        rows, regressions = compare_reports(load_report(args.baseline), load_report(args.current), args.threshold)
+        print_comparison(rows, regressions, args.threshold)
+        return 1 if regressions else 0
+
+    from src.utils.config import load_config
+    from src.agents.sql_context import shutdown_sql_contexts
+    from src.agents.mongo_context import shutdown_mongo_clients
+    load_config()
+
+    backends = ["sql", "mongo"] if args.backend == "all" else [args.backend]
+    try:
+        report = run_benchmark(backends, max(1, args.repetitions), args.limit, args.cold_schema)
+    finally:
+        shutdown_sql_contexts()
+        shutdown_mongo_clients()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"\nResultados guardados en {args.output}")
+
+    if args.baseline:
+        rows, regressions = compare_reports(load_report(args.baseline), report, args.threshold)
+        print()
+        print_comparison(rows, regressions, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
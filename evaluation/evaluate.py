@@ -4,11 +4,28 @@ import os
 # Ensure the root directory is in sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.agents.sql_agent import run_sql_agent
-from src.agents.mongo_agent import run_mongo_agent
+from src.agents.sql_agent import arun_sql_agent
+from src.agents.sql_context import (
+    adispose_sql_contexts, sql_pool_stats, sql_schema_cache_stats, sql_schema_pruning_stats, shutdown_sql_contexts,
+)
+from src.agents.mongo_agent import arun_mongo_agent
+from src.agents.mongo_context import aclose_async_mongo_clients, mongo_client_stats, shutdown_mongo_clients
+from src.agents.query_cache import query_cache_stats
+from src.agents.example_store import SOURCE_EVALUATION, SOURCE_UNVERIFIED, example_store_stats, get_example_store
+from src.agents.fast_path import fast_path_stats
+from src.agents.single_flight import single_flight_stats
+from src.agents.llm_context import get_model_manager
+from src.agents.result_cache import result_cache_stats, shutdown_result_cache
+from src.utils.config import env_int
 from tabulate import tabulate
+from bson import json_util
+import argparse
+import ast
+import asyncio
 import time
 
+DEFAULT_CASE_TIMEOUT = env_int("EVAL_CASE_TIMEOUT", 300)
+
 # Define test cases - ajustados a la estructura real de la BD
 TEST_CASES_SQL = [
     # Consultas simples (COUNT) - 4 casos
@@ -61,72 +78,165 @@ TEST_CASES_MONGO = [
     "Lista los pedidos ordenados por fecha de creación descendente",
 ]
 
-def evaluate():
-    results = []
-    
-    # ========== SQL TESTS ==========
-    print("=" * 60)
-    print("--- Evaluating SQL Agent (PostgreSQL) ---")
-    print("=" * 60)
-    for idx, query in enumerate(TEST_CASES_SQL):
-        # Clasificar tipo de consulta SQL
-        if idx < 4:
-            query_type = "Consulta simple"
-        elif idx < 8:
-            query_type = "Consulta con JOIN"
-        elif idx < 12:
-            query_type = "Agregación"
-        else:
-            query_type = "Filtrado complejo"
-        
-        print(f"Running: {query}")
-        start = time.time()
-        response_dict = run_sql_agent(query)
-        
-        if response_dict.get("error"):
-             status = "FAILED"
-             error_msg = response_dict["error"]
-             response_summary = error_msg if len(error_msg) < 50 else error_msg[:47] + "..."
+# Respuestas conocidas de los casos cuyo resultado no depende de los pedidos aleatorios de setup_db.py:
+# números (con tolerancia 0.01) que deben ser los valores numéricos del resultado, o textos que deben ser una de sus celdas
+EXPECTED_RESULTS = {
+    ("SQL", "¿Cuántos usuarios hay en total?"): [10],
+    ("SQL", "¿Cuántos productos hay en la categoría Electronics?"): [5],
+    ("SQL", "¿Cuál es el precio promedio de todos los productos?"): [285.67],
+    ("SQL", "Lista los productos con precio mayor a 100 y stock menor a 50"): [
+        "4K Monitor", "Office Chair", "Standing Desk", "Bookshelf", "Sofa", "Air Fryer",
+    ],
+    ("SQL", "¿Cuáles son los 5 productos más caros de la categoría Electronics?"): [
+        "Laptop Pro", "Smartphone X", "4K Monitor", "Wireless Headphones", "Gaming Mouse",
+    ],
+    ("MongoDB", "¿Cuántos usuarios hay en total?"): [5],
+    ("MongoDB", "¿Cuántos pedidos hay en total?"): [15],
+    ("MongoDB", "Lista los usuarios cuyo email contiene 'example.com'"): [
+        "Alice Smith", "Bob Jones", "Charlie Brown", "Diana Prince", "Evan Wright",
+    ],
+    ("MongoDB", "Muestra los usuarios cuyo nombre empieza con 'B'"): ["Bob Jones"],
+}
+
+def _flatten(value):
+    if isinstance(value, dict):
+        return [cell for item in value.values() for cell in _flatten(item)]
+    if isinstance(value, list):
+        return [cell for item in value for cell in _flatten(item)]
+    return [value]
+
+def _literal_cells(node):
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [cell for item in node.elts for cell in _literal_cells(item)]
+    if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "Decimal" and node.args:
+        return [float(ast.literal_eval(node.args[0]))]
+    try:
+        return [ast.literal_eval(node)]
+    except ValueError:
+        # datetime.date(...) y otros objetos: su repr como texto
+        return [ast.unparse(node)]
+
+def result_cells(raw):
+    """Scalar values of a raw result: Mongo JSON or the ``str`` of SQL rows (a list of tuples)."""
+    try:
+        return _flatten(json_util.loads(raw))
+    except ValueError:
+        pass
+    try:
+        return _literal_cells(ast.parse(raw, mode="eval").body)
+    except SyntaxError:
+        return []
+
+def matches_expected(result, expected):
+    """
+    True if the raw results of ``result`` hold the expected values.
+
+    Expected texts must be whole cells; expected numbers must be, in order, all
+    the numeric cells of the result (the single value of an aggregate), so a
+    number that only appears in another row or column does not count.
+    """
+    cells = [cell for raw in result.get("raw_results") or [] for cell in result_cells(str(raw))]
+    numbers = [cell for cell in cells if isinstance(cell, (int, float)) and not isinstance(cell, bool)]
+    expected_numbers = [value for value in expected if not isinstance(value, str)]
+    if expected_numbers and (len(numbers) != len(expected_numbers)
+                             or any(abs(n - value) >= 0.01 for n, value in zip(numbers, expected_numbers))):
+        return False
+    return all(value in cells for value in expected if isinstance(value, str))
+
+def classify_sql(idx):
+    """Tipo de consulta SQL según su posición en TEST_CASES_SQL."""
+    if idx < 4:
+        return "Consulta simple"
+    elif idx < 8:
+        return "Consulta con JOIN"
+    elif idx < 12:
+        return "Agregación"
+    return "Filtrado complejo"
+
+def classify_mongo(idx):
+    """Tipo de consulta MongoDB según su posición en TEST_CASES_MONGO."""
+    if idx < 4:
+        return "Consulta simple"
+    elif idx < 9:
+        return "Consulta con filtrado"
+    elif idx < 13:
+        return "Agregación"
+    return "Filtrado y ordenamiento"
+
+def build_cases():
+    """All evaluation cases as (agent, query, query_type), in report order."""
+    cases = [("SQL", query, classify_sql(idx)) for idx, query in enumerate(TEST_CASES_SQL)]
+    cases += [("MongoDB", query, classify_mongo(idx)) for idx, query in enumerate(TEST_CASES_MONGO)]
+    return cases
+
+def summarize(text):
+    return text if len(text) < 50 else text[:47] + "..."
+
+async def run_case(agent, query, query_type, semaphore, timeout):
+    """Runs one case under the worker limit; the timeout cancels the agent coroutine."""
+    runner = arun_sql_agent if agent == "SQL" else arun_mongo_agent
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            response_dict = await asyncio.wait_for(runner(query), timeout=timeout)
+        except asyncio.TimeoutError:
+            response_dict = {"answer": None, "error": f"Timeout after {timeout:.0f}s"}
+            status = "TIMEOUT"
         else:
-             status = "SUCCESS"
-             answer = response_dict["answer"]
-             response_summary = answer if len(answer) < 50 else answer[:47] + "..."
-        
-        duration = time.time() - start
-        results.append(["SQL", query, status, response_summary, f"{duration:.2f}s", duration, query_type])
-        print(f"Result: {response_dict.get('answer', 'No answer')}\n")
-
-    # ========== MONGODB TESTS ==========
-    print("\n" + "=" * 60)
-    print("--- Evaluating MongoDB Agent ---")
+            status = "FAILED" if response_dict.get("error") else "SUCCESS"
+        duration = time.perf_counter() - start
+
+    verified = ""
+    if status == "SUCCESS" and response_dict.get("sql_queries"):
+        # Solo los casos con el resultado esperado alimentan los ejemplos few-shot; el resto
+        # (sin respuesta conocida o con otra respuesta) se guarda como no verificado y no se recupera
+        expected = EXPECTED_RESULTS.get((agent, query))
+        source = SOURCE_EVALUATION if expected and matches_expected(response_dict, expected) else SOURCE_UNVERIFIED
+        if expected:
+            verified = " [verificado]" if source == SOURCE_EVALUATION else " [resultado inesperado]"
+        backend = "postgres" if agent == "SQL" else "mongo"
+        await asyncio.to_thread(get_example_store().add, backend, query, response_dict["sql_queries"][-1], source)
+
+    if status == "SUCCESS":
+        response_summary = summarize(response_dict["answer"])
+    else:
+        response_summary = summarize(response_dict["error"])
+    fast = " [camino rápido]" if response_dict.get("fast_path") else ""
+    print(f"[{agent}] {status} ({duration:.2f}s){fast}{verified} {query}")
+    if response_dict.get("answer"):
+        print(f"Result: {response_dict['answer']}\n")
+    return [agent, query, status, response_summary, f"{duration:.2f}s", duration, query_type]
+
+async def run_cases(cases, concurrency, timeout):
+    """Runs every case over at most ``concurrency`` in-flight requests, keeping case order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        return await asyncio.gather(*[
+            run_case(agent, query, query_type, semaphore, timeout)
+            for agent, query, query_type in cases
+        ])
+    finally:
+        await adispose_sql_contexts()
+        await aclose_async_mongo_clients()
+
+def evaluate(concurrency=1, timeout=DEFAULT_CASE_TIMEOUT):
+    cases = build_cases()
+    # Los pipelines no guardan ejemplos durante la evaluación: run_case decide según el resultado esperado
+    get_example_store().record_runtime = False
+
     print("=" * 60)
-    for idx, query in enumerate(TEST_CASES_MONGO):
-        # Clasificar tipo de consulta MongoDB
-        if idx < 4:
-            query_type = "Consulta simple"
-        elif idx < 9:
-            query_type = "Consulta con filtrado"
-        elif idx < 13:
-            query_type = "Agregación"
-        else:
-            query_type = "Filtrado y ordenamiento"
-        
-        print(f"Running: {query}")
-        start = time.time()
-        response_dict = run_mongo_agent(query)
-        
-        if response_dict.get("error"):
-             status = "FAILED"
-             error_msg = response_dict["error"]
-             response_summary = error_msg if len(error_msg) < 50 else error_msg[:47] + "..."
-        else:
-             status = "SUCCESS"
-             answer = response_dict["answer"]
-             response_summary = answer if len(answer) < 50 else answer[:47] + "..."
-        
-        duration = time.time() - start
-        results.append(["MongoDB", query, status, response_summary, f"{duration:.2f}s", duration, query_type])
-        print(f"Result: {response_dict.get('answer', 'No answer')}\n")
+    print(f"--- Evaluating SQL Agent (PostgreSQL) + MongoDB Agent: {len(cases)} casos, concurrencia {concurrency} ---")
+    print("=" * 60)
+    # Carga del modelo antes de medir: el primer caso no incluye el arranque de Ollama
+    manager = get_model_manager()
+    if manager.load():
+        print(f"Modelo {manager.model} listo ({manager.warm_up_seconds:.2f}s de carga)")
+    else:
+        print(f"Modelo {manager.model} no disponible: {manager.error}")
+    wall_start = time.perf_counter()
+    # gather conserva el orden de los casos, así el informe es estable con cualquier concurrencia
+    results = asyncio.run(run_cases(cases, concurrency, timeout))
+    wall_time = time.perf_counter() - wall_start
 
     # ========== SUMMARY ==========
     print("\n" + "=" * 60)
@@ -142,6 +252,7 @@ def evaluate():
     mongo_tests = len([r for r in results if r[0] == "MongoDB"])
     success_tests = len([r for r in results if r[2] == "SUCCESS"])
     failed_tests = len([r for r in results if r[2] == "FAILED"])
+    timeout_tests = len([r for r in results if r[2] == "TIMEOUT"])
     
     # Calcular tiempos promedio
     sql_times = [r[5] for r in results if r[0] == "SQL"]
@@ -169,6 +280,7 @@ def evaluate():
     print(f"  - MongoDB: {mongo_tests}")
     print(f"  Exitosos: {success_tests} ({success_tests/total_tests*100:.1f}%)")
     print(f"  Fallidos: {failed_tests} ({failed_tests/total_tests*100:.1f}%)")
+    print(f"  Timeouts: {timeout_tests} ({timeout_tests/total_tests*100:.1f}%)")
     print(f"\nTIEMPOS PROMEDIO:")
     print(f"  General: {total_avg:.2f}s")
     print(f"  - PostgreSQL (SQL): {sql_avg:.2f}s")
@@ -176,7 +288,77 @@ def evaluate():
     print(f"\n  Por tipo de consulta:")
     for qtype in sorted(type_averages.keys()):
         print(f"    - {qtype}: {type_averages[qtype]:.2f}s")
+
+    # Tiempo real frente a latencia acumulada: la diferencia es lo ganado con la concurrencia;
+    # si la latencia media crece con la concurrencia, los casos compiten por Ollama
+    summed_latency = sum(all_times)
+    speedup = summed_latency / wall_time if wall_time else 0
+    print(f"\nCONCURRENCIA ({concurrency} workers, timeout {timeout:.0f}s por caso):")
+    print(f"  Tiempo real (wall-clock): {wall_time:.2f}s")
+    print(f"  Latencia acumulada: {summed_latency:.2f}s")
+    print(f"  Speedup: {speedup:.2f}x (eficiencia {speedup / concurrency * 100:.0f}%)")
+
+    # Estadísticas del pool de conexiones compartido
+    for uri, stats in sql_pool_stats().items():
+        print(f"\nPOOL SQL ({uri}):")
+        print(f"  Checkouts: {stats['checkouts']} (timeouts: {stats['timeouts']})")
+        print(f"  Espera media: {stats['avg_wait_s'] * 1000:.2f}ms - máxima: {stats['max_wait_s'] * 1000:.2f}ms")
+        print(f"  Tamaño: {stats['pool_size']} + overflow {stats['overflow']}/{stats['max_overflow']}")
+    for uri, stats in sql_schema_cache_stats().items():
+        print(f"\nCACHÉ DE ESQUEMA SQL ({uri}):")
+        print(f"  Aciertos: {stats['hits']} (desde disco: {stats['disk_hits']}) - Fallos: {stats['misses']}")
+        print(f"  Tiempo de reflexión ahorrado: {stats['reflect_seconds_saved']:.2f}s")
+    for uri, stats in sql_schema_pruning_stats().items():
+        print(f"\nPODA DE ESQUEMA SQL ({uri}):")
+        print(f"  Preguntas: {stats['questions']} - tokens de esquema: {stats['tokens_full']} -> {stats['tokens_pruned']}")
+        print(f"  Tokens de prompt ahorrados: {stats['tokens_saved']} (media {stats['avg_tokens_saved']:.0f} por pregunta)")
+    fp_stats = fast_path_stats()
+    for backend in ("postgres", "mongo"):
+        if backend in fp_stats:
+            stats = fp_stats[backend]
+            print(f"\nCAMINO RÁPIDO ({backend}): {stats['hits']}/{stats['questions']} preguntas sin LLM "
+                  f"(cobertura {stats['coverage'] * 100:.1f}%)")
+    if fp_stats.get("intents"):
+        print("  Intenciones: " + ", ".join(f"{intent}: {count}" for intent, count in fp_stats["intents"].items()))
+    sf_stats = single_flight_stats()
+    for backend in ("postgres", "mongo"):
+        if sf_stats.get(backend, {}).get("coalesced"):
+            stats = sf_stats[backend]
+            print(f"\nPREGUNTAS COMPARTIDAS ({backend}): {stats['coalesced']} peticiones unidas a una ejecución en curso "
+                  f"({stats['executions']} ejecuciones), {stats['llm_calls_saved']} llamadas al LLM y "
+                  f"{stats['llm_seconds_saved']:.2f}s de LLM ahorrados")
+    qc_stats = query_cache_stats()
+    if qc_stats:
+        print(f"\nCACHÉ PREGUNTA->CONSULTA: {qc_stats['hits']} aciertos ({qc_stats['similar_hits']} por similitud), "
+              f"{qc_stats['misses']} fallos, {qc_stats['entries']} entradas")
+    ex_stats = example_store_stats()
+    if ex_stats:
+        entries = ", ".join(f"{backend}: {count}" for backend, count in ex_stats["entries"].items())
+        print(f"\nEJEMPLOS FEW-SHOT: {entries} ({ex_stats['index_bytes'] / 1024:.1f} KB de índice), "
+              f"{ex_stats['retrievals']} búsquedas, media {ex_stats['avg_retrieval_ms']:.2f}ms, "
+              f"máxima {ex_stats['max_retrieval_ms']:.2f}ms")
+    rc_stats = result_cache_stats()
+    if rc_stats:
+        print(f"\nCACHÉ DE RESULTADOS: {rc_stats['hits']} aciertos, {rc_stats['misses']} fallos, "
+              f"{rc_stats['entries']} entradas ({rc_stats['bytes'] / 1024:.1f} KB), "
+              f"{rc_stats['invalidations']} invalidaciones")
+    mongo_stats = mongo_client_stats()
+    if mongo_stats:
+        print(f"\nCLIENTES MONGO: creados {mongo_stats['clients_created']}, reutilizados {mongo_stats['clients_reused']}")
+        for uri, conns in mongo_stats["connections"].items():
+            print(f"  {uri}: conexiones creadas {conns['connections_created']}, reutilizadas {conns['connections_reused']}")
     print(f"{'=' * 60}")
 
 if __name__ == "__main__":
-    evaluate()
+    parser = argparse.ArgumentParser(description="Evaluación de los agentes SQL y MongoDB")
+    parser.add_argument("--concurrency", type=int, default=env_int("EVAL_CONCURRENCY", 1),
+                        help="Casos ejecutados a la vez (por defecto 1: secuencial)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_CASE_TIMEOUT,
+                        help="Tiempo máximo por caso en segundos")
+    args = parser.parse_args()
+    try:
+        evaluate(concurrency=max(1, args.concurrency), timeout=args.timeout)
+    finally:
+        shutdown_result_cache()
+        shutdown_sql_contexts()
+        shutdown_mongo_clients()
@@ -1,18 +1,27 @@
 import customtkinter as ctk
 import os
 import threading
-import re
-from src.utils.encoding_utils import safe_load_dotenv
-from src.agents.sql_agent import run_sql_agent
-from src.agents.mongo_agent import run_mongo_agent
+from src.utils.config import load_config
+from src.agents.backends import load_backend, preload_backend, shutdown_backends
+from src.agents.streaming import ANSWER_TOKEN, DONE, QUERY_GENERATED, ROWS_FETCHED
+from src.agents.llm_context import model_status, start_model_warmup
+from src.ui.chat_view import ChatView
+from src.ui.request_queue import JOB_FAILED, JOB_STARTED, PENDING, QueueFullError, RequestQueue
 
 # Configuración Inicial
-safe_load_dotenv(verbose=True)
+load_config(verbose=True)
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 ctk.set_widget_scaling(1.0)  # Fix for "too big" UI
 ctk.set_window_scaling(1.0)  # Fix for "too big" UI
 
+# Etiqueta del selector -> backend de src.agents.backends
+DB_BACKENDS = {"PostgreSQL": "postgres", "MongoDB": "mongo"}
+DB_LABELS = {backend: label for label, backend in DB_BACKENDS.items()}
+
+# Refresco de los cronómetros de la cola de consultas
+QUEUE_TICK_MS = 500
+
 class DatabaseAgentApp(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -41,18 +50,29 @@ class DatabaseAgentApp(ctk.CTk):
             self.header_frame, 
             values=["PostgreSQL", "MongoDB"], 
             variable=self.db_var, 
-            command=self.change_db_color,
+            command=self.change_db,
             font=(self.FONT_MAIN, 13, "bold")
         )
         self.db_selector.pack(side="right", padx=20, pady=15)
 
-        # 2. Chat Area
-        self.chat_scroll = ctk.CTkScrollableFrame(self, fg_color="transparent")
-        self.chat_scroll.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+        self.model_label = ctk.CTkLabel(self.header_frame, text="", text_color="gray", font=(self.FONT_MAIN, 11))
+        self.model_label.pack(side="right", padx=10, pady=15)
+
+        # 2. Chat Area (virtualizada: solo las burbujas visibles existen como widgets)
+        self.chat_view = ChatView(self, font_main=self.FONT_MAIN, font_mono=self.FONT_MONO)
+        self.chat_view.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
 
-        # 3. Input Area
+        # 3. Cola de consultas (una línea por pregunta en cola o en curso; oculta si no hay ninguna)
+        self.queue_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.queue_frame.grid(row=2, column=0, padx=20, pady=(0, 5), sticky="ew")
+        self.queue_frame.grid_remove()
+        self.job_labels = {}
+        self._queue_ticking = False
+        self.requests = RequestQueue(self._run_job, self._wake_pump)
+
+        # 4. Input Area
         self.input_frame = ctk.CTkFrame(self, height=80, fg_color="transparent")
-        self.input_frame.grid(row=2, column=0, padx=20, pady=(0, 20), sticky="ew")
+        self.input_frame.grid(row=3, column=0, padx=20, pady=(0, 20), sticky="ew")
         self.input_frame.grid_columnconfigure(0, weight=1)
 
         self.input_entry = ctk.CTkEntry(
@@ -80,159 +100,61 @@ class DatabaseAgentApp(ctk.CTk):
         self.status_label = ctk.CTkLabel(self.input_frame, text="", text_color="gray", font=(self.FONT_MAIN, 11))
         self.status_label.grid(row=1, column=0, columnspan=2, sticky="w", padx=10, pady=(5, 0))
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
         # Bienvenida
         self.add_message("Sistema", "**Sistema**: Bienvenido. Selecciona la base de datos y escribe tu consulta.", "system")
 
+        # Carga del modelo en segundo plano: la primera pregunta no paga el arranque de Ollama
+        start_model_warmup()
+        self._poll_model_status()
+        # El agente seleccionado se importa con la ventana ya visible; el otro, al elegirlo
+        preload_backend(DB_BACKENDS[self.db_var.get()])
+
+    def on_close(self):
+        # Cancelar las preguntas en cola, detener los listeners y cerrar los pools compartidos
+        self.requests.shutdown()
+        shutdown_backends()
+        self.destroy()
+
+    def _poll_model_status(self):
+        # ollama ps es una llamada HTTP: fuera del hilo de la interfaz
+        def worker():
+            status = model_status()
+            try:
+                self.after(0, lambda: self._show_model_status(status))
+            except RuntimeError:
+                pass  # ventana ya cerrada
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _show_model_status(self, status):
+        if status["resident"]:
+            text, color = f"{status['model']}: cargado", "green"
+        elif status["state"] == "warming":
+            text, color = f"{status['model']}: cargando...", "orange"
+        elif status["resident"] is None:
+            text, color = f"{status['model']}: Ollama no responde", "red"
+        else:
+            text, color = f"{status['model']}: no cargado", "gray"
+        self.model_label.configure(text=text, text_color=color)
+        # Más frecuente mientras carga; después basta con detectar descargas
+        self.after(2000 if status["state"] == "warming" else 30000, self._poll_model_status)
+
+    def change_db(self, value):
+        preload_backend(DB_BACKENDS[value])
+        self.change_db_color(value)
+
     def change_db_color(self, value):
         if value == "MongoDB":
             self.db_selector.configure(selected_color="#00ed64", selected_hover_color="#00c050", text_color="white")
         else:
             self.db_selector.configure(selected_color="#336791", selected_hover_color="#28527a", text_color="white")
 
-    def render_rich_text(self, textbox, markdown_text):
-        """Simple markdown parser for CTkTextbox."""
-        textbox.configure(state="normal")
-        textbox.delete("1.0", "end")
-        
-        # Normalize line endings
-        markdown_text = markdown_text.replace('\r\n', '\n')
-        
-        # Configure Tags via underlying tk widget
-        # RESTORING READABLE SIZES (approx 13-14px)
-        textbox._textbox.tag_config("bold", font=(self.FONT_MAIN, 13, "bold"))
-        textbox._textbox.tag_config("italic", font=(self.FONT_MAIN, 13, "italic"))
-        textbox._textbox.tag_config("header", font=(self.FONT_MAIN, 16, "bold"))
-        textbox._textbox.tag_config("code_block", font=(self.FONT_MONO, 12), background="#2b2b2b", foreground="#a5d6a7")
-        textbox._textbox.tag_config("code_inline", font=(self.FONT_MONO, 12), background="#333333", foreground="#e0e0e0")
-        # Removed "normal" tag config, relying on base font set in constructor
-        
-        # Split by tokens pattern
-        pattern = r'(```[\s\S]*?```|\*\*.*?\*\*|`[^`\n]+`|###\s.*?$|\*.*?\*)'
-        tokens = re.split(pattern, markdown_text, flags=re.MULTILINE)
-        
-        for token in tokens:
-            if not token: continue
-            
-            if token.startswith("```") and token.endswith("```"):
-                content = token[3:-3]
-                if content.startswith('\n'): content = content[1:]
-                first_line_end = content.find('\n')
-                if first_line_end != -1 and first_line_end < 20: 
-                     potential_lang = content[:first_line_end].strip()
-                     if potential_lang and " " not in potential_lang:
-                         content = content[first_line_end+1:]
-                textbox.insert("end", f"\n{content}\n", "code_block")
-                
-            elif token.startswith("**") and token.endswith("**"):
-                content = token[2:-2]
-                textbox.insert("end", content, "bold")
-            elif token.startswith("`") and token.endswith("`"):
-                content = token[1:-1]
-                textbox.insert("end", f" {content} ", "code_inline")
-            elif token.startswith("### "):
-                content = token[4:] + "\n"
-                textbox.insert("end", content, "header")
-            elif token.startswith("*") and token.endswith("*"):
-                content = token[1:-1]
-                textbox.insert("end", content, "italic")
-            else:
-                # Insert normal text without specific tag
-                textbox.insert("end", token)
-
-    def add_message(self, sender, text, msg_type="agent"):
-        row = ctk.CTkFrame(self.chat_scroll, fg_color="transparent")
-        row.pack(fill="x", pady=5)
-
-        # Colors & Alignment
-        if msg_type == "user":
-            bg_color = "#1f538d"
-            text_color = "white"
-            side = "right"
-            padx_bubble = (50, 10)
-            font_choice = (self.FONT_MAIN, 13)
-        elif msg_type == "code":
-            bg_color = "black" # Terminal black
-            text_color = "#00ff00" # Hacker green
-            side = "left"
-            padx_bubble = (10, 50)
-            font_choice = (self.FONT_MONO, 13)
-        elif msg_type == "system":
-            bg_color = "transparent"
-            text_color = "gray"
-            side = "top" 
-            padx_bubble = (10, 10)
-            font_choice = (self.FONT_MAIN, 12)
-        elif msg_type == "error":
-            bg_color = "#c62828"
-            text_color = "white"
-            side = "left"
-            padx_bubble = (10, 50)
-            font_choice = (self.FONT_MAIN, 13)
-        else: # agent
-            bg_color = ("#e0e0e0", "#3a3a3a")
-            text_color = ("black", "white")
-            side = "left"
-            padx_bubble = (10, 50)
-            font_choice = (self.FONT_MAIN, 13)
-
-        # Bubble Container
-        if msg_type == "system":
-            lbl = ctk.CTkLabel(row, text=text, font=(self.FONT_MAIN, 12, "italic"), text_color="gray")
-            lbl.pack(pady=2)
-            return
-
-        bubble = ctk.CTkFrame(row, fg_color=bg_color, corner_radius=16)
-        bubble.pack(side=side, padx=padx_bubble)
-
-        # Rich Text Box inside Bubble
-        # Estimating height typically requires complex logic. 
-        # For simplicity, we create a textbox with a reasonable width and 'auto' height behaviour simulation by lines.
-        lines = text.count('\n') + len(text) // 60 + 1
-        height = min(lines * 22, 400) # Max height limit
-        
-        # Rich Text Box inside Bubble
-        # Dynamic height calculation
-        # 1. Create with arbitrary height
-        # CRITICAL: Pass font here for base text to ensure correct rendering/spacing
-        textbox = ctk.CTkTextbox(
-            bubble, 
-            width=500 if msg_type == "code" else 400, 
-            height=50, 
-            fg_color="transparent", 
-            text_color=text_color,
-            wrap="word",
-            font=font_choice if 'font_choice' in locals() else (self.FONT_MAIN, 13),
-            activate_scrollbars=False 
-        )
-        textbox.pack(padx=10, pady=5)
-        
-        # 2. Render content
-        self.render_rich_text(textbox, text)
-        
-        # 3. Calculate real height
-        textbox.update_idletasks() 
-        try:
-            # Using dlineinfo to find the bottom of the text
-            dline = textbox._textbox.dlineinfo("end-1c")
-            if dline:
-                check_y = dline[1]
-                check_h = dline[3]
-                new_height = check_y + check_h + 15
-            else:
-                # Fallback: Count displaylines (wrapped)
-                count = textbox._textbox.count("1.0", "end", "displaylines") or [0]
-                num_lines = int(count[0])
-                if num_lines == 0: num_lines = text.count('\n') + 1
-                new_height = (num_lines * 18) + 10
-        except Exception:
-            new_height = 50
-        
-        new_height = max(30, new_height)
-        textbox.configure(height=new_height, state="disabled")
-        self.after(50, self._scroll_down)
-
-    def _scroll_down(self):
-        self.chat_scroll._parent_canvas.yview_moveto(1.0)
+    def add_message(self, sender, text, msg_type="agent", markdown=True):
+        """Appends a bubble to the chat and returns its handle in ``ChatView``."""
+        handle = self.chat_view.add(msg_type, text, markdown)
+        self.chat_view.scroll_to_end()
+        return handle
 
     def send_query_event(self, event):
         self.send_query()
@@ -240,52 +162,124 @@ class DatabaseAgentApp(ctk.CTk):
     def send_query(self):
         query = self.input_entry.get().strip()
         if not query: return
-        
+
+        # La entrada sigue activa: se pueden encolar más preguntas mientras se responden las anteriores
+        try:
+            job = self.requests.submit(query, DB_BACKENDS[self.db_var.get()])
+        except QueueFullError as e:
+            self.status_label.configure(text=f"{e}. Espera a que termine alguna.")
+            return
+        job.stream.update(message=None, text="", query_shown=False)
         self.input_entry.delete(0, "end")
-        self.add_message("Tú", f"**{query}**", "user") # User text bold automatically
-        
-        self.status_label.configure(text="Pensando...")
-        self.input_entry.configure(state="disabled")
-        self.send_button.configure(state="disabled")
-        
-        threading.Thread(target=self._process_backend, args=(query,)).start()
+        self.add_message("Tú", f"**#{job.id}** {query}", "user")
+        self._refresh_queue_panel()
+        if not self._queue_ticking:
+            self._queue_ticking = True
+            self.after(QUEUE_TICK_MS, self._tick_queue)
 
-    def _process_backend(self, query):
-        db_type = self.db_var.get()
+    def _run_job(self, job):
+        # Hilo del executor: si la precarga aún no terminó, espera a que el módulo acabe de importarse
+        return load_backend(job.backend)(job.query)
+
+    def _wake_pump(self):
+        # Llamado desde un hilo de trabajo cuando la bandeja de eventos deja de estar vacía
         try:
-            if db_type == "PostgreSQL":
-                result = run_sql_agent(query)
+            self.after(0, self._pump_events)
+        except RuntimeError:
+            pass  # ventana ya cerrada
+
+    def _pump_events(self):
+        """Applies a batch of worker events; re-schedules itself if the inbox is not empty."""
+        batch, remaining = self.requests.drain()
+        for job, ev in batch:
+            self._on_event(job, ev)
+        if batch:
+            self._refresh_queue_panel()
+        if remaining:
+            # Deja respirar al bucle de Tk (repintado, teclado) entre lotes
+            self.after(10, self._pump_events)
+
+    def _tick_queue(self):
+        self._refresh_queue_panel()
+        if self.requests.active():
+            self.after(QUEUE_TICK_MS, self._tick_queue)
+        else:
+            self._queue_ticking = False
+
+    def _refresh_queue_panel(self):
+        """One status line per pending/running question, with its elapsed time."""
+        jobs = self.requests.active()
+        for job_id in [i for i in self.job_labels if i not in {job.id for job in jobs}]:
+            self.job_labels.pop(job_id).destroy()
+        for job in jobs:
+            label = self.job_labels.get(job.id)
+            if label is None:
+                label = ctk.CTkLabel(self.queue_frame, text="", anchor="w", font=(self.FONT_MAIN, 11))
+                label.pack(fill="x", padx=10)
+                self.job_labels[job.id] = label
+            question = job.query if len(job.query) <= 60 else job.query[:57] + "..."
+            if job.state == PENDING:
+                text, color = f"⏳ #{job.id} [{DB_LABELS[job.backend]}] en cola · {job.waited():.0f}s — {question}", "gray"
             else:
-                result = run_mongo_agent(query)
-            
-            self.after(0, lambda: self._on_response(result))
-        except Exception as e:
-            self.after(0, lambda: self._on_error(str(e)))
-
-    def _on_response(self, result):
-        self.status_label.configure(text="")
-        self.input_entry.configure(state="normal")
-        self.send_button.configure(state="normal")
-        self.input_entry.focus()
-
-        # Mostrar Código (si existe)
-        if result.get("sql_queries"):
+                text, color = f"▶ #{job.id} [{DB_LABELS[job.backend]}] {job.stage} · {job.elapsed():.1f}s — {question}", ("#1f538d", "#7ab8ff")
+            label.configure(text=text, text_color=color)
+
+        if jobs:
+            self.queue_frame.grid()
+            counts = self.requests.counts()
+            self.status_label.configure(text=f"{counts['running']} en curso, {counts['pending']} en cola")
+        else:
+            self.queue_frame.grid_remove()
+            self.status_label.configure(text="")
+
+    def _on_event(self, job, ev):
+        stream = job.stream
+        if ev["type"] == JOB_STARTED:
+            job.stage = "iniciando"
+        elif ev["type"] == QUERY_GENERATED:
+            stream["query_shown"] = True
+            # Enviamos raw code para que use el estilo 'code' de add_message
+            label = "Rewritten Query (cheaper plan)" if ev.get("rewritten") else "Generated Query"
+            if ev.get("fast_path"):
+                label = "Fast Path Query (no LLM)"
+            self.add_message("System", f"> #{job.id} {label}:\n{ev['query']}", "code")
+            job.stage = "consultando base de datos"
+        elif ev["type"] == ROWS_FETCHED:
+            job.stage = "redactando respuesta"
+        elif ev["type"] == ANSWER_TOKEN:
+            # Los tokens llegan ya agrupados por lote; texto plano mientras llega
+            job.stage = "respondiendo"
+            stream["text"] += ev["text"]
+            if stream["message"] is None:
+                stream["message"] = self.add_message("Agent", f"#{job.id} · {stream['text']}", "agent", markdown=False)
+            else:
+                self.chat_view.append_text(stream["message"], ev["text"])
+        elif ev["type"] == DONE:
+            self._on_response(job, ev["result"])
+        elif ev["type"] == JOB_FAILED:
+            self._on_error(job, ev["error"])
+
+    def _on_response(self, job, result):
+        stream = job.stream
+        # Mostrar Código (si existe y no se mostró ya durante el streaming)
+        if result.get("sql_queries") and not stream["query_shown"]:
             for code in result["sql_queries"]:
                 # Enviamos raw code para que use el estilo 'code' de add_message
-                self.add_message("System", f"> Generated Query:\n{code}", "code")
+                self.add_message("System", f"> #{job.id} Generated Query:\n{code}", "code")
 
         # Mostrar Respuesta
         if result.get("error"):
-             self.add_message("System", f"**Error**: {result['error']}", "error")
+             self.add_message("System", f"**Error (#{job.id})**: {result['error']}", "error")
+        elif stream["message"] is not None:
+             # Render final con markdown sobre la burbuja que se fue llenando
+             answer = result.get("answer", stream["text"])
+             self.chat_view.set_text(stream["message"], f"**#{job.id}** · {answer}")
         else:
              answer = result.get("answer", "Sin respuesta")
-             self.add_message("Agent", answer, "agent")
+             self.add_message("Agent", f"**#{job.id}** · {answer}", "agent")
 
-    def _on_error(self, error_msg):
-        self.status_label.configure(text="Error")
-        self.input_entry.configure(state="normal")
-        self.send_button.configure(state="normal")
-        self.add_message("System", f"**Crash**: {error_msg}", "error")
+    def _on_error(self, job, error_msg):
+        self.add_message("System", f"**Crash (#{job.id})**: {error_msg}", "error")
 
 if __name__ == "__main__":
     app = DatabaseAgentApp()
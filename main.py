@@ -1,60 +1,138 @@
-import os
-import argparse
+import time
+_IMPORT_START = time.perf_counter()
 
-# IMPORTANTE: Importar psycopg2_fix ANTES de cualquier agente que use psycopg2
-from src.utils import psycopg2_fix
+import argparse
 
-from src.utils.encoding_utils import safe_load_dotenv
-from src.agents.sql_agent import run_sql_agent
-from src.agents.mongo_agent import run_mongo_agent
+# Los agentes (y psycopg2_fix, que importa el agente SQL) se cargan al seleccionar cada base de datos
+from src.agents.backends import load_backend, shutdown_backends
+from src.agents.streaming import ANSWER_TOKEN, DONE, QUERY_GENERATED, ROWS_FETCHED
+from src.agents.llm_context import model_status, start_model_warmup
+from src.utils.config import load_config
+from src.utils.startup import StartupTimer, format_breakdown, import_breakdown, TARGETS
 from colorama import init, Fore, Style
 
+startup = StartupTimer(started=_IMPORT_START)
+startup.record("imports", time.perf_counter() - _IMPORT_START)
+
 # Initialize colorama
 init(autoreset=True)
 
-safe_load_dotenv(verbose=True)
+with startup.phase("config (.env)"):
+    load_config(verbose=True)
+
+DB_NAMES = {"postgres": "PostgreSQL", "mongo": "MongoDB"}
+
+
+def select_backend(db_type: str):
+    """Loads the backend the first time it is selected and reports how long that took."""
+    start = time.perf_counter()
+    load_backend(db_type)
+    elapsed = time.perf_counter() - start
+    if elapsed > 0.01:
+        startup.record(f"backend {db_type}", elapsed)
+        print(f"{Fore.WHITE}(agente {DB_NAMES[db_type]} cargado en {elapsed:.2f}s){Style.RESET_ALL}")
+
+
+def print_startup_report(db_type: str):
+    """Startup phases of this process plus an -X importtime breakdown of main and the backend."""
+    print(f"{Fore.CYAN}--- Tiempos de arranque ---{Style.RESET_ALL}")
+    print("\n".join(startup.report()))
+    for target in ("main", db_type):
+        try:
+            print("\n".join(format_breakdown(target, import_breakdown(TARGETS[target]))))
+        except RuntimeError as e:
+            print(f"{Fore.RED}{e}")
+    print()
+
 
 def process_query(query: str, db_type: str = "postgres"):
-    """Processes a single query and prints the output."""
+    """Processes a single query and prints the output as it is produced."""
     # Silent execution, only output results
     
     if db_type == "postgres":
         print(f"{Fore.BLUE}Using PostgreSQL Agent...{Style.RESET_ALL}")
-        result = run_sql_agent(query)
+        events = load_backend(db_type)(query)
     elif db_type == "mongo":
         print(f"{Fore.GREEN}Using MongoDB Agent...{Style.RESET_ALL}")
-        result = run_mongo_agent(query)
+        events = load_backend(db_type)(query)
     else:
         print(f"{Fore.RED}Unknown DB type: {db_type}")
         return
 
-    if result.get("error"):
-        print(f"{Fore.RED}Error: {result['error']}")
-    else:
-        if result.get("sql_queries"):
-            title = "Consulta Generada (SQL)" if db_type == "postgres" else "Código Generado (PyMongo)"
+    answer_started = False
+    for ev in events:
+        if ev["type"] == QUERY_GENERATED:
+            title = "Consulta Generada (SQL)" if db_type == "postgres" else "Consulta Generada (MongoDB)"
+            if ev.get("rewritten"):
+                title = "Consulta Reescrita (el plan original superaba el coste máximo)"
+            elif ev.get("fast_path"):
+                title += " - camino rápido, sin LLM"
             print(f"\n{Fore.CYAN}--- {title} ---{Style.RESET_ALL}")
-            for sql in result["sql_queries"]:
-                print(f"{Fore.YELLOW}{sql}")
-        
-        if result.get("raw_results"):
+            print(f"{Fore.YELLOW}{ev['query']}")
+
+        elif ev["type"] == ROWS_FETCHED:
             print(f"\n{Fore.CYAN}--- Respuesta Raw ---{Style.RESET_ALL}")
-            for res in result["raw_results"]:
-                print(f"{Fore.WHITE}{res}")
+            if ev["from_cache"]:
+                print(f"{Fore.MAGENTA}(resultado servido desde caché){Style.RESET_ALL}")
+            print(f"{Fore.WHITE}{ev['raw_result']}")
+            if ev.get("more_rows"):
+                print(f"{Fore.MAGENTA}(hay más filas disponibles; se alcanzó el límite SQL_MAX_ROWS){Style.RESET_ALL}")
+
+        elif ev["type"] == ANSWER_TOKEN:
+            # Los tokens se imprimen según llegan: el usuario ve la respuesta desde el primer token
+            if not answer_started:
+                print(f"\n{Fore.CYAN}--- Interpretación ---{Style.RESET_ALL}")
+                answer_started = True
+            print(f"{Fore.GREEN}{ev['text']}", end="", flush=True)
+
+        elif ev["type"] == DONE:
+            result = ev["result"]
+            if answer_started:
+                print("\n")
+            if result.get("error"):
+                print(f"{Fore.RED}Error: {result['error']}")
 
-        print(f"\n{Fore.CYAN}--- Interpretación ---{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}{result['answer']}\n")
+
+def print_model_status():
+    """Prints the Ollama model state and whether it is loaded in memory."""
+    status = model_status()
+    resident = {True: "cargado en memoria", False: "no cargado", None: "Ollama no responde"}[status["resident"]]
+    print(f"{Fore.WHITE}Modelo: {Fore.YELLOW}{status['model']}{Fore.WHITE} - estado: {status['state']} ({resident})")
+    if status.get("expires_at"):
+        print(f"  Se descargará: {status['expires_at']} (keep_alive {status['keep_alive']})")
+    if status["warm_up_seconds"] is not None:
+        print(f"  Carga inicial: {status['warm_up_seconds']:.2f}s")
+    if status["error"]:
+        print(f"{Fore.RED}  Error: {status['error']}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Agente de Base de Datos LLM (PostgreSQL + MongoDB + Ollama)")
     parser.add_argument("--query", type=str, required=False, help="Consulta en lenguaje natural (opcional)")
     parser.add_argument("--db", type=str, default="postgres", choices=["postgres", "mongo"], help="Base de datos a usar (postgres o mongo)")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Muestra los tiempos de arranque y el desglose de importaciones (-X importtime)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Arranca el servicio HTTP (JSON y SSE) compartido por varios clientes")
+    parser.add_argument("--port", type=int, default=None, help="Puerto del servicio HTTP (SERVE_PORT, por defecto 8000)")
     
     args = parser.parse_args()
+
+    if args.serve:
+        from src.server import serve
+        serve(port=args.port)
+        return
     
     current_db = args.db
 
+    # El modelo se carga en segundo plano mientras se prepara el esquema o se escribe la pregunta
+    with startup.phase("model warm-up start"):
+        start_model_warmup()
+    select_backend(current_db)
+
+    if args.startup_report:
+        print_startup_report(current_db)
+
     # Single-shot mode
     if args.query:
         process_query(args.query, current_db)
@@ -64,6 +142,7 @@ def main():
     print(f"{Fore.MAGENTA}Agente de Base de Datos LLM (Modo Interactivo)")
     print(f"{Fore.WHITE}Base de datos actual: {Fore.YELLOW}{current_db.upper()}")
     print(f"Escribe 'switch mongo' o 'switch postgres' para cambiar de DB.")
+    print(f"Escribe 'estado' para ver si el modelo está cargado.")
     print(f"Escribe 'salir' o 'exit' para terminar.\n")
     
     while True:
@@ -77,13 +156,19 @@ def main():
                 print(f"{Fore.MAGENTA}¡Hasta la vista!")
                 break
             
+            if user_input.lower() in ["estado", "status"]:
+                print_model_status()
+                continue
+
             if user_input.lower() in ["switch mongo", "use mongo"]:
                 current_db = "mongo"
+                select_backend(current_db)
                 print(f"{Fore.YELLOW}Cambiado a MongoDB.{Style.RESET_ALL}")
                 continue
                 
             if user_input.lower() in ["switch postgres", "use postgres"]:
                 current_db = "postgres"
+                select_backend(current_db)
                 print(f"{Fore.YELLOW}Cambiado a PostgreSQL.{Style.RESET_ALL}")
                 continue
 
@@ -96,4 +181,8 @@ def main():
             print(f"{Fore.RED}Ocurrió un error: {e}")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Detener los listeners de cambios y cerrar los pools compartidos de los backends cargados
+        shutdown_backends()
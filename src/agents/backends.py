@@ -0,0 +1,74 @@
+"""
+Lazy loading of the database backends.
+
+Importing an agent pulls in its whole stack: SQLAlchemy, psycopg2 and sqlglot
+for PostgreSQL, pymongo for MongoDB, plus the LLM client. The CLI and the GUI
+import this module instead. A backend is imported the first time it is selected
+(``--db``, ``switch mongo``, the GUI selector), so starting with PostgreSQL
+never loads pymongo and vice versa.
+"""
+import importlib
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator
+
+# backend -> (módulo, función de streaming)
+BACKENDS = {
+    "postgres": ("src.agents.sql_agent", "stream_sql_agent"),
+    "mongo": ("src.agents.mongo_agent", "stream_mongo_agent"),
+}
+
+# Se ejecutan solo si el módulo llegó a importarse: cerrar no debe cargar un backend
+SHUTDOWN_HOOKS = (
+    ("src.agents.result_cache", "shutdown_result_cache"),
+    ("src.agents.query_cache", "flush_query_cache"),
+    ("src.agents.sql_context", "shutdown_sql_contexts"),
+    ("src.agents.mongo_context", "shutdown_mongo_clients"),
+    ("src.agents.llm_context", "shutdown_model_manager"),
+)
+
+_load_seconds: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def load_backend(name: str) -> Callable[[str], Iterator[dict]]:
+    """
+    Imports a backend on first use and returns its streaming agent function.
+
+    Args:
+        name: ``"postgres"`` or ``"mongo"``.
+
+    Raises:
+        ValueError: For an unknown backend.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown DB type: {name}")
+    module_name, function = BACKENDS[name]
+    # import_module siempre: si otro hilo está importando el módulo, espera a que termine
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    with _lock:
+        _load_seconds.setdefault(name, time.perf_counter() - start)
+    return getattr(module, function)
+
+
+def preload_backend(name: str) -> threading.Thread:
+    """Imports a backend in a background thread, e.g. while the user is still typing."""
+    thread = threading.Thread(target=load_backend, args=(name,), name=f"load-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def backend_load_times() -> Dict[str, float]:
+    """Seconds each loaded backend took to import in this process."""
+    with _lock:
+        return dict(_load_seconds)
+
+
+def shutdown_backends():
+    """Closes pools, listeners and the keep-alive thread of whatever was loaded."""
+    for module_name, function in SHUTDOWN_HOOKS:
+        module = sys.modules.get(module_name)
+        if module is not None:
+            getattr(module, function)()
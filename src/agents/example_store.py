@@ -0,0 +1,275 @@
+"""
+Few-shot examples for the generation prompts, retrieved from verified history.
+
+Every (question, query) pair that executed successfully in normal use is
+stored in a local SQLite file. ``evaluation/evaluate.py`` stores its cases as
+``SOURCE_EVALUATION`` only when the result matches the expected answer; the
+rest are kept as ``SOURCE_UNVERIFIED``, which is never retrieved. Each
+question is also embedded as a hashed bag of word unigrams, word bigrams and
+character trigrams. The vectors live in one L2-normalized NumPy matrix per
+backend, so retrieving the top-k most similar examples is a single
+matrix-vector product. New pairs are appended as new rows (the matrix grows
+by doubling), so adding an example never rebuilds the index.
+
+Tuning: ``EXAMPLES_TOP_K``, ``EXAMPLES_MIN_SIMILARITY`` (percent),
+``EXAMPLES_MAX_ENTRIES`` and ``EXAMPLES_HASH_DIM``.
+"""
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from src.agents.query_cache import normalize_question
+from src.agents.schema_cache import default_cache_dir
+from src.utils.config import env_int
+
+SOURCE_RUNTIME = "runtime"
+SOURCE_EVALUATION = "evaluation"
+# Se ejecutó pero nadie comprobó el resultado: se guarda, pero nunca se usa como ejemplo
+SOURCE_UNVERIFIED = "unverified"
+
+
+class Example(NamedTuple):
+    question: str
+    query: str
+    similarity: float
+
+
+def question_features(question: str, dim: int) -> np.ndarray:
+    """Hashed, L2-normalized feature vector of a question (stable across processes)."""
+    vector = np.zeros(dim, dtype=np.float32)
+    words = normalize_question(question).split()
+    features = list(words)
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f" {word} "
+        features += [f"#{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    for feature in features:
+        # crc32 en lugar de hash(): los vectores deben coincidir entre procesos
+        vector[zlib.crc32(feature.encode("utf-8")) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        # TF sublineal para que una palabra repetida no domine
+        vector = np.log1p(vector)
+        vector /= np.linalg.norm(vector)
+    return vector
+
+
+class _BackendIndex:
+    """Growable matrix of question vectors plus the matching (normalized, question, query) rows."""
+
+    def __init__(self, dim: int):
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.rows: List[list] = []
+        self.positions: Dict[str, int] = {}
+
+    def upsert(self, normalized: str, question: str, query: str, vector: np.ndarray, created_at: float):
+        position = self.positions.get(normalized)
+        if position is None:
+            position = len(self.rows)
+            if position == self.matrix.shape[0]:
+                self.matrix = np.vstack([self.matrix, np.zeros_like(self.matrix)])
+            self.rows.append(None)
+            self.positions[normalized] = position
+        self.matrix[position] = vector
+        self.rows[position] = [normalized, question, query, created_at]
+
+    def remove(self, normalized: str):
+        position = self.positions.pop(normalized, None)
+        if position is None:
+            return
+        # Se mueve la última fila al hueco: sin reconstruir la matriz
+        last = len(self.rows) - 1
+        if position != last:
+            self.matrix[position] = self.matrix[last]
+            self.rows[position] = self.rows[last]
+            self.positions[self.rows[position][0]] = position
+        self.matrix[last] = 0.0
+        self.rows.pop()
+
+    def oldest(self) -> Optional[str]:
+        if not self.rows:
+            return None
+        return min(self.rows, key=lambda row: row[3])[0]
+
+
+def format_examples(examples: List[Example], language: str) -> str:
+    """Prompt block with the retrieved examples ('' if there are none)."""
+    if not examples:
+        return ""
+    blocks = [f"Pregunta: {ex.question}\n```{language}\n{ex.query}\n```" for ex in examples]
+    return "EJEMPLOS VERIFICADOS (preguntas parecidas y su consulta correcta):\n" + "\n".join(blocks) + "\n\n"
+
+
+class ExampleStore:
+    """
+    Verified (question, query) pairs per backend with top-k similarity retrieval.
+
+    Args:
+        path: SQLite file. None keeps the examples in memory only.
+        dim: Hashed feature dimension (``EXAMPLES_HASH_DIM``).
+        max_entries: Examples kept per backend (``EXAMPLES_MAX_ENTRIES``); the oldest go first.
+    """
+
+    def __init__(self, path: Optional[Path] = None, dim: Optional[int] = None,
+                 max_entries: Optional[int] = None):
+        self.dim = dim if dim is not None else env_int("EXAMPLES_HASH_DIM", 1024)
+        self.max_entries = max_entries if max_entries is not None else env_int("EXAMPLES_MAX_ENTRIES", 2000)
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _BackendIndex] = {}
+        # evaluate.py lo desactiva: sus casos solo entran si se comprueba el resultado
+        self.record_runtime = True
+        self.retrievals = 0
+        self.retrieval_seconds = 0.0
+        self.max_retrieval_seconds = 0.0
+        self._conn = None
+        if path is not None:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS examples ("
+                " backend TEXT, normalized TEXT, question TEXT, query TEXT, source TEXT, created_at REAL,"
+                " PRIMARY KEY (backend, normalized))"
+            )
+            self._conn.commit()
+            self._load()
+
+    def add(self, backend: str, question: str, query: str, source: str = SOURCE_RUNTIME):
+        """
+        Adds (or replaces) the query for ``question``; incremental, no rebuild.
+
+        With ``SOURCE_UNVERIFIED`` the pair is only persisted, and it replaces
+        any retrievable example for the same question.
+        """
+        normalized = normalize_question(question)
+        if not normalized or not query or (source == SOURCE_RUNTIME and not self.record_runtime):
+            return
+        vector = question_features(question, self.dim)
+        now = time.time()
+        with self._lock:
+            index = self._indexes.setdefault(backend, _BackendIndex(self.dim))
+            if source == SOURCE_UNVERIFIED:
+                index.remove(normalized)
+            else:
+                index.upsert(normalized, question, query, vector, now)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO examples VALUES (?, ?, ?, ?, ?, ?)",
+                    (backend, normalized, question, query, source, now),
+                )
+            while len(index.rows) > self.max_entries:
+                self._delete(backend, index, index.oldest())
+            if self._conn is not None:
+                self._conn.commit()
+
+    def discard(self, backend: str, query: str):
+        """Removes every example whose query stopped working."""
+        with self._lock:
+            index = self._indexes.get(backend)
+            if index is None:
+                return
+            for normalized in [row[0] for row in index.rows if row[2] == query]:
+                self._delete(backend, index, normalized)
+            if self._conn is not None:
+                self._conn.commit()
+
+    def search(self, backend: str, question: str, k: Optional[int] = None,
+               min_similarity: Optional[int] = None) -> List[Example]:
+        """
+        Most similar verified examples for ``question``, best first.
+
+        Args:
+            backend: ``postgres`` or ``mongo``.
+            question: User question.
+            k: Examples returned at most (``EXAMPLES_TOP_K``).
+            min_similarity: Minimum cosine similarity in percent (``EXAMPLES_MIN_SIMILARITY``).
+        """
+        k = k if k is not None else env_int("EXAMPLES_TOP_K", 3)
+        threshold = (min_similarity if min_similarity is not None
+                     else env_int("EXAMPLES_MIN_SIMILARITY", 30)) / 100.0
+        start = time.perf_counter()
+        vector = question_features(question, self.dim)
+        with self._lock:
+            index = self._indexes.get(backend)
+            examples = []
+            if index is not None and index.rows and k > 0:
+                scores = index.matrix[:len(index.rows)] @ vector
+                top = np.argsort(-scores)[:k]
+                examples = [
+                    Example(index.rows[i][1], index.rows[i][2], float(scores[i]))
+                    for i in top if scores[i] >= threshold
+                ]
+            elapsed = time.perf_counter() - start
+            self.retrievals += 1
+            self.retrieval_seconds += elapsed
+            self.max_retrieval_seconds = max(self.max_retrieval_seconds, elapsed)
+        return examples
+
+    def size(self, backend: Optional[str] = None) -> int:
+        with self._lock:
+            indexes = [self._indexes.get(backend)] if backend else list(self._indexes.values())
+            return sum(len(index.rows) for index in indexes if index is not None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            avg = self.retrieval_seconds / self.retrievals if self.retrievals else 0.0
+            return {
+                "entries": {backend: len(index.rows) for backend, index in self._indexes.items()},
+                "index_bytes": sum(index.matrix.nbytes for index in self._indexes.values()),
+                "retrievals": self.retrievals,
+                "avg_retrieval_ms": round(avg * 1000, 3),
+                "max_retrieval_ms": round(self.max_retrieval_seconds * 1000, 3),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _delete(self, backend: str, index: _BackendIndex, normalized: Optional[str]):
+        if normalized is None:
+            return
+        index.remove(normalized)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM examples WHERE backend = ? AND normalized = ?", (backend, normalized))
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT backend, normalized, question, query, created_at FROM examples"
+            " WHERE source IS NOT ? ORDER BY created_at",
+            (SOURCE_UNVERIFIED,),
+        ).fetchall()
+        for backend, normalized, question, query, created_at in rows:
+            index = self._indexes.setdefault(backend, _BackendIndex(self.dim))
+            index.upsert(normalized, question, query, question_features(question, self.dim), created_at)
+        for backend, index in self._indexes.items():
+            while len(index.rows) > self.max_entries:
+                self._delete(backend, index, index.oldest())
+        self._conn.commit()
+
+
+_store: Optional[ExampleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_example_store() -> ExampleStore:
+    """Process-wide store persisted to ``CACHE_DIR/examples.sqlite3``."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ExampleStore(default_cache_dir() / "examples.sqlite3")
+    return _store
+
+
+def example_store_stats() -> dict:
+    """Statistics of the process-wide store (empty if it was never used)."""
+    if _store is None:
+        return {}
+    return _store.stats()
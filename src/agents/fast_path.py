@@ -0,0 +1,440 @@
+"""
+Deterministic fast path for simple aggregate questions, answered without the LLM.
+
+Many questions are a single aggregate over one table or collection
+("¿Cuántos pedidos hay en total?", "¿Cuál es el importe total de todos los
+pedidos?", "¿Cuál es el precio medio de los productos?"), optionally filtered
+by column values ("¿Cuántos pedidos con estado 'Shipped' hay?").
+``FastPathMatcher.match`` recognizes those Spanish patterns against the
+cached schema, using the same stems and Spanish-English vocabulary as the schema
+index. It matches only if every word of the question is explained by the
+intent, the table, the columns, the filter values or filler words; anything
+else (grouping, comparisons, joins, dates) goes to the LLM as usual.
+
+A match becomes SQL (``to_sql``) or a MongoDB spec (``to_mongo_spec``), and the
+answer comes from a template (``format_answer``). The whole fast path runs
+in milliseconds plus one database query. Results carry ``fast_path: True``
+and ``FastPathStats`` counts coverage per backend.
+
+Filter values are compared literally (case-insensitively), so a value phrased
+differently from the stored one ("enviado" for 'Shipped') selects no rows. A
+filtered match whose aggregate comes back empty (zero count, NULL) is
+therefore not reported as a fact: ``answers_question`` turns it into a miss
+and the question goes to the LLM, which sees the actual values.
+
+``FAST_PATH=0`` disables it.
+"""
+import re
+import threading
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from src.agents.query_cache import STOPWORDS, fold_text
+from src.agents.schema_index import tokenize
+from src.agents.streaming import ANSWER_TOKEN, DONE, QUERY_GENERATED, ROWS_FETCHED, event
+from src.utils.config import env_int
+
+COUNT, SUM, AVG, MIN, MAX = "count", "sum", "avg", "min", "max"
+
+NUMBER, TEXT = "number", "text"
+
+_COUNT_WORDS = {"cuantos", "cuantas", "numero", "contar", "cuenta"}
+_SUM_WORDS = {"suma", "sumar", "sumatorio", "sumatoria"}
+_AVG_WORDS = {"media", "medio", "promedio"}
+_MAX_WORDS = {"maximo", "maxima", "mayor"}
+_MIN_WORDS = {"minimo", "minima", "menor"}
+_HIGH_WORDS = {"alto", "alta", "caro", "cara", "grande", "elevado", "elevada"}
+_LOW_WORDS = {"bajo", "baja", "barato", "barata", "pequeno", "pequena"}
+# "total" solo es suma si acompaña a una columna numérica ("importe total"); si no, es un conteo
+_WEAK_SUM_WORDS = {"total"}
+
+# Palabras que indican agrupación, comparación, orden o negación: siempre al LLM
+_REJECT_WORDS = {
+    "por", "cada", "agrupado", "agrupados", "segun", "top", "ranking", "mas", "menos", "entre",
+    "desde", "hasta", "antes", "despues", "ultimo", "ultimos", "ultima", "ultimas", "primer",
+    "primero", "primeros", "no", "sin", "excepto", "salvo", "distinto", "distintos", "diferentes",
+    "quien", "quienes", "cuales", "ordenado", "ordenados", "mes", "ano", "dia", "semana", "hoy",
+}
+_FILLER_WORDS = STOPWORDS | {
+    "cual", "total", "todos", "todas", "todo", "tenemos", "tiene", "tienen", "tengan", "existe",
+    "hay", "registrados", "registradas", "registros", "registro", "actualmente", "base", "datos",
+    "tabla", "coleccion", "valor", "sistema", "guardados", "guardadas", "almacenados", "calcula",
+    "calcular", "saber", "quiero", "conocer", "cuyo", "cuya", "cuyos", "cuyas", "donde", "igual",
+    "sea", "sean", "of",
+}
+# Palabras entre el nombre de la columna y su valor ("estado igual a enviado")
+_CONNECTORS = {"es", "sea", "igual", "a", "de", "del", "con", "en", "el", "la", "los", "las", "son", "sean"}
+
+_TOKEN_RE = re.compile(r"'([^']+)'|\"([^\"]+)\"|«([^»]+)»|([\w@-]+(?:[.,]\d+)?)")
+_NUMERIC_TYPES = ("smallint", "integer", "bigint", "int", "numeric", "decimal", "real", "double", "money", "float")
+
+
+class FastPathMatch(NamedTuple):
+    intent: str
+    table: str
+    column: Optional[str]
+    filters: Tuple[Tuple[str, object], ...]
+    noun: str
+
+
+class _Token(NamedTuple):
+    raw: str
+    folded: str
+    stems: frozenset
+    quoted: bool
+
+
+def sql_column_kinds(column_types: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    """``{table: {column: kind}}`` from PostgreSQL types (``SQLAgentContext.schema_column_types``)."""
+    return {
+        table: {col: NUMBER if col_type.lower().startswith(_NUMERIC_TYPES) else TEXT
+                for col, col_type in columns.items()}
+        for table, columns in column_types.items()
+    }
+
+
+def mongo_column_kinds(schema: Dict[str, dict]) -> Dict[str, Dict[str, str]]:
+    """``{collection: {field: kind}}`` from the inferred MongoDB schema (dominant type per field)."""
+    kinds = {}
+    for collection, info in schema.items():
+        fields = {}
+        for path, field in (info.get("fields") or {}).items():
+            types = field.get("types") or []
+            if path == "_id" or not types or types[0] in ("object", "array", "objectId", "binData"):
+                continue
+            fields[path] = NUMBER if types[0] in ("int", "long", "double", "decimal") else TEXT
+        kinds[collection] = fields
+    return kinds
+
+
+def _tokens(question: str) -> List[_Token]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(question):
+        quoted = next((g for g in match.groups()[:3] if g is not None), None)
+        raw = quoted if quoted is not None else match.group(4)
+        folded = fold_text(raw)
+        stems = frozenset(tokenize(raw)) if quoted is None else frozenset()
+        tokens.append(_Token(raw, folded, stems, quoted is not None))
+    return tokens
+
+
+def _intent(tokens: List[_Token]):
+    """(intent, weak, consumed indexes) or None if there is no intent or more than one."""
+    intents = set()
+    weak = False
+    consumed = set()
+    for i, token in enumerate(tokens):
+        word = token.folded
+        if word in _COUNT_WORDS:
+            intents.add(COUNT)
+        elif word in _SUM_WORDS:
+            intents.add(SUM)
+        elif word in _AVG_WORDS:
+            intents.add(AVG)
+        elif word in _MAX_WORDS:
+            intents.add(MAX)
+        elif word in _MIN_WORDS:
+            intents.add(MIN)
+        elif word == "mas" and i + 1 < len(tokens) and tokens[i + 1].folded in _HIGH_WORDS | _LOW_WORDS:
+            intents.add(MAX if tokens[i + 1].folded in _HIGH_WORDS else MIN)
+            consumed.add(i + 1)
+        else:
+            continue
+        consumed.add(i)
+    if not intents and any(t.folded in _WEAK_SUM_WORDS for t in tokens):
+        intents.add(SUM)
+        weak = True
+    if len(intents) != 1:
+        return None
+    return intents.pop(), weak, consumed
+
+
+def _best(candidates: Dict[str, int]) -> Optional[str]:
+    """Name with the highest positive score, or None if there is none or it is tied."""
+    ranked = sorted(candidates.items(), key=lambda item: -item[1])
+    if not ranked or ranked[0][1] <= 0 or (len(ranked) > 1 and ranked[1][1] == ranked[0][1]):
+        return None
+    return ranked[0][0]
+
+
+class FastPathMatcher:
+    """
+    Recognizes simple aggregate questions over one schema.
+
+    Args:
+        kinds: ``{table: {column: NUMBER | TEXT}}`` (``sql_column_kinds`` / ``mongo_column_kinds``).
+        fingerprint: Schema fingerprint the kinds belong to.
+    """
+
+    def __init__(self, kinds: Dict[str, Dict[str, str]], fingerprint: Optional[str] = None):
+        self.kinds = kinds
+        self.fingerprint = fingerprint
+        self._table_stems = {table: frozenset(tokenize(table)) for table in kinds}
+        self._column_stems = {
+            table: {col: frozenset(tokenize(col.replace(".", " "))) for col in columns}
+            for table, columns in kinds.items()
+        }
+
+    def match(self, question: str) -> Optional[FastPathMatch]:
+        """The fast-path interpretation of ``question``, or None if it needs the LLM."""
+        tokens = _tokens(question)
+        found = _intent(tokens)
+        if found is None:
+            return None
+        intent, weak, consumed = found
+        if any(t.folded in _REJECT_WORDS for i, t in enumerate(tokens)
+               if not t.quoted and not (t.folded == "mas" and i + 1 in consumed)):
+            return None
+
+        # 1. Una sola tabla nombrada en la pregunta (dos tablas suelen implicar un JOIN)
+        question_stems = set().union(*(t.stems for i, t in enumerate(tokens) if i not in consumed))
+        tables = [table for table, stems in self._table_stems.items() if stems and stems <= question_stems]
+        tables = [t for t in tables if not any(self._table_stems[t] < self._table_stems[o] for o in tables)]
+        if len(tables) != 1:
+            return None
+        table = tables[0]
+        table_stems = self._table_stems[table]
+        table_tokens = [i for i, t in enumerate(tokens) if i not in consumed and t.stems & table_stems]
+        consumed.update(table_tokens)
+        noun = " ".join(t.raw for t in tokens[table_tokens[0]:table_tokens[-1] + 1])
+        columns = self._column_stems[table]
+
+        # 2. Columna numérica del agregado ("importe total" -> total_amount)
+        column = None
+        if intent != COUNT:
+            free = [i for i in range(len(tokens)) if i not in consumed]
+            scores = {}
+            for col, stems in columns.items():
+                if self.kinds[table][col] != NUMBER:
+                    continue
+                # "total" sola no identifica columna: hace falta otra palabra con significado
+                strong = sum(1 for i in free if tokens[i].stems & stems and tokens[i].folded not in _WEAK_SUM_WORDS)
+                if strong:
+                    scores[col] = strong + sum(1 for i in free if tokens[i].stems & stems
+                                               and tokens[i].folded in _WEAK_SUM_WORDS)
+            column = _best(scores)
+            if column is None:
+                if not weak:
+                    return None
+                intent = COUNT
+            else:
+                consumed.update(i for i in free if tokens[i].stems & columns[column])
+        if weak:
+            consumed.update(i for i, t in enumerate(tokens) if t.folded in _WEAK_SUM_WORDS)
+
+        # 3. Filtros "columna valor" ("con estado 'enviado'", "cuya ciudad es Madrid")
+        filters = []
+        i = 0
+        while i < len(tokens):
+            if i in consumed or tokens[i].quoted or not tokens[i].stems or tokens[i].folded in _FILLER_WORDS:
+                i += 1
+                continue
+            col = _best({c: len(tokens[i].stems & stems) for c, stems in columns.items() if c != column})
+            if col is None:
+                return None
+            j = i + 1
+            while j < len(tokens) and not tokens[j].quoted and tokens[j].folded in _CONNECTORS:
+                j += 1
+            if j >= len(tokens) or j in consumed:
+                return None
+            value = self._value(tokens[j], self.kinds[table][col])
+            if value is None:
+                return None
+            filters.append((col, value))
+            consumed.update(range(i, j + 1))
+            i = j + 1
+
+        # 4. Todo lo demás debe ser relleno: una palabra sin explicar puede cambiar el significado
+        for i, token in enumerate(tokens):
+            if i not in consumed and (token.quoted or token.folded not in _FILLER_WORDS):
+                return None
+        return FastPathMatch(intent, table, column, tuple(filters), noun)
+
+    @staticmethod
+    def _value(token: _Token, kind: str):
+        if kind != NUMBER:
+            return token.raw
+        try:
+            number = float(token.raw.replace(",", "."))
+        except ValueError:
+            return None
+        return int(number) if number.is_integer() else number
+
+
+def _quote_ident(name: str) -> str:
+    if re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def to_sql(match: FastPathMatch) -> str:
+    """Read-only PostgreSQL statement for a match (text filters compare case-insensitively)."""
+    func = "COUNT(*)" if match.intent == COUNT else f"{match.intent.upper()}({_quote_ident(match.column)})"
+    sql = f"SELECT {func} AS value FROM {_quote_ident(match.table)}"
+    conditions = []
+    for col, value in match.filters:
+        if isinstance(value, (int, float)):
+            conditions.append(f"{_quote_ident(col)} = {_sql_literal(value)}")
+        else:
+            # ILIKE sin comodines: igualdad sin distinguir mayúsculas (CAST por si es un enum)
+            pattern = re.sub(r"([\\%_])", r"\\\1", str(value))
+            conditions.append(f"CAST({_quote_ident(col)} AS TEXT) ILIKE {_sql_literal(pattern)}")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql
+
+
+def to_mongo_spec(match: FastPathMatch) -> dict:
+    """MongoDB query spec (see ``src.agents.mongo_spec``) for a match."""
+    mongo_filter = {}
+    for col, value in match.filters:
+        if isinstance(value, (int, float)):
+            mongo_filter[col] = value
+        else:
+            mongo_filter[col] = {"$regex": f"^{re.escape(str(value))}$", "$options": "i"}
+    if match.intent == COUNT:
+        return {"collection": match.table, "operation": "count", "filter": mongo_filter}
+    pipeline = [{"$match": mongo_filter}] if mongo_filter else []
+    pipeline.append({"$group": {"_id": None, "value": {f"${match.intent}": f"${match.column}"}}})
+    return {"collection": match.table, "operation": "aggregate", "pipeline": pipeline}
+
+
+def _format_number(value) -> str:
+    if isinstance(value, Decimal):
+        value = float(value)
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:.2f}"
+    return str(value)
+
+
+_TEMPLATES = {
+    SUM: "La suma de {column} en {table}{where} es {value}.",
+    AVG: "El valor medio de {column} en {table}{where} es {value}.",
+    MIN: "El valor mínimo de {column} en {table}{where} es {value}.",
+    MAX: "El valor máximo de {column} en {table}{where} es {value}.",
+}
+
+
+def answers_question(match: FastPathMatch, value) -> bool:
+    """
+    False when a filtered match found nothing (zero count or NULL aggregate).
+
+    The filter value may just be worded differently from the stored one, so
+    the question is better left to the LLM than answered with "Hay 0".
+    """
+    if not match.filters:
+        return True
+    return value is not None and value != 0
+
+
+def format_answer(match: FastPathMatch, value) -> str:
+    """Spanish answer built from a template (no LLM involved)."""
+    where = "".join(
+        f" {'con' if n == 0 else 'y'} {col} = {_sql_literal(val)}" for n, (col, val) in enumerate(match.filters)
+    )
+    if match.intent == COUNT:
+        return f"Hay {_format_number(value or 0)} {match.noun} ({match.table}){where}."
+    if match.intent == SUM and value is None:
+        value = 0
+    if value is None:
+        return f"No hay valores de {match.column} en {match.table}{where}."
+    return _TEMPLATES[match.intent].format(column=match.column, table=match.table, where=where,
+                                           value=_format_number(value))
+
+
+def fast_path_events(match: FastPathMatch, query_text: str, raw_result: str, value, **extra) -> List[dict]:
+    """
+    Stream events of a question answered by the fast path, ending with ``DONE``.
+
+    Args:
+        match: Matched question.
+        query_text: Executed SQL or spec text.
+        raw_result: Result as shown to the user.
+        value: Scalar result of the aggregate.
+        **extra: Additional keys for the result dict (e.g. ``explain``).
+    """
+    answer = format_answer(match, value)
+    return [
+        event(QUERY_GENERATED, query=query_text, query_cache_hit=False, fast_path=True),
+        event(ROWS_FETCHED, raw_result=raw_result, from_cache=False, more_rows=False),
+        event(ANSWER_TOKEN, text=answer),
+        event(DONE, result={
+            "answer": answer,
+            "sql_queries": [query_text],
+            "raw_results": [raw_result],
+            "raw_results_from_cache": [False],
+            "raw_results_truncated_in_prompt": [False],
+            "more_rows_available": [False],
+            "query_cache_hit": False,
+            "fast_path": True,
+            "fast_path_intent": match.intent,
+            "error": None,
+            **extra,
+        }),
+    ]
+
+
+def fast_path_enabled() -> bool:
+    return env_int("FAST_PATH", 1) != 0
+
+
+_matchers: Dict[str, FastPathMatcher] = {}
+_matchers_lock = threading.Lock()
+
+
+def get_matcher(backend: str, fingerprint: Optional[str], build_kinds) -> FastPathMatcher:
+    """Matcher for ``backend``, rebuilt with ``build_kinds()`` only when the schema fingerprint changes."""
+    matcher = _matchers.get(backend)
+    if matcher is None or fingerprint is None or matcher.fingerprint != fingerprint:
+        matcher = FastPathMatcher(build_kinds(), fingerprint)
+        with _matchers_lock:
+            _matchers[backend] = matcher
+    return matcher
+
+
+class FastPathStats:
+    """Thread-safe fast-path coverage counters per backend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.questions = Counter()
+        self.hits = Counter()
+        self.intents = Counter()
+
+    def record(self, backend: str, match: Optional[FastPathMatch]):
+        with self._lock:
+            self.questions[backend] += 1
+            if match is not None:
+                self.hits[backend] += 1
+                self.intents[match.intent] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                backend: {
+                    "questions": total,
+                    "hits": self.hits[backend],
+                    "coverage": round(self.hits[backend] / total, 3) if total else 0.0,
+                }
+                for backend, total in self.questions.items()
+            } | ({"intents": dict(self.intents)} if self.intents else {})
+
+
+_stats = FastPathStats()
+
+
+def record_fast_path(backend: str, match: Optional[FastPathMatch]):
+    """Counts a question answered (``match``) or not (None) by the fast path."""
+    _stats.record(backend, match)
+
+
+def fast_path_stats() -> dict:
+    """Fast-path coverage per backend since the process started."""
+    return _stats.snapshot()
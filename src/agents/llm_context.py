@@ -0,0 +1,251 @@
+"""
+Lifecycle of the Ollama model shared by both agents.
+
+Ollama loads a model on the first request and unloads it after
+``keep_alive`` of inactivity. Without warm-up, the first question after
+starting ``main.py`` / ``gui.py`` (or after an idle period) pays several
+seconds of model loading. ``ModelManager`` does four things:
+
+- builds the single ``ChatOllama`` client used by the SQL and MongoDB agents;
+- loads the model in a background thread at startup, using an empty
+  ``generate`` call with the same ``num_ctx``, since a different context size
+  would make Ollama reload the model on the first real request;
+- re-sends that call every ``OLLAMA_KEEP_ALIVE_REFRESH_S`` seconds while the
+  process lives, so the model stays resident;
+- reports whether the model is resident (``ollama ps``).
+
+Configuration: ``OLLAMA_MODEL`` (default ``llama3``), ``OLLAMA_BASE_URL``,
+``OLLAMA_NUM_CTX`` and ``OLLAMA_NUM_PREDICT`` (0 = model default),
+``OLLAMA_KEEP_ALIVE`` (``30m``, seconds, or ``-1`` for ever),
+``OLLAMA_KEEP_ALIVE_REFRESH_S`` (0 = no refresh) and ``OLLAMA_WARMUP=0`` to
+skip the startup load.
+"""
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Union
+
+from src.utils.config import env_int
+
+if TYPE_CHECKING:
+    from langchain_ollama import ChatOllama
+    from ollama import Client
+
+DEFAULT_MODEL = "llama3"
+
+COLD = "cold"
+WARMING = "warming"
+READY = "ready"
+ERROR = "error"
+
+
+def parse_keep_alive(value: Optional[str]) -> Union[int, str]:
+    """``OLLAMA_KEEP_ALIVE`` as Ollama expects it: seconds as an int, otherwise a duration string."""
+    value = (value or "30m").strip()
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _model_key(name: str) -> str:
+    # "llama3" y "llama3:latest" son el mismo modelo para Ollama
+    return name if ":" in name else f"{name}:latest"
+
+
+def _field(item, name: str):
+    # ollama >= 0.4 devuelve modelos pydantic; las versiones anteriores, dicts
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+
+class ModelManager:
+    """
+    Shared ``ChatOllama`` client plus warm-up, keep-alive refresh and residency checks.
+
+    Args:
+        model: Ollama model name (``OLLAMA_MODEL``).
+        num_ctx: Context window in tokens; 0 keeps the model default (``OLLAMA_NUM_CTX``).
+        num_predict: Maximum generated tokens; 0 keeps the model default (``OLLAMA_NUM_PREDICT``).
+        keep_alive: How long Ollama keeps the model loaded after a request (``OLLAMA_KEEP_ALIVE``).
+        base_url: Ollama server; None uses the client default / ``OLLAMA_HOST`` (``OLLAMA_BASE_URL``).
+        refresh_seconds: Keep-alive refresh period; 0 disables it (``OLLAMA_KEEP_ALIVE_REFRESH_S``).
+    """
+
+    def __init__(self, model: Optional[str] = None, num_ctx: Optional[int] = None,
+                 num_predict: Optional[int] = None, keep_alive: Union[int, str, None] = None,
+                 base_url: Optional[str] = None, refresh_seconds: Optional[int] = None):
+        self.model = model or os.getenv("OLLAMA_MODEL") or DEFAULT_MODEL
+        self.num_ctx = num_ctx if num_ctx is not None else env_int("OLLAMA_NUM_CTX", 0)
+        self.num_predict = num_predict if num_predict is not None else env_int("OLLAMA_NUM_PREDICT", 0)
+        self.keep_alive = keep_alive if keep_alive is not None else parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE"))
+        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL") or None
+        self.refresh_seconds = (refresh_seconds if refresh_seconds is not None
+                                else env_int("OLLAMA_KEEP_ALIVE_REFRESH_S", 300))
+        self.state = COLD
+        self.error: Optional[str] = None
+        self.warm_up_seconds: Optional[float] = None
+        self.last_refresh: Optional[float] = None
+        self._lock = threading.Lock()
+        self._llm: Optional["ChatOllama"] = None
+        self._client: Optional["Client"] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def llm(self) -> "ChatOllama":
+        """The shared chat client; every request re-sends ``keep_alive``."""
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    # Import diferido: langchain_ollama es la dependencia más lenta de importar
+                    from langchain_ollama import ChatOllama
+                    kwargs = {"model": self.model, "temperature": 0, "keep_alive": self.keep_alive}
+                    if self.num_ctx > 0:
+                        kwargs["num_ctx"] = self.num_ctx
+                    if self.num_predict > 0:
+                        kwargs["num_predict"] = self.num_predict
+                    if self.base_url:
+                        kwargs["base_url"] = self.base_url
+                    self._llm = ChatOllama(**kwargs)
+        return self._llm
+
+    @property
+    def client(self) -> "Client":
+        """Low-level Ollama client for load / ps calls."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from ollama import Client
+                    self._client = Client(host=self.base_url)
+        return self._client
+
+    def load(self) -> bool:
+        """
+        Loads the model (or resets its idle timer) with an empty prompt; blocks until done.
+
+        Returns:
+            True if Ollama answered; the error is kept in ``error`` otherwise.
+        """
+        first = self.state != READY
+        if first:
+            self.state = WARMING
+        start = time.perf_counter()
+        options = {"num_ctx": self.num_ctx} if self.num_ctx > 0 else None
+        try:
+            # Prompt vacío: Ollama carga el modelo y responde sin generar tokens
+            self.client.generate(model=self.model, prompt="", keep_alive=self.keep_alive, options=options)
+        except Exception as e:
+            self.state = ERROR
+            self.error = str(e)
+            return False
+        if first:
+            self.warm_up_seconds = time.perf_counter() - start
+        self.state = READY
+        self.error = None
+        self.last_refresh = time.time()
+        return True
+
+    def warm_up(self) -> threading.Thread:
+        """Starts (once) the background thread that loads the model and keeps refreshing it."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="ollama-keepalive", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def _run(self):
+        self.load()
+        # El import de langchain_ollama también se hace aquí, fuera del camino de la primera pregunta
+        self.llm
+        while self.refresh_seconds > 0 and not self._stop.wait(self.refresh_seconds):
+            self.load()
+
+    def resident(self) -> Optional[dict]:
+        """The ``ollama ps`` entry of the model ({} if not loaded, None if Ollama is unreachable)."""
+        try:
+            models = _field(self.client.ps(), "models") or []
+        except Exception:
+            return None
+        key = _model_key(self.model)
+        for item in models:
+            if _model_key(_field(item, "model") or _field(item, "name") or "") == key:
+                return item
+        return {}
+
+    def status(self, check_resident: bool = True) -> dict:
+        """
+        Model configuration and lifecycle state.
+
+        Args:
+            check_resident: Also ask Ollama whether the model is loaded (one HTTP call).
+        """
+        info = {
+            "model": self.model,
+            "state": self.state,
+            "warm_up_seconds": round(self.warm_up_seconds, 2) if self.warm_up_seconds is not None else None,
+            "keep_alive": self.keep_alive,
+            "num_ctx": self.num_ctx or None,
+            "num_predict": self.num_predict or None,
+            "last_refresh": self.last_refresh,
+            "error": self.error,
+        }
+        if check_resident:
+            entry = self.resident()
+            info["resident"] = None if entry is None else bool(entry)
+            if entry:
+                expires_at = _field(entry, "expires_at")
+                info["expires_at"] = expires_at.isoformat() if hasattr(expires_at, "isoformat") else expires_at
+                info["size_vram"] = _field(entry, "size_vram")
+                info["context_length"] = _field(entry, "context_length")
+        return info
+
+    def shutdown(self):
+        """Stops the keep-alive refresh; Ollama unloads the model after ``keep_alive``."""
+        self._stop.set()
+
+
+_manager: Optional[ModelManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_model_manager() -> ModelManager:
+    """Process-wide model manager, configured from the environment on first use."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ModelManager()
+    return _manager
+
+
+def get_llm() -> "ChatOllama":
+    """The ``ChatOllama`` client shared by every agent."""
+    return get_model_manager().llm
+
+
+def set_llm(llm):
+    """
+    Replaces the shared chat client, e.g. with a stub in tests or a load test of the HTTP service.
+
+    Call it before the first question: the SQL context keeps the client it was built with.
+    """
+    get_model_manager()._llm = llm
+
+
+def start_model_warmup() -> Optional[threading.Thread]:
+    """Loads the model in the background (unless ``OLLAMA_WARMUP=0``); returns at once."""
+    if env_int("OLLAMA_WARMUP", 1) == 0:
+        return None
+    return get_model_manager().warm_up()
+
+
+def model_status(check_resident: bool = True) -> dict:
+    """``ModelManager.status`` of the shared manager."""
+    return get_model_manager().status(check_resident)
+
+
+def shutdown_model_manager():
+    """Stops the keep-alive refresh thread. Safe to call more than once."""
+    if _manager is not None:
+        _manager.shutdown()
@@ -1,139 +1,365 @@
-from langchain_ollama import ChatOllama
+import hashlib
 import os
-import re
-from pymongo import MongoClient
-import json
-from src.utils.encoding_utils import safe_load_dotenv
-from bson import json_util
+from functools import partial
+from src.utils.config import load_config
+from src.agents.llm_context import get_llm
+from src.agents.mongo_context import get_async_mongo_client, get_mongo_client
+from src.agents.mongo_schema import get_schema_inferrer, known_schema_fingerprint
+from src.agents.query_cache import get_query_cache
+from src.agents.example_store import format_examples, get_example_store
+from src.agents.fast_path import (
+    answers_question, fast_path_enabled, fast_path_events, get_matcher, mongo_column_kinds, record_fast_path,
+    to_mongo_spec,
+)
+from src.agents.streaming import DONE, QUERY_GENERATED, ROWS_FETCHED, acollect_result, atraced, collect_result, event, traced
+from src.agents.pipeline import Io, answer_tokens, arun_steps, invoke, run_steps
+from src.agents.single_flight import acoalesce, coalesce, flight_key
+from src.agents.tracing import Trace, usage_attributes
+from src.agents.result_compaction import compact_result
+from src.agents.result_cache import ensure_mongo_listener, get_result_cache, mongo_scope
+from src.agents.mongo_spec import (
+    SpecError, aexecute_spec, check_indexes, enforce_scan_limit, execute_spec, explain_spec,
+    load_spec, spec_collections, spec_is_volatile, spec_text, summarize_explain, to_json, validate_spec,
+)
 
-safe_load_dotenv()
+load_config()
 
-def run_mongo_agent(query: str):
+def build_generation_prompt(schema_context: str, query: str, examples=()) -> str:
+    """Prompt asking the LLM for a declarative JSON query spec (see ``src.agents.mongo_spec``), with few-shot examples."""
+    return (
+        f"Tu tarea es generar una consulta MongoDB en formato JSON basada en la pregunta del usuario y el esquema inferido.\n"
+        f"ESQUEMA (Colecciones, campos con tipo, % de documentos que los contienen, valor de ejemplo e índices):\n{schema_context}\n\n"
+        f"{format_examples(examples, 'json')}"
+        f"PREGUNTA: {query}\n\n"
+        "INSTRUCCIONES:\n"
+        "1. Responde SOLAMENTE con un objeto JSON dentro de un bloque markdown ```json ... ```.\n"
+        "2. Campos: \"collection\", \"operation\" (\"find\", \"count\" o \"aggregate\"), \"filter\", \"projection\", \"sort\", \"limit\" y, solo para aggregate, \"pipeline\".\n"
+        "3. Usa operadores de consulta de MongoDB ($gt, $regex, $in, $group, $sum...). NO escribas código Python ni uses $where o JavaScript.\n"
+        "4. Para fechas usa {\"$date\": \"2024-01-31T00:00:00Z\"} y para _id usa {\"$oid\": \"...\"}.\n"
+        "5. Para buscar por campos de texto, usa directamente strings: {\"name\": \"Bob\"}\n"
+        "6. Ejemplos válidos:\n"
+        "   - {\"collection\": \"users\", \"operation\": \"find\", \"filter\": {\"name\": \"Alice\"}}\n"
+        "   - {\"collection\": \"orders\", \"operation\": \"find\", \"filter\": {}, \"sort\": {\"total_amount\": -1}, \"limit\": 5}\n"
+        "   - {\"collection\": \"users\", \"operation\": \"count\", \"filter\": {}}\n"
+        "   - {\"collection\": \"orders\", \"operation\": \"aggregate\", \"pipeline\": [{\"$group\": {\"_id\": \"$user_name\", \"total\": {\"$sum\": \"$total_amount\"}}}]}\n"
+    )
+
+def prepare_spec(content, schema: dict, span=None) -> dict:
+    """
+    Parses, validates and index-checks a spec (LLM response, cached spec text or fast-path spec).
+
+    Args:
+        content: Text containing the JSON spec, or an already built spec dict.
+        schema: Inferred schema (``MongoSchemaInferrer.get_schema``) with collections and indexes.
+        span: Optional tracing span that receives the index check.
+
+    Raises:
+        SpecError: If the spec is invalid or would scan a large collection without an index.
+    """
+    collections = list(schema) if schema else None
+    spec = validate_spec(content, collections) if isinstance(content, dict) else load_spec(content, collections)
+    info = (schema or {}).get(spec["collection"], {})
+    check = check_indexes(spec, info.get("indexes", []), info.get("estimated_count"))
+    if span is not None:
+        span.set(**{
+            "mongo.operation": spec["operation"],
+            "mongo.collection": spec["collection"],
+            "mongo.index": check["index"],
+            "mongo.collection_scan": check["collection_scan"],
+        })
+    enforce_scan_limit(check)
+    return spec
+
+def build_interpretation_prompt(query: str, query_text: str, raw_result_str: str, truncated: bool = False,
+                                more_rows: bool = False) -> str:
+    """Prompt asking the LLM to explain the (possibly compacted) query result in Spanish."""
+    prompt = (
+        f"Pregunta Original: {query}\n"
+        f"Consulta Ejecutada: {query_text}\n"
+        f"Resultado de la Base de Datos: {raw_result_str}\n\n"
+        "INSTRUCCIONES:\n"
+        "1. Responde a la pregunta original basándote en el resultado.\n"
+        "2. Responde en ESPAÑOL.\n"
+        "3. Explica DETALLADAMENTE los resultados.\n"
+    )
+    if truncated:
+        prompt += "4. El resultado está TRUNCADO: usa las estadísticas por columna para totales y conteos y no inventes documentos que no se muestran.\n"
+    if more_rows:
+        prompt += "5. La consulta devolvió más documentos de los recuperados (límite alcanzado): indícalo y no presentes el resultado como completo.\n"
+    return prompt
+
+def _cache_value(result, more_rows):
+    """Full JSON, document count, compacted prompt text and the more-rows flag, computed once per execution."""
+    raw_result_str = to_json(result)
+    compacted = compact_result(result, raw_result_str, to_json)
+    row_count = len(result) if isinstance(result, list) else 1
+    # Los documentos no se guardan: solo el JSON completo y el resumen para el prompt
+    return raw_result_str, row_count, compacted, more_rows
+
+def _cache_size(value) -> int:
+    raw_result_str, _, compacted, _ = value
+    size = len(raw_result_str.encode("utf-8"))
+    if compacted.truncated:
+        size += len(compacted.text.encode("utf-8"))
+    return size
+
+def _record_rows(span, value, from_cache: bool):
+    if span is not None:
+        raw_result_str, row_count, compacted, more_rows = value
+        span.set(**{
+            "db.rows": row_count,
+            "db.more_rows": more_rows,
+            "db.result_bytes": len(raw_result_str.encode("utf-8")),
+            "result_cache.hit": from_cache,
+            "prompt.result_bytes": len(compacted.text.encode("utf-8")),
+            "prompt.result_truncated": compacted.truncated,
+        })
+
+def _execute(db, spec: dict, adb=None) -> Io:
+    """``execute_spec`` on ``db``; the async driver awaits it on ``adb()`` (``AsyncMongoClient``) when given."""
+    return Io(partial(execute_spec, db, spec), (lambda: aexecute_spec(adb(), spec)) if adb is not None else None)
+
+def cached_spec_steps(db, spec: dict, scope: str, span=None, adb=None):
+    """
+    Pipeline steps (``src.agents.pipeline``) that execute a validated spec through the shared result cache.
+
+    Args:
+        db: PyMongo database.
+        spec: Normalized spec from ``prepare_spec``.
+        scope: Result cache scope of the database (``mongo_scope``).
+        span: Optional tracing span that receives document count and result size.
+        adb: Returns the ``AsyncMongoClient`` database the async pipeline queries.
+
+    Returns:
+        Tuple ``(raw_result_str, compacted, more_rows, from_cache)`` where
+        ``compacted`` is the ``CompactedResult`` to use in the interpretation
+        prompt and ``more_rows`` tells whether ``MONGO_MAX_DOCS`` cut the result.
+    """
+    result_cache = get_result_cache()
+    # El listener de change streams usa el cliente síncrono en su propio hilo
+    ensure_mongo_listener(db, scope)
+    key = spec_text(spec)
+    collections = spec_collections(spec)
+    found, value = result_cache.get(scope, key, collections)
+    if not found:
+        versions = result_cache.version_snapshot(scope, collections)
+        value = _cache_value(*(yield _execute(db, spec, adb)))
+        result_cache.put(scope, key, versions, value, _cache_size(value), spec_is_volatile(spec))
+    _record_rows(span, value, found)
+    return value[0], value[2], value[3], found
+
+def run_mongo_agent(query: str, explain: bool = False):
     """
     Executes a natural language query against MongoDB using a deterministic
     generate-execute-interpret pipeline.
+
+    Args:
+        query: Question in natural language.
+        explain: If True, the result includes the query plan under ``explain``.
+    """
+    return collect_result(stream_mongo_agent(query, explain=explain))
+
+def stream_mongo_agent(query: str, explain: bool = False):
+    """
+    Streaming variant of ``run_mongo_agent``: yields the events described in
+    ``src.agents.streaming`` while the pipeline runs, ending with ``DONE``.
+    An identical question already in flight is shared instead of run again
+    (``src.agents.single_flight``).
+    """
+    return coalesce("mongo", _flight_key(query, explain), lambda: _stream_mongo_agent(query, explain))
+
+async def arun_mongo_agent(query: str, explain: bool = False):
+    """
+    Async counterpart of ``run_mongo_agent``. LLM calls use ``ainvoke`` /
+    ``astream`` and the spec runs on PyMongo's ``AsyncMongoClient``; schema
+    sampling and the SQLite query cache run in worker threads.
     """
+    return await acollect_result(astream_mongo_agent(query, explain=explain))
+
+def astream_mongo_agent(query: str, explain: bool = False):
+    """Async generator yielding the same events as ``stream_mongo_agent``, also coalescing identical questions."""
+    return acoalesce("mongo", _flight_key(query, explain), lambda: _astream_mongo_agent(query, explain))
+
+def _flight_key(query: str, explain: bool) -> tuple:
+    # Huella del último muestreo, sin volver a muestrear; el líder comprueba el esquema actual
+    mongo_uri = os.getenv("MONGO_URI")
+    db_name = os.getenv("MONGO_DB_NAME")
+    fingerprint = known_schema_fingerprint(mongo_uri, db_name) if mongo_uri and db_name else None
+    return flight_key(query, fingerprint, mongo_uri, db_name, explain)
+
+def _stream_mongo_agent(query: str, explain: bool):
+    trace = Trace("mongo_agent", **{"db.system": "mongodb", "question": query})
+    yield from traced(trace, run_steps(_mongo_steps(query, trace, explain)))
+
+async def _astream_mongo_agent(query: str, explain: bool):
+    trace = Trace("mongo_agent", **{"db.system": "mongodb", "question": query})
+    async for ev in atraced(trace, arun_steps(_mongo_steps(query, trace, explain))):
+        yield ev
+
+
+def _fast_path_spec(query: str, schema: dict, fingerprint, trace: Trace):
+    """``(match, spec)`` when the fast path answers ``query``, else ``(None, None)``."""
+    with trace.span("fast_path") as span:
+        match = spec = None
+        if schema:
+            match = get_matcher("mongo", fingerprint, lambda: mongo_column_kinds(schema)).match(query)
+        if match is not None:
+            try:
+                spec = prepare_spec(to_mongo_spec(match), schema, span)
+            except SpecError:
+                # p. ej. un recorrido sin índice de una colección grande: mejor que decida el LLM
+                match = None
+        span.set(**{"fast_path.hit": match is not None, "fast_path.intent": match.intent if match else None})
+    return match, spec
+
+def _fast_path_value(result):
+    if isinstance(result, list):
+        return result[0].get("value") if result else None
+    return result
+
+def _explain(db, spec: dict, trace: Trace):
+    with trace.span("explain") as span:
+        plan = explain_spec(db, spec)
+        summary = summarize_explain(plan)
+        span.set(**{"mongo.plan": " > ".join(summary["stages"])})
+    return {"summary": summary, "plan": plan}
+
+def _mongo_steps(query: str, trace: Trace, explain: bool = False):
+    """The MongoDB pipeline as steps (``src.agents.pipeline``): the async API runs specs on ``AsyncMongoClient``."""
     mongo_uri = os.getenv("MONGO_URI")
     db_name = os.getenv("MONGO_DB_NAME")
     
     if not mongo_uri or not db_name:
-        return {"error": "Error: MONGO_URI or MONGO_DB_NAME environment variable not set."}
+        yield event(DONE, result={"error": "Error: MONGO_URI or MONGO_DB_NAME environment variable not set."})
+        return
     
-    client = None
     try:
-        # 1. Setup
-        client = MongoClient(mongo_uri)
-        db = client[db_name]
-        llm = ChatOllama(model="llama3", temperature=0)
-        
-        # 2. Get Schema (Inferred from collections and first document)
-        collections = db.list_collection_names()
-        schema_info = {}
-        for col_name in collections:
-            doc = db[col_name].find_one()
-            if doc:
-                # Convert ObjectIds and Datetimes to string for schema representation
-                doc_str = json.dumps(json.loads(json_util.dumps(doc)), indent=2)
-                schema_info[col_name] = doc_str
-            else:
-                schema_info[col_name] = "Empty Collection"
+        # 1. Setup - Cliente compartido del registro (no se cierra tras cada pregunta)
+        with trace.span("setup"):
+            client = get_mongo_client(mongo_uri)
+            db = client[db_name]
+            # Cliente asíncrono ligado al event loop: solo se pide desde la ruta async
+            adb = lambda: get_async_mongo_client(mongo_uri)[db_name]
+            scope = mongo_scope(mongo_uri, db_name)
+            llm = get_llm()
         
-        schema_context = json.dumps(schema_info, indent=2)
+        # 2. Get Schema (muestreo $sample concurrente, unión de campos con tipos/presencia/índices, cacheado con TTL)
+        inferrer = get_schema_inferrer(mongo_uri, db_name)
+        with trace.span("schema_load") as span:
+            # Texto, estructura y huella del mismo refresco
+            schema_context, schema, schema_fingerprint = yield Io(inferrer.snapshot)
+            span.set(**{"schema.chars": len(schema_context), "schema.fingerprint": schema_fingerprint})
 
-        # 3. Generate PyMongo Code (Explicit Chain Step 1)
-        # We ask for Python code using pymongo because MQL is harder to execute directly purely as a string in some contexts,
-        # but generating a python script to execute is risky.
-        # Safer approach: Generate a "mongo shell" style query or specific finding parameters.
-        # Let's try generating a Python block that defines a result variable.
-        
-        generation_prompt = (
-            f"Tu tarea es generar código PYTHON usando `pymongo` para consultar MongoDB basado en la pregunta del usuario y el esquema (ejemplo de documentos).\n"
-            f"ESQUEMA (Colecciones y un documento de ejemplo):\n{schema_context}\n\n"
-            f"PREGUNTA: {query}\n\n"
-            "INSTRUCCIONES:\n"
-            "1. Responde SOLAMENTE con código Python dentro de un bloque markdown ```python ... ```.\n"
-            "2. Asume que existe una variable `db` que ya es la conexión a la base de datos.\n"
-            "3. El código debe ejecutar la consulta y guardar el resultado en una variable llamada `result`.\n"
-            "4. `result` debe ser una lista de diccionarios (usa `list(cursor)` si es necesario) o un valor simple (count).\n"
-            "5. NO uses ObjectId() ni formato JSON extendido de MongoDB como {{'$oid': '...'}}.\n"
-            "6. Para buscar por campos de texto, usa directamente strings: {{'nombre': 'Bob'}}\n"
-            "7. Para buscar por _id (si es necesario), usa from bson import ObjectId y ObjectId('id_string').\n"
-            "8. NO importes pymongo ni MongoClient, solo usa `db` directamente.\n"
-            "9. Ejemplos válidos:\n"
-            "   - result = list(db.users.find({{'name': 'Alice'}}))\n"
-            "   - result = list(db.orders.find({{'user_name': 'Bob'}}))\n"
-            "   - result = db.users.count_documents({{}})\n"
-        )
-        
-        response_gen = llm.invoke(generation_prompt)
-        content_gen = response_gen.content if hasattr(response_gen, 'content') else str(response_gen)
-        
-        # Extract Code
-        generated_code = ""
-        code_match = re.search(r"```python\s*(.*?)```", content_gen, re.IGNORECASE | re.DOTALL)
-        
-        if code_match:
-            generated_code = code_match.group(1).strip()
-        else:
-             # Fallback: try to find lines that start with result = 
-            if "result =" in content_gen:
-                generated_code = content_gen.strip()
-            else:
-                return {
-                    "answer": "No pude generar código PyMongo válido.",
-                    "sql_queries": [], # reusing key for consistency for now, or rename to generated_code
+        # 2b. Camino rápido: agregados simples resueltos con una plantilla, sin llamadas al LLM
+        if fast_path_enabled():
+            match, spec = _fast_path_spec(query, schema, schema_fingerprint, trace)
+            if match is not None:
+                query_text = spec_text(spec)
+                try:
+                    with trace.span("db_execution", **{"db.statement": query_text}):
+                        result, _ = yield _execute(db, spec, adb)
+                    value = _fast_path_value(result)
+                    if not answers_question(match, value):
+                        # Filtro sin documentos: quizá el valor está escrito de otra forma; mejor que decida el LLM
+                        match = None
+                except Exception:
+                    match = None
+            record_fast_path("mongo", match)
+            if match is not None:
+                extra = {"explain": (yield Io(partial(_explain, db, spec, trace)))} if explain else {}
+                yield from fast_path_events(match, query_text, to_json(result), value, **extra)
+                return
+
+        # 3. Question-to-query cache: un acierto salta la llamada de generación al LLM
+        query_cache = get_query_cache()
+        cache_scope = schema_fingerprint or hashlib.sha256(schema_context.encode("utf-8")).hexdigest()
+        with trace.span("query_cache_lookup") as span:
+            cached = yield Io(partial(query_cache.lookup, "mongo", cache_scope, query))
+            span.set(**{"query_cache.hit": cached is not None})
+        if cached:
+            try:
+                # Las entradas antiguas (código Python) no son JSON válido y se descartan aquí
+                spec = prepare_spec(cached.query, schema)
+                query_text = spec_text(spec)
+                with trace.span("db_execution", **{"db.statement": query_text}) as span:
+                    raw_result_str, compacted, more_rows, from_cache = yield from cached_spec_steps(db, spec, scope, span, adb)
+                yield event(QUERY_GENERATED, query=query_text, query_cache_hit=True)
+            except Exception:
+                # La consulta cacheada ya no es válida: se descarta y se genera de nuevo
+                yield Io(partial(query_cache.discard, "mongo", cache_scope, query, cached.query))
+                yield Io(partial(get_example_store().discard, "mongo", cached.query))
+                cached = None
+
+        if not cached:
+            # 3b. Generate the JSON query spec (Explicit Chain Step 1)
+            # El modelo describe la consulta de forma declarativa; nada generado se ejecuta como código
+            # Ejemplos verificados más parecidos a la pregunta (few-shot)
+            example_store = get_example_store()
+            with trace.span("examples_retrieval") as span:
+                examples = example_store.search("mongo", query)
+                span.set(**{"examples.count": len(examples), "examples.index_size": example_store.size("mongo")})
+            prompt = build_generation_prompt(schema_context, query, examples)
+            with trace.span("generation_llm", **{"llm.prompt_chars": len(prompt)}) as span:
+                response_gen = yield invoke(llm, prompt)
+                span.set(**usage_attributes(response_gen))
+            content_gen = response_gen.content if hasattr(response_gen, 'content') else str(response_gen)
+
+            try:
+                with trace.span("extraction") as span:
+                    spec = prepare_spec(content_gen, schema, span)
+            except SpecError as e:
+                yield event(DONE, result={
+                    "answer": f"No pude generar una consulta MongoDB válida: {e}",
+                    "sql_queries": [], # reusing key for consistency for now
                     "raw_results": [],
-                    "error": "Code Extraction Failed"
-                }
-
-        # 4. Execute Code (Explicit Step 2)
-        # WARNING: Executing generated code is dangerous. In a real prod env, this needs strict sandboxing.
-        # For this prototype local CLI, we use exec with restricted locals.
-        # Import ObjectId in case the generated code needs it
-        from bson import ObjectId
-        local_scope = {'db': db, 'ObjectId': ObjectId}
-        try:
-            exec(generated_code, {}, local_scope)
-            raw_result = local_scope.get('result', "No result variable found")
-        except Exception as e:
-            return {
-                "answer": f"Error al ejecutar el código MongoDB: {str(e)}",
-                "sql_queries": [generated_code],
-                "raw_results": [f"Error: {str(e)}"],
-                "error": str(e)
-            }
-            
-        # Serialize raw_result for display/prompt
-        raw_result_str = json_util.dumps(raw_result)
-
-        # 5. Interpret Result (Explicit Step 3)
-        interpretation_prompt = (
-            f"Pregunta Original: {query}\n"
-            f"Código Ejecutado: {generated_code}\n"
-            f"Resultado de la Base de Datos: {raw_result_str}\n\n"
-            "INSTRUCCIONES:\n"
-            "1. Responde a la pregunta original basándote en el resultado.\n"
-            "2. Responde en ESPAÑOL.\n"
-            "3. Explica DETALLADAMENTE los resultados.\n"
-        )
-        
-        response_int = llm.invoke(interpretation_prompt)
-        final_answer = response_int.content if hasattr(response_int, 'content') else str(response_int)
+                    "error": f"Spec Validation Failed: {e}"
+                })
+                return
+            query_text = spec_text(spec)
+            yield event(QUERY_GENERATED, query=query_text, query_cache_hit=False)
+
+            # 4. Execute the spec (Explicit Step 2)
+            try:
+                with trace.span("db_execution", **{"db.statement": query_text}) as span:
+                    raw_result_str, compacted, more_rows, from_cache = yield from cached_spec_steps(db, spec, scope, span, adb)
+            except Exception as e:
+                yield event(DONE, result={
+                    "answer": f"Error al ejecutar la consulta MongoDB: {str(e)}",
+                    "sql_queries": [query_text],
+                    "raw_results": [f"Error: {str(e)}"],
+                    "error": str(e)
+                })
+                return
+            yield Io(partial(query_cache.store, "mongo", cache_scope, query, query_text))
+            yield Io(partial(example_store.add, "mongo", query, query_text))
+
+        yield event(ROWS_FETCHED, raw_result=raw_result_str, from_cache=from_cache, more_rows=more_rows)
 
-        return {
+        # 5. Interpret Result (Explicit Step 3) - la respuesta se emite token a token
+        prompt = build_interpretation_prompt(query, query_text, compacted.text, compacted.truncated, more_rows)
+        with trace.span("interpretation_llm", **{"llm.prompt_chars": len(prompt)}) as span:
+            answer_parts = yield answer_tokens(llm, prompt, span)
+        final_answer = "".join(answer_parts)
+
+        result = {
             "answer": final_answer,
-            "sql_queries": [generated_code], # showing code instead of SQL
+            "sql_queries": [query_text], # showing the spec instead of SQL
             "raw_results": [raw_result_str],
+            "raw_results_from_cache": [from_cache],
+            "raw_results_truncated_in_prompt": [compacted.truncated],
+            "more_rows_available": [more_rows],
+            "query_cache_hit": cached is not None,
+            "fast_path": False,
             "error": None
         }
+        if explain:
+            result["explain"] = yield Io(partial(_explain, db, spec, trace))
+        yield event(DONE, result=result)
 
     except Exception as e:
-        return {
+        yield event(DONE, result={
             "answer": "Ocurrió un error inesperado en el agente Mongo.",
             "sql_queries": [],
             "raw_results": [],
             "error": str(e)
-        }
-    finally:
-        if client:
-            client.close()
+        })
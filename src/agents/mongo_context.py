@@ -0,0 +1,217 @@
+"""
+Process-wide registry of pooled MongoClient instances for the Mongo agent.
+
+A MongoClient owns its own connection pool and background monitoring threads,
+so it is meant to be created once and reused. The registry creates one client
+per URI on first use and keeps it until ``shutdown_mongo_clients`` is called
+from ``main.py`` / ``gui.py``. The async API gets one ``AsyncMongoClient`` per
+URI and event loop, closed with ``aclose_async_mongo_clients``.
+"""
+import asyncio
+import re
+import threading
+import weakref
+from typing import Dict, Optional
+
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.monitoring import ConnectionPoolListener
+
+from src.utils.config import env_int
+
+
+class ConnectionCounter(ConnectionPoolListener):
+    """Counts physical connections opened vs. checkouts served by the pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+
+    # Eventos que no necesitamos contar
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "checkouts": self.checkouts,
+                "connections_reused": max(self.checkouts - self.created, 0),
+            }
+
+
+class MongoClientRegistry:
+    """
+    Lazily creates and caches one MongoClient per URI.
+
+    ``maxPoolSize`` / ``minPoolSize`` are read from ``MONGO_MAX_POOL_SIZE`` and
+    ``MONGO_MIN_POOL_SIZE`` unless given explicitly.
+    """
+
+    def __init__(self, max_pool_size: Optional[int] = None, min_pool_size: Optional[int] = None):
+        self.max_pool_size = max_pool_size if max_pool_size is not None else env_int("MONGO_MAX_POOL_SIZE", 100)
+        self.min_pool_size = min_pool_size if min_pool_size is not None else env_int("MONGO_MIN_POOL_SIZE", 0)
+        self._lock = threading.Lock()
+        self._clients: Dict[str, MongoClient] = {}
+        self._counters: Dict[str, ConnectionCounter] = {}
+        # Un AsyncMongoClient queda ligado al event loop en el que se usa por primera vez
+        self._async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self.clients_created = 0
+        self.clients_reused = 0
+
+    def get(self, uri: str) -> MongoClient:
+        """Returns the shared client for ``uri``, creating it on first use."""
+        with self._lock:
+            client = self._clients.get(uri)
+            if client is not None:
+                self.clients_reused += 1
+                return client
+            counter = ConnectionCounter()
+            client = MongoClient(
+                uri,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                event_listeners=[counter],
+            )
+            self._clients[uri] = client
+            self._counters[uri] = counter
+            self.clients_created += 1
+            return client
+
+    def aget(self, uri: str) -> AsyncMongoClient:
+        """Returns the async client for ``uri`` on the running event loop, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(uri)
+            if client is not None:
+                self.clients_reused += 1
+                return client
+            counter = self._counters.setdefault(f"async:{uri}", ConnectionCounter())
+            client = AsyncMongoClient(
+                uri,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                event_listeners=[counter],
+            )
+            clients[uri] = client
+            self.clients_created += 1
+            return client
+
+    async def aclose_loop_clients(self):
+        """Closes the async clients created on the running event loop."""
+        with self._lock:
+            clients = list(self._async_clients.pop(asyncio.get_running_loop(), {}).values())
+        for client in clients:
+            try:
+                await client.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        """Client creation/reuse counters plus per-URI connection counters."""
+        with self._lock:
+            counters = list(self._counters.items())
+            stats = {
+                "clients_created": self.clients_created,
+                "clients_reused": self.clients_reused,
+                "max_pool_size": self.max_pool_size,
+                "min_pool_size": self.min_pool_size,
+            }
+        stats["connections"] = {_redact(uri): counter.snapshot() for uri, counter in counters}
+        return stats
+
+    def close_all(self):
+        """Closes every registered client. Safe to call more than once."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._counters.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+def _redact(uri: str) -> str:
+    """Hides the password of a Mongo URI for display purposes."""
+    return re.sub(r"//([^:/@]+):([^@]+)@", r"//\1:***@", uri)
+
+
+_registry: Optional[MongoClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_mongo_registry() -> MongoClientRegistry:
+    """Returns the process-wide registry, creating it on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MongoClientRegistry()
+    return _registry
+
+
+def get_mongo_client(uri: str) -> MongoClient:
+    """Shortcut for ``get_mongo_registry().get(uri)``."""
+    return get_mongo_registry().get(uri)
+
+
+def get_async_mongo_client(uri: str) -> AsyncMongoClient:
+    """Shortcut for ``get_mongo_registry().aget(uri)``; call from inside the event loop."""
+    return get_mongo_registry().aget(uri)
+
+
+async def aclose_async_mongo_clients():
+    """Closes the async clients of the running loop; call before the event loop ends."""
+    if _registry is not None:
+        await _registry.aclose_loop_clients()
+
+
+def mongo_client_stats() -> dict:
+    """Statistics of the process-wide registry (empty if it was never used)."""
+    if _registry is None:
+        return {}
+    return _registry.stats()
+
+
+def shutdown_mongo_clients():
+    """Closes every shared MongoClient."""
+    if _registry is not None:
+        _registry.close_all()
@@ -0,0 +1,334 @@
+"""
+Sampled, concurrent and cached schema inference for the Mongo agent.
+
+Instead of pretty-printing one ``find_one()`` document per collection, each
+collection is sampled with ``$sample`` in parallel and the documents are
+merged into a union of field paths with their types, presence ratio and an
+example value, plus the collection's indexes. Results are cached with a TTL
+and refreshed as soon as a collection is created or dropped.
+
+The schema fingerprint (query cache scope, fast-path matcher, single-flight
+key) hashes only stable metadata: collection names, indexes and validators.
+Fields seen in a random sample vary between refreshes of a heterogeneous
+collection and would change the fingerprint without any schema change.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from bson import Decimal128, ObjectId
+from bson.int64 import Int64
+
+from src.agents.mongo_context import get_mongo_client
+from src.utils.config import env_int
+
+MAX_DEPTH = 4
+MAX_FIELDS_PER_COLLECTION = 40
+EXAMPLE_MAX_CHARS = 30
+
+_TYPE_NAMES = {
+    str: "string",
+    bool: "bool",
+    int: "int",
+    Int64: "long",
+    float: "double",
+    dict: "object",
+    list: "array",
+    datetime: "date",
+    ObjectId: "objectId",
+    Decimal128: "decimal",
+    bytes: "binData",
+    type(None): "null",
+}
+
+
+def _type_name(value) -> str:
+    return _TYPE_NAMES.get(type(value), type(value).__name__)
+
+
+def _collect_paths(doc: dict, prefix: str, depth: int, out: Dict[str, list]):
+    """Adds (path -> [value, ...]) entries for every field of ``doc``."""
+    for key, value in doc.items():
+        path = f"{prefix}{key}"
+        out.setdefault(path, []).append(value)
+        if depth >= MAX_DEPTH:
+            continue
+        if isinstance(value, dict):
+            _collect_paths(value, f"{path}.", depth + 1, out)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    _collect_paths(item, f"{path}[].", depth + 1, out)
+
+
+def merge_documents(docs: List[dict]) -> Dict[str, dict]:
+    """
+    Merges sampled documents into a union of field paths.
+
+    Returns:
+        ``{path: {"types": [...], "presence": float, "example": value}}`` where
+        presence is the fraction of sampled documents containing the path.
+    """
+    fields: Dict[str, dict] = {}
+    total = len(docs)
+    for doc in docs:
+        seen: Dict[str, list] = {}
+        _collect_paths(doc, "", 0, seen)
+        for path, values in seen.items():
+            info = fields.setdefault(path, {"types": {}, "docs": 0, "example": None})
+            info["docs"] += 1
+            for value in values:
+                name = _type_name(value)
+                info["types"][name] = info["types"].get(name, 0) + 1
+                if info["example"] is None and not isinstance(value, (dict, list, ObjectId)) and value is not None:
+                    info["example"] = value
+
+    merged = {}
+    for path, info in fields.items():
+        types = sorted(info["types"], key=lambda t: -info["types"][t])
+        merged[path] = {
+            "types": types,
+            "presence": info["docs"] / total if total else 0.0,
+            "example": info["example"],
+        }
+    return merged
+
+
+def infer_collection_schema(collection, sample_size: int, max_time_ms: int) -> dict:
+    """Samples ``collection`` and returns its merged field union and indexes."""
+    docs = list(collection.aggregate(
+        [{"$sample": {"size": sample_size}}],
+        maxTimeMS=max_time_ms,
+    ))
+    try:
+        indexes = [
+            {"name": name, "keys": [key for key, _ in spec["key"]], "unique": bool(spec.get("unique"))}
+            for name, spec in collection.index_information().items()
+        ]
+    except Exception:
+        indexes = []
+    try:
+        validator = collection.options().get("validator")
+    except Exception:
+        validator = None
+    try:
+        estimated = collection.estimated_document_count(maxTimeMS=max_time_ms)
+    except Exception:
+        estimated = None
+    return {
+        "sampled": len(docs),
+        "estimated_count": estimated,
+        "fields": merge_documents(docs),
+        "indexes": indexes,
+        "validator": validator,
+    }
+
+
+def _format_example(value) -> str:
+    text = repr(value) if isinstance(value, str) else str(value)
+    if len(text) > EXAMPLE_MAX_CHARS:
+        text = text[:EXAMPLE_MAX_CHARS - 3] + "..."
+    return text
+
+
+def format_schema(schema: Dict[str, dict]) -> str:
+    """Compact, prompt-friendly rendering of an inferred schema."""
+    lines = []
+    for name in sorted(schema):
+        info = schema[name]
+        if info.get("error"):
+            lines.append(f"{name}: (esquema no disponible: {info['error']})")
+            continue
+        count = info.get("estimated_count")
+        count_str = f"~{count} docs" if count is not None else "? docs"
+        lines.append(f"{name} ({count_str}, muestra {info['sampled']}):")
+        if not info["fields"]:
+            lines.append("  (colección vacía)")
+        for i, (path, field) in enumerate(info["fields"].items()):
+            if i >= MAX_FIELDS_PER_COLLECTION:
+                lines.append(f"  ... {len(info['fields']) - i} campos más")
+                break
+            line = f"  {path}: {'|'.join(field['types'])} ({field['presence']:.0%})"
+            if field["example"] is not None:
+                line += f" ej: {_format_example(field['example'])}"
+            lines.append(line)
+        index_strs = [
+            f"{idx['name']}({', '.join(idx['keys'])}{', unique' if idx['unique'] else ''})"
+            for idx in info["indexes"]
+        ]
+        if index_strs:
+            lines.append(f"  índices: {'; '.join(index_strs)}")
+    return "\n".join(lines)
+
+
+class SchemaSnapshot(NamedTuple):
+    """Prompt text, structured schema and fingerprint taken from one refresh."""
+    text: str
+    schema: Dict[str, dict]
+    fingerprint: str
+
+
+class MongoSchemaInferrer:
+    """
+    Infers and caches the schema of one Mongo database.
+
+    Sample size, worker count, TTL and the overall time budget are read from
+    ``MONGO_SCHEMA_SAMPLE_SIZE``, ``MONGO_SCHEMA_WORKERS``, ``MONGO_SCHEMA_TTL``
+    (seconds) and ``MONGO_SCHEMA_TIMEOUT_MS`` unless given explicitly.
+    """
+
+    def __init__(self, db, sample_size: Optional[int] = None, workers: Optional[int] = None,
+                 ttl: Optional[int] = None, timeout_ms: Optional[int] = None):
+        self.db = db
+        self.sample_size = sample_size if sample_size is not None else env_int("MONGO_SCHEMA_SAMPLE_SIZE", 100)
+        self.workers = workers if workers is not None else env_int("MONGO_SCHEMA_WORKERS", 8)
+        self.ttl = ttl if ttl is not None else env_int("MONGO_SCHEMA_TTL", 300)
+        self.timeout_ms = timeout_ms if timeout_ms is not None else env_int("MONGO_SCHEMA_TIMEOUT_MS", 5000)
+        # _lock protege el estado; _refresh_lock serializa el muestreo sin bloquear a quien lee la caché
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._schema: Dict[str, dict] = {}
+        self._expires: Dict[str, float] = {}
+        self._snapshot: Optional[SchemaSnapshot] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Hash of the collection names, indexes and validators currently cached."""
+        snapshot = self._snapshot
+        return snapshot.fingerprint if snapshot is not None else None
+
+    def snapshot(self) -> SchemaSnapshot:
+        """
+        Returns the schema text, structure and fingerprint of a single refresh.
+
+        Collections whose TTL expired (or that are new) are sampled again
+        without holding the cache lock; concurrent callers wait for that
+        refresh instead of sampling the same collections twice.
+        """
+        # list_collection_names es barato y detecta colecciones creadas o eliminadas
+        names = set(self.db.list_collection_names())
+        with self._lock:
+            if self._snapshot is not None and not self._pending(names, time.monotonic()):
+                self.hits += 1
+                return self._snapshot
+        with self._refresh_lock:
+            now = time.monotonic()
+            with self._lock:
+                stale = self._pending(names, now)
+                if self._snapshot is not None and not stale:
+                    # Otro hilo acaba de refrescar
+                    self.hits += 1
+                    return self._snapshot
+                self.misses += 1
+            sampled = self._sample([name for name in stale if name in names])
+            with self._lock:
+                for name in set(self._schema) - names:
+                    self._schema.pop(name, None)
+                    self._expires.pop(name, None)
+                for name, info in sampled.items():
+                    self._schema[name] = info
+                    if "error" not in info:
+                        self._expires[name] = now + self.ttl
+                    else:
+                        # Los errores no se cachean: se reintenta en la siguiente pregunta
+                        self._expires.pop(name, None)
+                schema = dict(self._schema)
+                self._snapshot = SchemaSnapshot(format_schema(schema), schema, _schema_fingerprint(schema))
+                return self._snapshot
+
+    def get_schema(self) -> Dict[str, dict]:
+        """Returns the (possibly cached) inferred schema for every collection."""
+        return self.snapshot().schema
+
+    def get_schema_context(self) -> str:
+        """Returns the compact schema text for the generation prompt."""
+        return self.snapshot().text
+
+    def invalidate(self, collection: Optional[str] = None):
+        """Forces re-inference of one collection, or of all of them."""
+        with self._lock:
+            if collection is None:
+                self._expires.clear()
+            else:
+                self._expires.pop(collection, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "collections": len(self._schema),
+                "fingerprint": self.fingerprint,
+            }
+
+    def _pending(self, names: set, now: float) -> set:
+        """Collections to sample (expired or new) or to drop."""
+        stale = {name for name in names if self._expires.get(name, 0) <= now or name not in self._schema}
+        return stale | (set(self._schema) - names)
+
+    def _sample(self, names: List[str]) -> Dict[str, dict]:
+        if not names:
+            return {}
+        # Sin "with": el executor no debe esperar a las colecciones que agotaron el tiempo
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(names))))
+        try:
+            futures = {
+                executor.submit(infer_collection_schema, self.db[name], self.sample_size, self.timeout_ms): name
+                for name in names
+            }
+            done, not_done = wait(futures, timeout=self.timeout_ms / 1000.0)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        sampled = {}
+        for future in done:
+            try:
+                sampled[futures[future]] = future.result()
+            except Exception as e:
+                sampled[futures[future]] = {"error": str(e)}
+        for future in not_done:
+            sampled[futures[future]] = {"error": "timeout"}
+        return sampled
+
+
+def _schema_fingerprint(schema: Dict[str, dict]) -> str:
+    # Solo metadatos estables: los campos de una muestra aleatoria cambian entre refrescos
+    digest = hashlib.sha256()
+    for name in sorted(schema):
+        info = schema[name]
+        digest.update(name.encode("utf-8"))
+        for index in sorted(info.get("indexes", []), key=lambda idx: idx["name"]):
+            digest.update(f"{index['name']}:{','.join(index['keys'])}:{index['unique']};".encode("utf-8"))
+        if info.get("validator") is not None:
+            digest.update(json.dumps(info["validator"], sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"|")
+    return digest.hexdigest()
+
+
+_inferrers: Dict[tuple, MongoSchemaInferrer] = {}
+_inferrers_lock = threading.Lock()
+
+
+def get_schema_inferrer(mongo_uri: str, db_name: str) -> MongoSchemaInferrer:
+    """Returns the process-wide inferrer for ``db_name`` on ``mongo_uri``."""
+    key = (mongo_uri, db_name)
+    inferrer = _inferrers.get(key)
+    if inferrer is not None:
+        return inferrer
+    with _inferrers_lock:
+        inferrer = _inferrers.get(key)
+        if inferrer is None:
+            inferrer = MongoSchemaInferrer(get_mongo_client(mongo_uri)[db_name])
+            _inferrers[key] = inferrer
+        return inferrer
+
+
+def known_schema_fingerprint(mongo_uri: str, db_name: str) -> Optional[str]:
+    """Schema fingerprint last inferred for ``db_name``, without sampling (None before the first question)."""
+    inferrer = _inferrers.get((mongo_uri, db_name))
+    return inferrer.fingerprint if inferrer is not None else None
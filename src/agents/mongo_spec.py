@@ -0,0 +1,410 @@
+"""
+Declarative query specs for the Mongo agent.
+
+The LLM answers with a JSON object instead of Python code::
+
+    {"collection": "orders", "operation": "find",
+     "filter": {"status": "pending"}, "projection": {"user_name": 1},
+     "sort": {"total_amount": -1}, "limit": 5}
+
+``parse_spec`` / ``validate_spec`` turn it into a normalized spec:
+- only ``find``, ``count`` and ``aggregate`` are allowed;
+- server-side JavaScript and write stages are rejected;
+- ``limit`` is kept only when it fits under the document cap, for aggregates
+  too (a trailing ``$limit`` stage); otherwise the cap applies when it runs;
+- a projection is always applied (``_id`` is dropped from aggregates that
+  return whole documents);
+- ``$lookup`` / ``$graphLookup`` / ``$unionWith`` may only read known collections.
+
+Normalized specs serialize to a canonical string (``spec_text``), which is
+what the question and result caches key on. ``check_indexes`` tells whether
+the query can use an index before it runs. ``execute_spec`` /
+``aexecute_spec`` run it with ``maxTimeMS`` on PyMongo's sync or async
+client, and ``explain_spec`` returns the query plan.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from bson import json_util
+
+from src.utils.config import env_int
+
+OPERATIONS = ("find", "count", "aggregate")
+SPEC_KEYS = {"collection", "operation", "filter", "projection", "sort", "limit", "skip", "pipeline"}
+# Ejecutan JavaScript en el servidor o escriben datos
+FORBIDDEN_OPERATORS = {"$where", "$function", "$accumulator", "$out", "$merge"}
+DEFAULT_PROJECTION = {"_id": 0}
+# Etapas tras las que el pipeline ya no devuelve los documentos originales
+SHAPING_STAGES = {
+    "$project", "$group", "$count", "$replaceRoot", "$replaceWith", "$facet",
+    "$bucket", "$bucketAuto", "$sortByCount", "$unset",
+}
+
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.IGNORECASE | re.DOTALL)
+
+
+class SpecError(ValueError):
+    """The generated spec is malformed or not allowed."""
+
+
+def max_docs() -> int:
+    """Maximum documents returned per query (``MONGO_MAX_DOCS``)."""
+    return max(1, env_int("MONGO_MAX_DOCS", 1000))
+
+
+def parse_spec(content: str) -> dict:
+    """
+    Extracts the JSON spec from an LLM response (```json block or bare object).
+
+    Extended JSON such as ``{"$date": ...}`` or ``{"$oid": ...}`` is decoded to BSON types.
+    """
+    match = _JSON_BLOCK_RE.search(content)
+    if match:
+        raw = match.group(1)
+    else:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            raise SpecError("No se encontró un objeto JSON en la respuesta")
+        raw = content[start:end + 1]
+    try:
+        spec = json_util.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise SpecError(f"JSON inválido: {e}") from e
+    if not isinstance(spec, dict):
+        raise SpecError("La especificación debe ser un objeto JSON")
+    return spec
+
+
+def _check_operators(value, where: str):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in FORBIDDEN_OPERATORS:
+                raise SpecError(f"Operador no permitido en {where}: {key}")
+            _check_operators(item, where)
+    elif isinstance(value, list):
+        for item in value:
+            _check_operators(item, where)
+
+
+def _normalize_sort(sort) -> List[Tuple[str, int]]:
+    if sort is None:
+        return []
+    items = sort.items() if isinstance(sort, dict) else sort
+    normalized = []
+    try:
+        for field, direction in items:
+            direction = -1 if str(direction).lower() in ("-1", "desc", "descending") else 1
+            normalized.append((str(field), direction))
+    except (TypeError, ValueError) as e:
+        raise SpecError("'sort' debe ser un objeto {campo: 1|-1}") from e
+    return normalized
+
+
+def validate_spec(spec: dict, collections: Optional[List[str]] = None) -> dict:
+    """
+    Validates a parsed spec and returns its normalized form.
+
+    Args:
+        spec: Parsed spec from ``parse_spec``.
+        collections: Existing collection names; unknown collections are rejected.
+
+    Raises:
+        SpecError: If the spec is invalid or uses forbidden operators.
+    """
+    unknown = set(spec) - SPEC_KEYS
+    if unknown:
+        raise SpecError(f"Campos desconocidos en la especificación: {', '.join(sorted(unknown))}")
+    collection = spec.get("collection")
+    if not isinstance(collection, str) or not collection:
+        raise SpecError("Falta 'collection'")
+    if collections is not None and collection not in collections:
+        raise SpecError(f"La colección '{collection}' no existe")
+    operation = spec.get("operation", "find")
+    if operation not in OPERATIONS:
+        raise SpecError(f"Operación no permitida: {operation}")
+
+    cap = max_docs()
+    normalized = {"collection": collection, "operation": operation}
+
+    if operation == "aggregate":
+        pipeline = spec.get("pipeline")
+        if not isinstance(pipeline, list) or not all(isinstance(stage, dict) and len(stage) == 1 for stage in pipeline):
+            raise SpecError("'pipeline' debe ser una lista de etapas {\"$etapa\": ...}")
+        _check_operators(pipeline, "pipeline")
+        if collections is not None:
+            for source in _pipeline_sources(pipeline):
+                if source not in collections:
+                    raise SpecError(f"La colección '{source}' (en $lookup/$unionWith) no existe")
+        pipeline = list(pipeline)
+        limits = [_as_limit(spec.get("limit"))] if spec.get("limit") is not None else []
+        # El $limit final pasa a 'limit': execute_spec lo vuelve a añadir (con el tope si no hay)
+        while pipeline and "$limit" in pipeline[-1]:
+            limits.append(_as_limit(pipeline.pop()["$limit"]))
+        if not any(next(iter(stage)) in SHAPING_STAGES for stage in pipeline):
+            # Devuelve documentos completos: misma proyección por defecto que find
+            pipeline.append({"$project": dict(DEFAULT_PROJECTION)})
+        normalized["pipeline"] = pipeline
+        limits = [limit for limit in limits if limit]
+        if limits and min(limits) <= cap:
+            normalized["limit"] = min(limits)
+        return normalized
+
+    query_filter = spec.get("filter") or {}
+    if not isinstance(query_filter, dict):
+        raise SpecError("'filter' debe ser un objeto")
+    _check_operators(query_filter, "filter")
+    normalized["filter"] = query_filter
+    if operation == "count":
+        return normalized
+
+    projection = spec.get("projection")
+    if projection is not None and not isinstance(projection, dict):
+        raise SpecError("'projection' debe ser un objeto")
+    projection = dict(projection or {})
+    if not projection:
+        projection = dict(DEFAULT_PROJECTION)
+    elif "_id" not in projection and all(v in (1, True) for v in projection.values()):
+        projection["_id"] = 0
+    _check_operators(projection, "projection")
+    normalized["projection"] = projection
+
+    sort = _normalize_sort(spec.get("sort"))
+    if sort:
+        normalized["sort"] = sort
+    skip = spec.get("skip") or 0
+    limit = spec.get("limit")
+    try:
+        skip = int(skip)
+        limit = int(limit) if limit is not None else 0
+    except (TypeError, ValueError) as e:
+        raise SpecError("'limit' y 'skip' deben ser enteros") from e
+    if skip < 0 or limit < 0:
+        raise SpecError("'limit' y 'skip' no pueden ser negativos")
+    if skip:
+        normalized["skip"] = skip
+    if limit and limit <= cap:
+        normalized["limit"] = limit
+    return normalized
+
+
+def _as_limit(value) -> int:
+    try:
+        limit = int(value)
+    except (TypeError, ValueError) as e:
+        raise SpecError("'limit' debe ser un entero") from e
+    if limit < 0:
+        raise SpecError("'limit' no puede ser negativo")
+    return limit
+
+
+def _pipeline_sources(pipeline: list) -> List[str]:
+    """Collections read by ``$lookup`` / ``$graphLookup`` / ``$unionWith`` stages, nested pipelines included."""
+    sources = []
+    for stage in pipeline:
+        for op, body in stage.items():
+            if op in ("$lookup", "$graphLookup") and isinstance(body, dict):
+                if body.get("from"):
+                    sources.append(body["from"])
+                sources += _pipeline_sources(body.get("pipeline") or [])
+            elif op == "$unionWith":
+                if isinstance(body, str):
+                    sources.append(body)
+                elif isinstance(body, dict):
+                    if body.get("coll"):
+                        sources.append(body["coll"])
+                    sources += _pipeline_sources(body.get("pipeline") or [])
+            elif op == "$facet" and isinstance(body, dict):
+                for branch in body.values():
+                    sources += _pipeline_sources(branch if isinstance(branch, list) else [])
+    return [source for source in sources if isinstance(source, str)]
+
+
+def spec_text(spec: dict) -> str:
+    """Canonical Extended JSON of a normalized spec (stable across key order)."""
+    return json_util.dumps(spec, sort_keys=True, ensure_ascii=False)
+
+
+def load_spec(text: str, collections: Optional[List[str]] = None) -> dict:
+    """Parses and validates a spec stored as text (e.g. from the query cache)."""
+    return validate_spec(parse_spec(text), collections)
+
+
+def spec_collections(spec: dict) -> Tuple[str, ...]:
+    """Collections read by the spec, including ``$lookup`` / ``$unionWith`` / ``$graphLookup`` sources."""
+    names = {spec["collection"], *_pipeline_sources(spec.get("pipeline", []))}
+    names.discard("")
+    return tuple(sorted(names))
+
+
+# Operadores, etapas y variables cuyo resultado cambia sin que cambien los datos
+VOLATILE_OPERATORS = {"$rand", "$sample", "$sampleRate"}
+VOLATILE_VARIABLES = {"$$NOW", "$$CLUSTER_TIME"}
+
+
+def spec_is_volatile(spec) -> bool:
+    """Whether the spec reads the clock (``$$NOW``) or random numbers (``$rand``, ``$sample``)."""
+    if isinstance(spec, dict):
+        return any(key in VOLATILE_OPERATORS or spec_is_volatile(item) for key, item in spec.items())
+    if isinstance(spec, list):
+        return any(spec_is_volatile(item) for item in spec)
+    return isinstance(spec, str) and spec in VOLATILE_VARIABLES
+
+
+def _filter_fields(query_filter: dict) -> List[str]:
+    fields = []
+    for key, value in query_filter.items():
+        if key == "$and" and isinstance(value, list):
+            for clause in value:
+                if isinstance(clause, dict):
+                    fields.extend(_filter_fields(clause))
+        elif not key.startswith("$"):
+            fields.append(key)
+    return fields
+
+
+def check_indexes(spec: dict, indexes: List[dict], estimated_count: Optional[int] = None) -> dict:
+    """
+    Checks whether the filter or sort of ``spec`` can use one of ``indexes``.
+
+    Args:
+        spec: Normalized spec.
+        indexes: Index descriptions as produced by the schema inferrer (``{"name", "keys"}``).
+        estimated_count: Estimated documents in the collection.
+
+    Returns:
+        ``{"index": name or None, "collection_scan": bool, "fields": [...], "estimated_count": n}``.
+        A query with no filter and no sort is not a scan problem (it stops at ``limit``).
+    """
+    if spec["operation"] == "aggregate":
+        pipeline = spec["pipeline"]
+        first = pipeline[0] if pipeline else {}
+        query_filter = first.get("$match", {}) if isinstance(first.get("$match"), dict) else {}
+        sort = list(first["$sort"].items()) if isinstance(first.get("$sort"), dict) else []
+        bounded = bool(first) and next(iter(first)) in ("$limit", "$sample")
+    else:
+        query_filter = spec.get("filter", {})
+        sort = spec.get("sort", [])
+        bounded = spec["operation"] == "find" and not query_filter and not sort
+
+    filter_fields = _filter_fields(query_filter)
+    sort_fields = [field for field, _ in sort[:1]]
+    candidates = filter_fields or sort_fields
+    index_name = None
+    for index in indexes:
+        if index.get("keys") and index["keys"][0] in candidates:
+            index_name = index["name"]
+            break
+    count_all = spec["operation"] == "count" and not query_filter
+    return {
+        "index": index_name,
+        "collection_scan": index_name is None and not bounded and not count_all,
+        "fields": candidates,
+        "estimated_count": estimated_count,
+    }
+
+
+def enforce_scan_limit(check: dict):
+    """Rejects collection scans over ``MONGO_MAX_SCAN_DOCS`` documents (0 disables the check)."""
+    limit = env_int("MONGO_MAX_SCAN_DOCS", 100000)
+    count = check.get("estimated_count")
+    if limit and check["collection_scan"] and count is not None and count > limit:
+        raise SpecError(
+            f"La consulta recorrería ~{count} documentos sin índice "
+            f"(campos: {', '.join(check['fields']) or 'ninguno'}); límite MONGO_MAX_SCAN_DOCS={limit}"
+        )
+
+
+def _fetch_limit(spec: dict, cap: int) -> int:
+    # Sin límite propio (o por encima del tope) se pide una fila de sondeo: si llega, el tope recortó
+    return min(spec.get("limit", cap + 1), cap + 1)
+
+
+def _pipeline_with_cap(spec: dict, cap: int) -> list:
+    return list(spec["pipeline"]) + [{"$limit": _fetch_limit(spec, cap)}]
+
+
+def _cap(docs: list, cap: int):
+    return docs[:cap], len(docs) > cap
+
+
+def execute_spec(db, spec: dict, max_time_ms: Optional[int] = None):
+    """
+    Runs a normalized spec with ``maxTimeMS`` on a PyMongo database.
+
+    Returns:
+        Tuple ``(result, more_rows)``: a list of documents (or an int for
+        ``count``) and whether the document cap cut the result.
+    """
+    max_time_ms = max_time_ms if max_time_ms is not None else env_int("MONGO_MAX_TIME_MS", 10000)
+    collection = db[spec["collection"]]
+    cap = max_docs()
+    if spec["operation"] == "count":
+        if not spec["filter"]:
+            # Sin filtro basta con los metadatos de la colección
+            return collection.estimated_document_count(maxTimeMS=max_time_ms), False
+        return collection.count_documents(spec["filter"], maxTimeMS=max_time_ms), False
+    if spec["operation"] == "aggregate":
+        docs = list(collection.aggregate(_pipeline_with_cap(spec, cap), maxTimeMS=max_time_ms))
+        return _cap(docs, cap)
+    cursor = collection.find(
+        spec["filter"], spec["projection"],
+        sort=spec.get("sort") or None, skip=spec.get("skip", 0),
+        limit=_fetch_limit(spec, cap),
+        max_time_ms=max_time_ms,
+    )
+    return _cap(list(cursor), cap)
+
+
+async def aexecute_spec(db, spec: dict, max_time_ms: Optional[int] = None):
+    """``execute_spec`` for an ``AsyncMongoClient`` database."""
+    max_time_ms = max_time_ms if max_time_ms is not None else env_int("MONGO_MAX_TIME_MS", 10000)
+    collection = db[spec["collection"]]
+    cap = max_docs()
+    if spec["operation"] == "count":
+        if not spec["filter"]:
+            return await collection.estimated_document_count(maxTimeMS=max_time_ms), False
+        return await collection.count_documents(spec["filter"], maxTimeMS=max_time_ms), False
+    if spec["operation"] == "aggregate":
+        cursor = await collection.aggregate(_pipeline_with_cap(spec, cap), maxTimeMS=max_time_ms)
+        return _cap(await cursor.to_list(None), cap)
+    cursor = collection.find(
+        spec["filter"], spec["projection"],
+        sort=spec.get("sort") or None, skip=spec.get("skip", 0),
+        limit=_fetch_limit(spec, cap),
+        max_time_ms=max_time_ms,
+    )
+    return _cap(await cursor.to_list(None), cap)
+
+
+def explain_spec(db, spec: dict, verbosity: str = "queryPlanner") -> dict:
+    """Query plan of a normalized spec (``explain`` command, nothing is returned to the caller)."""
+    name = spec["collection"]
+    if spec["operation"] == "count":
+        command = {"count": name, "query": spec["filter"]}
+    elif spec["operation"] == "aggregate":
+        command = {"aggregate": name, "pipeline": _pipeline_with_cap(spec, max_docs()), "cursor": {}}
+    else:
+        command = {"find": name, "filter": spec["filter"], "projection": spec["projection"],
+                   "limit": spec.get("limit", max_docs())}
+        if spec.get("sort"):
+            command["sort"] = dict(spec["sort"])
+        if spec.get("skip"):
+            command["skip"] = spec["skip"]
+    return db.command("explain", command, verbosity=verbosity)
+
+
+def summarize_explain(plan: dict) -> Dict[str, object]:
+    """Winning plan stages of an explain result, e.g. ``{"stages": ["LIMIT", "IXSCAN"]}``."""
+    stages = []
+    node = (plan.get("queryPlanner") or {}).get("winningPlan") or {}
+    node = node.get("queryPlan", node)
+    while isinstance(node, dict) and node:
+        if node.get("stage"):
+            stages.append(node["stage"])
+        node = node.get("inputStage") or (node.get("inputStages") or [None])[0]
+    return {"stages": stages, "collection_scan": "COLLSCAN" in stages}
+
+
+def to_json(value) -> str:
+    """Serializes a result with BSON-aware JSON (ObjectId, dates...)."""
+    return json_util.dumps(value)
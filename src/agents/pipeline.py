@@ -0,0 +1,121 @@
+"""
+One pipeline definition shared by the sync and async APIs of both agents.
+
+Each agent describes its generate-execute-interpret pipeline once, as a step
+generator: a plain generator that yields streaming events (see
+``src.agents.streaming``) and, whenever it needs I/O, an ``Io`` or ``Stream``
+request instead of doing the call itself. ``run_steps`` performs those
+requests with blocking calls; ``arun_steps`` awaits the async variants (or
+runs the blocking call in a worker thread). The result of each request is sent
+back into the generator, and an exception is raised at the ``yield`` that
+asked for it, so the steps handle errors with ordinary ``try`` blocks.
+
+Sub-steps compose with ``yield from`` and return values normally.
+"""
+import asyncio
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Generator, Iterator, NamedTuple, Optional
+
+from src.agents.streaming import ANSWER_TOKEN, astream_answer, event, stream_answer
+
+
+class Io(NamedTuple):
+    """
+    A call requested by a step; the driver sends back its return value.
+
+    Args:
+        call: Blocking call without arguments (``functools.partial``).
+        acall: Coroutine function for the async driver; None runs ``call`` in a worker thread.
+    """
+    call: Callable[[], object]
+    acall: Optional[Callable[[], Awaitable]] = None
+
+
+class Stream(NamedTuple):
+    """
+    An iterator requested by a step, e.g. the interpretation tokens.
+
+    Every item is emitted right away as ``to_event(item)``; the list of
+    items is sent back to the step once the iterator is exhausted.
+    """
+    call: Callable[[], Iterator]
+    acall: Callable[[], AsyncIterator]
+    to_event: Callable[[object], dict]
+
+
+Steps = Generator[object, object, None]
+
+
+def invoke(llm, prompt: str) -> Io:
+    """LLM call: ``invoke`` in the sync pipeline, ``ainvoke`` in the async one."""
+    # ainvoke se resuelve al llamar: un cliente solo síncrono (stub de tests) sirve a la ruta síncrona
+    return Io(partial(llm.invoke, prompt), lambda: llm.ainvoke(prompt))
+
+
+def answer_tokens(llm, prompt: str, span=None) -> Stream:
+    """Interpretation streamed as ``ANSWER_TOKEN`` events; the step receives the list of chunks."""
+    return Stream(partial(stream_answer, llm, prompt, span), partial(astream_answer, llm, prompt, span),
+                  lambda text: event(ANSWER_TOKEN, text=text))
+
+
+def run_steps(steps: Steps) -> Iterator[dict]:
+    """Runs a step generator with blocking I/O, yielding its events."""
+    reply, error = None, None
+    try:
+        while True:
+            try:
+                request = steps.throw(error) if error is not None else steps.send(reply)
+            except StopIteration:
+                return
+            reply, error = None, None
+            if isinstance(request, Io):
+                try:
+                    reply = request.call()
+                except Exception as e:
+                    error = e
+            elif isinstance(request, Stream):
+                items = []
+                try:
+                    for item in request.call():
+                        items.append(item)
+                        yield request.to_event(item)
+                except Exception as e:
+                    error = e
+                reply = items
+            else:
+                yield request
+    finally:
+        steps.close()
+
+
+async def arun_steps(steps: Steps) -> AsyncIterator[dict]:
+    """Runs a step generator without blocking the event loop, yielding its events."""
+    reply, error = None, None
+    try:
+        while True:
+            try:
+                request = steps.throw(error) if error is not None else steps.send(reply)
+            except StopIteration:
+                return
+            reply, error = None, None
+            if isinstance(request, Io):
+                try:
+                    if request.acall is not None:
+                        reply = await request.acall()
+                    else:
+                        reply = await asyncio.to_thread(request.call)
+                except Exception as e:
+                    error = e
+            elif isinstance(request, Stream):
+                items = []
+                try:
+                    async for item in request.acall():
+                        items.append(item)
+                        yield request.to_event(item)
+                except Exception as e:
+                    error = e
+                reply = items
+            else:
+                yield request
+    finally:
+        steps.close()
@@ -0,0 +1,304 @@
+"""
+Cache from normalized question text to a previously generated and executed query.
+
+Most traffic is the same few dozen questions phrased slightly differently. A
+hit returns the SQL / Mongo query spec that already executed successfully for an
+equivalent question, so the pipeline can skip the generation LLM call and go
+straight to execution. Entries are scoped by backend and schema fingerprint,
+evicted by LRU + TTL and persisted to a local SQLite file.
+
+A similar (not identical) question only reuses a query when the words that
+differ are neither literals of that query nor negation or comparison words:
+"clientes que no han comprado" or "el pedido menor" need a different query
+even though almost every token matches.
+"""
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+
+from src.agents.schema_cache import default_cache_dir
+from src.utils.config import env_int
+
+# Palabras vacías que no cambian el significado de la pregunta
+STOPWORDS = {
+    "a", "al", "de", "del", "el", "la", "las", "los", "lo", "un", "una", "unos", "unas",
+    "en", "y", "o", "que", "por", "para", "con", "me", "mi", "se", "su", "sus", "es",
+    "hay", "esta", "estan", "son", "existen", "dime", "muestra", "muestrame", "lista", "listame",
+    "dame", "favor", "porfavor",
+    "the", "of", "in", "and", "is", "are", "show", "list", "me", "please",
+}
+
+# Negación, comparación y orden (sin tildes): si difieren, la consulta cambia aunque casi todo coincida
+MEANING_WORDS = {
+    "no", "ni", "sin", "nunca", "jamas", "nadie", "nada", "ningun", "ninguno", "ninguna", "excepto", "salvo",
+    "mas", "menos", "mayor", "mayores", "menor", "menores", "maximo", "maxima", "minimo", "minima",
+    "superior", "inferior", "encima", "debajo", "antes", "despues", "desde", "hasta",
+    "mejor", "mejores", "peor", "peores", "alto", "alta", "altos", "altas", "bajo", "baja", "bajos", "bajas",
+    "primer", "primero", "primeros", "primera", "primeras", "ultimo", "ultimos", "ultima", "ultimas",
+    "ascendente", "descendente", "caro", "caros", "barato", "baratos",
+    "not", "without", "never", "none", "except", "more", "less", "fewer", "most", "least",
+    "greater", "greatest", "higher", "highest", "lower", "lowest", "max", "min", "maximum", "minimum",
+    "above", "below", "over", "under", "before", "after", "since", "until",
+    "best", "worst", "top", "bottom", "first", "last", "asc", "desc",
+}
+
+# Cada cuántos aciertos (o segundos) se escriben en SQLite los last_used pendientes
+TOUCH_FLUSH_EVERY = 50
+TOUCH_FLUSH_SECONDS = 30.0
+
+_LITERAL_RE = re.compile(r"'([^']*)'|\"([^\"]*)\"|\b(\d+(?:\.\d+)?)\b")
+
+
+def fold_text(text: str) -> str:
+    """Lowercases, strips accents and replaces punctuation with spaces."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_question(text: str) -> str:
+    """Folded question without stopwords, used as the exact-match key."""
+    return " ".join(t for t in fold_text(text).split() if t not in STOPWORDS)
+
+
+def _literal_tokens(query_text: str) -> set:
+    """Folded tokens of the string and numeric literals inside a generated query."""
+    tokens = set()
+    for match in _LITERAL_RE.finditer(query_text):
+        literal = next(g for g in match.groups() if g is not None)
+        tokens.update(fold_text(literal).split())
+    return tokens
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class CachedQuery(NamedTuple):
+    query: str
+    question: str
+    similarity: float
+
+
+class QueryCache:
+    """
+    LRU + TTL cache of (backend, schema fingerprint, question) -> query, backed by SQLite.
+
+    Args:
+        path: SQLite file. None keeps the cache in memory only.
+        max_entries: LRU capacity (``QUERY_CACHE_MAX_ENTRIES``).
+        ttl: Seconds an entry stays valid (``QUERY_CACHE_TTL``).
+        threshold: Minimum token Jaccard similarity, in percent (``QUERY_CACHE_SIMILARITY``).
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_entries: Optional[int] = None,
+                 ttl: Optional[int] = None, threshold: Optional[int] = None):
+        self.max_entries = max_entries if max_entries is not None else env_int("QUERY_CACHE_MAX_ENTRIES", 500)
+        self.ttl = ttl if ttl is not None else env_int("QUERY_CACHE_TTL", 7 * 24 * 3600)
+        self.threshold = (threshold if threshold is not None else env_int("QUERY_CACHE_SIMILARITY", 85)) / 100.0
+        self._lock = threading.Lock()
+        # key -> dict(query, question, tokens, literals, created_at)
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        # key -> last_used aún no escrito: un acierto no hace commit en SQLite
+        self._pending_touches: Dict[tuple, float] = {}
+        self._touches_since_flush = 0
+        self._last_flush = time.monotonic()
+        self._conn = None
+        if path is not None:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                " backend TEXT, fingerprint TEXT, normalized TEXT, question TEXT,"
+                " query TEXT, created_at REAL, last_used REAL,"
+                " PRIMARY KEY (backend, fingerprint, normalized))"
+            )
+            self._conn.commit()
+            self._load()
+
+    def lookup(self, backend: str, fingerprint: str, question: str) -> Optional[CachedQuery]:
+        """Returns the cached query for an equivalent question, or None."""
+        normalized = normalize_question(question)
+        tokens = set(normalized.split())
+        now = time.time()
+        with self._lock:
+            key = (backend, fingerprint, normalized)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["created_at"] <= self.ttl:
+                self._touch(key, now)
+                self.hits += 1
+                return CachedQuery(entry["query"], entry["question"], 1.0)
+
+            best_key, best_score = None, 0.0
+            for other_key, other in self._entries.items():
+                if other_key[0] != backend or other_key[1] != fingerprint:
+                    continue
+                if now - other["created_at"] > self.ttl:
+                    continue
+                score = jaccard(tokens, other["tokens"])
+                if score < self.threshold or score <= best_score:
+                    continue
+                # Si la diferencia entre preguntas toca un literal de la consulta
+                # (p. ej. 'pending' vs 'completed'), una negación o una comparación
+                # ("más"/"menos"), la consulta cacheada no sirve
+                differing = tokens ^ other["tokens"]
+                if (differing & other["literals"] or differing & MEANING_WORDS
+                        or any(t.isdigit() for t in differing)):
+                    continue
+                best_key, best_score = other_key, score
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            entry = self._entries[best_key]
+            self._touch(best_key, now)
+            self.hits += 1
+            self.similar_hits += 1
+            return CachedQuery(entry["query"], entry["question"], best_score)
+
+    def store(self, backend: str, fingerprint: str, question: str, query: str):
+        """Records a query that executed successfully for ``question``."""
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            key = (backend, fingerprint, normalized)
+            self._entries[key] = self._make_entry(question, normalized, query, now)
+            self._entries.move_to_end(key)
+            self._pending_touches.pop(key, None)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (backend, fingerprint, normalized, question, query, now, now),
+                )
+            self._evict(now)
+            self._flush_touches()
+
+    def discard(self, backend: str, fingerprint: str, question: str, query: str):
+        """Removes every entry in the scope that maps to ``query`` (e.g. it stopped working)."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items()
+                        if k[0] == backend and k[1] == fingerprint and e["query"] == query]:
+                self._delete(key)
+            self._flush_touches()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+            }
+
+    def flush(self):
+        """Writes the pending access times to SQLite."""
+        with self._lock:
+            self._flush_touches()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._flush_touches()
+                self._conn.close()
+                self._conn = None
+
+    def _make_entry(self, question: str, normalized: str, query: str, created_at: float) -> dict:
+        return {
+            "question": question,
+            "query": query,
+            "tokens": set(normalized.split()),
+            "literals": _literal_tokens(query),
+            "created_at": created_at,
+        }
+
+    def _touch(self, key: tuple, now: float):
+        self._entries.move_to_end(key)
+        if self._conn is None:
+            return
+        # last_used solo ordena el LRU al recargar: se escribe por lotes
+        self._pending_touches[key] = now
+        self._touches_since_flush += 1
+        if (self._touches_since_flush >= TOUCH_FLUSH_EVERY
+                or time.monotonic() - self._last_flush >= TOUCH_FLUSH_SECONDS):
+            self._flush_touches()
+
+    def _flush_touches(self):
+        """Writes pending access times and commits every change made so far (caller holds the lock)."""
+        self._last_flush = time.monotonic()
+        self._touches_since_flush = 0
+        if self._conn is None:
+            return
+        if self._pending_touches:
+            self._conn.executemany(
+                "UPDATE query_cache SET last_used = ? WHERE backend = ? AND fingerprint = ? AND normalized = ?",
+                [(last_used, *key) for key, last_used in self._pending_touches.items()],
+            )
+            self._pending_touches.clear()
+        self._conn.commit()
+
+    def _delete(self, key: tuple):
+        self._entries.pop(key, None)
+        self._pending_touches.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute(
+                "DELETE FROM query_cache WHERE backend = ? AND fingerprint = ? AND normalized = ?", key
+            )
+
+    def _evict(self, now: float):
+        for key in [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl]:
+            self._delete(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._delete(oldest)
+
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT backend, fingerprint, normalized, question, query, created_at"
+            " FROM query_cache ORDER BY last_used"
+        ).fetchall()
+        now = time.time()
+        for backend, fingerprint, normalized, question, query, created_at in rows:
+            self._entries[(backend, fingerprint, normalized)] = self._make_entry(
+                question, normalized, query, created_at
+            )
+        self._evict(now)
+        self._conn.commit()
+
+
+_cache: Optional[QueryCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    """Process-wide cache persisted to ``CACHE_DIR/query_cache.sqlite3``."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryCache(default_cache_dir() / "query_cache.sqlite3")
+    return _cache
+
+
+def query_cache_stats() -> Dict[str, int]:
+    """Statistics of the process-wide cache (empty if it was never used)."""
+    if _cache is None:
+        return {}
+    return _cache.stats()
+
+
+def flush_query_cache():
+    """Writes the access times still pending in the process-wide cache."""
+    if _cache is not None:
+        _cache.flush()
@@ -0,0 +1,401 @@
+"""
+Result cache for generated queries with data-change invalidation.
+
+Entries are keyed by database scope (backend plus database URI / name, see
+``postgres_scope`` and ``mongo_scope``) and normalized SQL text / canonical
+Mongo query spec, and record the version of every table (or collection) the
+query reads. Versions are bumped by background listeners, one per database:
+
+- PostgreSQL: ``LISTEN table_changes`` fed by the statement-level triggers
+  installed by ``src/utils/setup_db.py`` on ``users``, ``products`` and ``orders``.
+- MongoDB: a database-wide change stream (requires a replica set).
+
+Tables without a live notification source fall back to a TTL, and so do
+queries whose result depends on the clock or on chance (``NOW()``,
+``CURRENT_DATE``, ``random()``...), which no data change would invalidate.
+Memory is bounded by the total serialized size of the cached results.
+"""
+import re
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from src.utils.config import env_int
+
+NOTIFY_CHANNEL = "table_changes"
+NOTIFY_TRIGGER_PREFIX = "notify_change_"
+WILDCARD = "*"
+
+# Función y triggers que publican el nombre de la tabla modificada en NOTIFY_CHANNEL
+NOTIFY_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{NOTIFY_CHANNEL}', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def notify_trigger_sql(table: str) -> str:
+    """DDL for the statement-level trigger that notifies changes on ``table``."""
+    return (
+        f"DROP TRIGGER IF EXISTS {NOTIFY_TRIGGER_PREFIX}{table} ON {table};\n"
+        f"CREATE TRIGGER {NOTIFY_TRIGGER_PREFIX}{table} "
+        f"AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+        f"FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();"
+    )
+
+
+# Funciones cuyo resultado cambia sin que cambien los datos (reloj, azar, secuencias)
+VOLATILE_SQL_FUNCTIONS = {
+    "clock_timestamp", "statement_timestamp", "transaction_timestamp", "timeofday", "now",
+    "random", "setseed", "gen_random_uuid", "uuid_generate_v4", "nextval", "currval", "lastval",
+}
+
+
+def postgres_scope(engine) -> str:
+    """Result cache scope of a PostgreSQL database: ``postgres:`` plus its URL without the password."""
+    return f"postgres:{engine.url.render_as_string(hide_password=True)}"
+
+
+def mongo_scope(mongo_uri: str, db_name: str) -> str:
+    """Result cache scope of a MongoDB database: ``mongo:`` plus the URI without credentials and the database name."""
+    return f"mongo:{re.sub(r'//[^/@]*@', '//', mongo_uri)}/{db_name}"
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapses whitespace and drops the trailing semicolon."""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+def sql_tables(sql: str) -> Tuple[str, ...]:
+    """
+    Tables the statement reads (schema and quotes removed; CTE names excluded).
+
+    Parsed with sqlglot like ``src.agents.sql_validation``, so ``EXTRACT(YEAR
+    FROM col)`` or ``FROM`` inside a string is not mistaken for a table. SQL
+    that does not parse maps to ``WILDCARD`` (invalidated by any change).
+    """
+    # sqlglot solo se importa con el agente SQL; el de MongoDB no lo necesita
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+    from src.agents.sql_validation import DIALECT
+
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=DIALECT) if s is not None]
+    except ParseError:
+        return (WILDCARD,)
+    tables, ctes = set(), set()
+    for statement in statements:
+        ctes.update(cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE))
+        tables.update(table.name.lower() for table in statement.find_all(exp.Table) if table.name)
+    return tuple(sorted(tables - ctes)) or (WILDCARD,)
+
+
+def sql_is_volatile(sql: str) -> bool:
+    """
+    Whether the statement reads the clock, random numbers or sequences.
+
+    Such results go stale without any data change, so they expire by TTL even
+    on notified tables. SQL that does not parse counts as volatile.
+    """
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+    from src.agents.sql_validation import DIALECT
+
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=DIALECT) if s is not None]
+    except ParseError:
+        return True
+    volatile_types = (exp.CurrentDate, exp.CurrentTime, exp.CurrentTimestamp, exp.Localtime,
+                      exp.Localtimestamp, exp.Rand, exp.Uuid)
+    for statement in statements:
+        for func in statement.find_all(exp.Func):
+            if isinstance(func, volatile_types):
+                return True
+            if isinstance(func, exp.Anonymous):
+                name = func.name.lower()
+                # age(x) es relativo a CURRENT_DATE; age(x, y) no
+                if name in VOLATILE_SQL_FUNCTIONS or (name == "age" and len(func.expressions) == 1):
+                    return True
+    return False
+
+
+class TableVersions:
+    """Per-(scope, table) version counters plus which tables have a live notification source."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[tuple, int] = {}
+        self._notified: Dict[str, set] = {}
+        self._global: Dict[str, int] = {}
+        self.bumps = 0
+
+    def bump(self, scope: str, table: Optional[str] = None):
+        """Marks ``table`` (or every table of the ``scope`` database if None) as changed."""
+        with self._lock:
+            self.bumps += 1
+            if table is None:
+                self._global[scope] = self._global.get(scope, 0) + 1
+            else:
+                key = (scope, table.lower())
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def snapshot(self, scope: str, tables: Iterable[str]) -> tuple:
+        with self._lock:
+            return (self._global.get(scope, 0),) + tuple(
+                self._versions.get((scope, t), 0) for t in tables
+            )
+
+    def set_notified(self, scope: str, tables: Iterable[str]):
+        with self._lock:
+            self._notified[scope] = {t.lower() for t in tables}
+
+    def is_notified(self, scope: str, tables: Iterable[str]) -> bool:
+        with self._lock:
+            notified = self._notified.get(scope, set())
+            if WILDCARD in notified:
+                return True
+            if WILDCARD in tables:
+                return False
+            return all(t in notified for t in tables)
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of query results, invalidated by table versions or TTL.
+
+    Every method takes the ``scope`` of the database the query ran on
+    (``postgres_scope`` / ``mongo_scope``), so two databases never share
+    entries, versions or notification state.
+
+    Args:
+        max_bytes: Total serialized size kept in memory (``RESULT_CACHE_MAX_BYTES``).
+        ttl: Lifetime in seconds for tables without notifications and for volatile queries (``RESULT_CACHE_TTL``).
+        max_entry_bytes: Larger results are never cached (``RESULT_CACHE_MAX_ENTRY_BYTES``).
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, ttl: Optional[int] = None,
+                 max_entry_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else env_int("RESULT_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        self.ttl = ttl if ttl is not None else env_int("RESULT_CACHE_TTL", 60)
+        self.max_entry_bytes = (max_entry_bytes if max_entry_bytes is not None
+                                else env_int("RESULT_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+        self.versions = TableVersions()
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, scope: str, key: str, tables: Tuple[str, ...]):
+        """Returns ``(True, value)`` if a still-valid result is cached, else ``(False, None)``."""
+        current = self.versions.snapshot(scope, tables)
+        notified = self.versions.is_notified(scope, tables)
+        with self._lock:
+            entry = self._entries.get((scope, key))
+            if entry is not None:
+                expires = entry["volatile"] or not notified
+                expired = expires and time.monotonic() - entry["created_at"] > self.ttl
+                if entry["versions"] == current and not expired:
+                    self._entries.move_to_end((scope, key))
+                    self.hits += 1
+                    return True, entry["value"]
+                self._remove((scope, key))
+            self.misses += 1
+            return False, None
+
+    def version_snapshot(self, scope: str, tables: Tuple[str, ...]) -> tuple:
+        """Versions to pass to ``put``; take it *before* executing the query."""
+        return self.versions.snapshot(scope, tables)
+
+    def put(self, scope: str, key: str, versions: tuple, value, size: int, volatile: bool = False):
+        """
+        Stores ``value`` (``size`` serialized bytes) computed at ``versions``.
+
+        ``volatile`` results (clock, random; see ``sql_is_volatile``) expire
+        after ``ttl`` even if their tables are notified.
+        """
+        if size > self.max_entry_bytes or size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove((scope, key))
+            self._entries[(scope, key)] = {
+                "value": value,
+                "size": size,
+                "versions": versions,
+                "volatile": volatile,
+                "created_at": time.monotonic(),
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.versions.bumps,
+            }
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+
+class PostgresChangeListener(threading.Thread):
+    """Background LISTEN on ``NOTIFY_CHANNEL`` that bumps table versions."""
+
+    def __init__(self, engine, versions: TableVersions, retry_seconds: float = 5.0):
+        super().__init__(name="pg-change-listener", daemon=True)
+        self.engine = engine
+        self.versions = versions
+        self.scope = postgres_scope(engine)
+        self.retry_seconds = retry_seconds
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+                conn = self.engine.dialect.loaded_dbapi.connect(*cargs, **cparams)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                # Solo las tablas con trigger instalado reciben notificaciones; el resto usa TTL
+                cursor.execute(
+                    "SELECT c.relname FROM pg_catalog.pg_trigger t "
+                    "JOIN pg_catalog.pg_class c ON c.oid = t.tgrelid "
+                    "WHERE t.tgname LIKE %s AND NOT t.tgisinternal",
+                    (f"{NOTIFY_TRIGGER_PREFIX}%",),
+                )
+                tables = [row[0] for row in cursor.fetchall()]
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                cursor.close()
+                # Cualquier cambio ocurrido antes del LISTEN pudo perderse
+                self.versions.bump(self.scope)
+                self.versions.set_notified(self.scope, tables)
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.versions.bump(self.scope, notify.payload)
+            except Exception:
+                self.versions.set_notified(self.scope, [])
+                self.versions.bump(self.scope)
+                self._stop_event.wait(self.retry_seconds)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+class MongoChangeListener(threading.Thread):
+    """Database-wide change stream that bumps collection versions (replica sets only)."""
+
+    def __init__(self, db, versions: TableVersions, scope: str, retry_seconds: float = 30.0):
+        super().__init__(name="mongo-change-listener", daemon=True)
+        self.db = db
+        self.versions = versions
+        self.scope = scope
+        self.retry_seconds = retry_seconds
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with self.db.watch(max_await_time_ms=1000) as stream:
+                    self.versions.bump(self.scope)
+                    self.versions.set_notified(self.scope, [WILDCARD])
+                    while not self._stop_event.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        collection = change.get("ns", {}).get("coll")
+                        self.versions.bump(self.scope, collection)
+            except Exception:
+                # Standalone sin change streams: se recurre al TTL
+                self.versions.set_notified(self.scope, [])
+                self.versions.bump(self.scope)
+                self._stop_event.wait(self.retry_seconds)
+
+
+_cache: Optional[ResultCache] = None
+_listeners: Dict[str, threading.Thread] = {}
+_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Process-wide result cache."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+
+def ensure_postgres_listener(engine):
+    """Starts the LISTEN/NOTIFY thread for ``engine`` once per process."""
+    if engine.dialect.name != "postgresql":
+        return
+    key = postgres_scope(engine)
+    with _lock:
+        if key not in _listeners:
+            listener = PostgresChangeListener(engine, get_result_cache().versions)
+            _listeners[key] = listener
+            listener.start()
+
+
+def ensure_mongo_listener(db, scope: str):
+    """Starts the change stream thread for ``db`` (``mongo_scope`` of its URI and name) once per process."""
+    with _lock:
+        if scope not in _listeners:
+            listener = MongoChangeListener(db, get_result_cache().versions, scope)
+            _listeners[scope] = listener
+            listener.start()
+
+
+def result_cache_stats() -> dict:
+    """Statistics of the process-wide cache (empty if it was never used)."""
+    if _cache is None:
+        return {}
+    return _cache.stats()
+
+
+def shutdown_result_cache():
+    """Stops every change listener thread."""
+    with _lock:
+        listeners = list(_listeners.values())
+        _listeners.clear()
+    for listener in listeners:
+        listener.stop()
@@ -0,0 +1,174 @@
+"""
+Compaction of query results before they are pasted into the interpretation prompt.
+
+Small results are passed verbatim. Results above the row or byte budget are
+replaced by the first rows plus per-column statistics computed over the whole
+result (count, min/max, sum/mean for numbers, top-k values for categories) and
+an explicit truncation marker, so the model can still answer totals correctly
+without evaluating a huge prompt. The full result string is left untouched
+for the caller (``raw_results``).
+
+Budgets come from ``RESULT_PROMPT_MAX_ROWS``, ``RESULT_PROMPT_MAX_BYTES``,
+``RESULT_PROMPT_HEAD_ROWS`` and ``RESULT_PROMPT_TOP_K``.
+"""
+import datetime
+import json
+import math
+from collections import Counter
+from collections.abc import Sequence as SequenceABC
+from decimal import Decimal
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from src.utils.config import env_int
+
+TRUNCATED_MARKER = "RESULTADO TRUNCADO"
+# Decimales máximos que se muestran en sumas y medias
+MAX_DECIMAL_PLACES = 10
+
+
+class CompactedResult(NamedTuple):
+    text: str
+    truncated: bool
+    total_rows: int
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _is_temporal(value) -> bool:
+    return isinstance(value, (datetime.date, datetime.datetime, datetime.time))
+
+
+def _category_key(value) -> str:
+    if isinstance(value, str):
+        return value
+    try:
+        return json.dumps(value, default=str, ensure_ascii=False, sort_keys=True)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _as_decimal(value) -> Decimal:
+    # repr: el float más corto que se lee igual (0.1 -> Decimal('0.1'), no 0.1000000000000000055...)
+    return Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+
+
+def _decimal_places(values) -> int:
+    """Largest number of decimals written in ``values`` (capped at ``MAX_DECIMAL_PLACES``)."""
+    places = 0
+    for value in values:
+        if isinstance(value, (float, Decimal)):
+            exponent = _as_decimal(value).as_tuple().exponent
+            if isinstance(exponent, int):
+                places = max(places, -exponent)
+    return min(places, MAX_DECIMAL_PLACES)
+
+
+def _format_number(value, places: Optional[int] = None) -> str:
+    """Exact text of a number (no exponent); with ``places``, rounded to that many decimals."""
+    if isinstance(value, int):
+        return str(value)
+    if places is not None:
+        return format(value, f".{places}f")
+    return format(_as_decimal(value), "f")
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def column_statistics(name: str, values: Sequence, top_k: int) -> str:
+    """One-line summary of a column: numeric range/sum, date range or most frequent values."""
+    present = [v for v in values if v is not None]
+    nulls = len(values) - len(present)
+    line = f"- {name}: {len(present)} valores"
+    if nulls:
+        line += f", {nulls} nulos"
+    if not present:
+        return line
+
+    if all(_is_number(v) for v in present):
+        # Suma exacta: un total mal redondeado hace que el modelo conteste mal
+        places = _decimal_places(present)
+        if all(isinstance(v, int) for v in present):
+            total = sum(present)
+            mean = Decimal(total) / len(present)
+        else:
+            if any(isinstance(v, Decimal) for v in present):
+                # Decimal + float no se pueden sumar directamente
+                total = sum(_as_decimal(v) for v in present)
+            else:
+                total = math.fsum(present)
+            mean = total / len(present)
+        line += (f", min {_format_number(min(present))}, max {_format_number(max(present))}, "
+                 f"suma {_format_number(total, places)}, media {_format_number(mean, max(places, 2))}")
+        return line
+    if all(_is_temporal(v) for v in present) and len({type(v) for v in present}) == 1:
+        return line + f", desde {min(present)} hasta {max(present)}"
+
+    counts = Counter(_category_key(v) for v in present)
+    if len(counts) == len(present) and len(present) > top_k:
+        # Identificadores u otros valores únicos: listar ejemplos no aporta nada
+        return line + ", todos distintos"
+    top = ", ".join(f"{_clip(value, 60)} ({count})" for value, count in counts.most_common(top_k))
+    return line + f", {len(counts)} distintos; más frecuentes: {top}"
+
+
+def _columns_of(rows: List, columns: Optional[Sequence[str]]):
+    """Column names and a value getter for tuple rows (SQL), dict rows (Mongo) or scalars."""
+    if rows and isinstance(rows[0], dict):
+        names = list(columns or [])
+        seen = set(names)
+        for row in rows:
+            for key in row:
+                if key not in seen:
+                    seen.add(key)
+                    names.append(key)
+        return names, lambda row, name, i: row.get(name) if isinstance(row, dict) else None
+    # Las filas de SQLAlchemy (Row) son secuencias pero no tuplas
+    if not all(isinstance(row, SequenceABC) and not isinstance(row, (str, bytes)) for row in rows):
+        # Lista de escalares (p. ej. distinct()): una única columna
+        return ["valor"], lambda row, name, i: row
+    width = max((len(row) for row in rows), default=0)
+    names = list(columns) if columns else [f"col{i + 1}" for i in range(width)]
+    return names, lambda row, name, i: row[i] if i < len(row) else None
+
+
+def compact_result(rows, full_text: str, serialize: Callable[[list], str],
+                   columns: Optional[Sequence[str]] = None,
+                   max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                   head_rows: Optional[int] = None, top_k: Optional[int] = None) -> CompactedResult:
+    """
+    Returns the text to paste into the interpretation prompt.
+
+    Args:
+        rows: Result rows (tuples or dicts). Non-list results are passed verbatim.
+        full_text: Already serialized full result, reused when under budget.
+        serialize: Serializer for the head rows (same format as ``full_text``).
+        columns: Column names for tuple rows.
+    """
+    max_rows = max_rows if max_rows is not None else env_int("RESULT_PROMPT_MAX_ROWS", 50)
+    max_bytes = max_bytes if max_bytes is not None else env_int("RESULT_PROMPT_MAX_BYTES", 8000)
+    head_rows = head_rows if head_rows is not None else env_int("RESULT_PROMPT_HEAD_ROWS", 10)
+    top_k = top_k if top_k is not None else env_int("RESULT_PROMPT_TOP_K", 5)
+
+    if not isinstance(rows, list):
+        return CompactedResult(_clip(full_text, max_bytes), len(full_text) > max_bytes, 1)
+    total = len(rows)
+    if total <= max_rows and len(full_text.encode("utf-8")) <= max_bytes:
+        return CompactedResult(full_text, False, total)
+
+    head = rows[:head_rows]
+    head_text = _clip(serialize(head), max_bytes // 2)
+    names, getter = _columns_of(rows, columns)
+    stats = [
+        column_statistics(name, [getter(row, name, i) for row in rows], top_k)
+        for i, name in enumerate(names)
+    ]
+    text = (
+        f"[{TRUNCATED_MARKER}: {total} filas en total; se muestran las primeras {len(head)}]\n"
+        f"Primeras filas: {head_text}\n"
+        f"Estadísticas por columna (calculadas sobre las {total} filas):\n" + "\n".join(stats)
+    )
+    return CompactedResult(_clip(text, max_bytes), True, total)
@@ -0,0 +1,240 @@
+"""
+Fingerprinted, disk-persisted cache of the SQL schema used in the generation prompt.
+
+Reflecting every table through SQLAlchemy is by far the most expensive
+non-LLM step of the SQL pipeline. Instead, each call runs one cheap query over
+``pg_class`` / ``pg_attribute`` / ``pg_constraint`` and hashes the result; the
+schema is only re-reflected when that fingerprint changes (i.e. after DDL).
+The last snapshot is written to disk so a cold start of ``main.py`` or
+``gui.py`` can reuse it without reflecting at all. The same snapshot holds the
+catalog rows of the pruning ``SchemaIndex`` (``src.agents.schema_index``), so
+the default pruned path also starts without a catalog dump.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+
+CATALOG_FINGERPRINT_SQL = """
+SELECT c.oid, c.relname, c.relkind, a.attnum, a.attname,
+       format_type(a.atttypid, a.atttypmod), a.attnotnull
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_catalog.pg_attribute a
+       ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+ORDER BY c.oid, a.attnum
+"""
+
+CONSTRAINT_FINGERPRINT_SQL = """
+SELECT con.conrelid, con.conname, pg_catalog.pg_get_constraintdef(con.oid)
+FROM pg_catalog.pg_constraint con
+JOIN pg_catalog.pg_namespace n ON n.oid = con.connamespace
+WHERE n.nspname = current_schema()
+ORDER BY con.conrelid, con.conname
+"""
+
+
+def default_cache_dir() -> Path:
+    """Directory for persisted caches (``CACHE_DIR`` env var, default ``.cache``)."""
+    return Path(os.getenv("CACHE_DIR", ".cache"))
+
+
+def catalog_fingerprint(engine) -> Optional[str]:
+    """
+    Hashes relation OIDs, column definitions and constraints of the current schema.
+
+    Returns None for non-PostgreSQL engines, in which case callers should not cache.
+    """
+    if engine.dialect.name != "postgresql":
+        return None
+    # Import local: query_cache y example_store usan este módulo también en el backend MongoDB
+    from sqlalchemy import text
+    digest = hashlib.sha256()
+    with engine.connect() as conn:
+        for sql in (CATALOG_FINGERPRINT_SQL, CONSTRAINT_FINGERPRINT_SQL):
+            _hash_rows(digest, conn.execute(text(sql)))
+    return digest.hexdigest()
+
+
+async def acatalog_fingerprint(async_engine) -> Optional[str]:
+    """Async counterpart of ``catalog_fingerprint`` for an ``AsyncEngine``."""
+    if async_engine.dialect.name != "postgresql":
+        return None
+    from sqlalchemy import text
+    digest = hashlib.sha256()
+    async with async_engine.connect() as conn:
+        for sql in (CATALOG_FINGERPRINT_SQL, CONSTRAINT_FINGERPRINT_SQL):
+            _hash_rows(digest, await conn.execute(text(sql)))
+    return digest.hexdigest()
+
+
+def _hash_rows(digest, rows):
+    for row in rows:
+        digest.update(repr(tuple(row)).encode("utf-8"))
+    digest.update(b"|")
+
+
+# Qué se guarda por huella: el DDL completo (sin poda) y las filas del índice de esquema (con poda)
+TABLE_INFO = "table_info"
+INDEX_ROWS = "index_rows"
+
+
+class SQLSchemaCache:
+    """
+    Caches schema snapshots for one database, keyed by its catalog fingerprint.
+
+    Each fingerprint holds one value per kind: ``TABLE_INFO`` (the reflected
+    DDL used without pruning) and ``INDEX_ROWS`` (the catalog rows the
+    ``SchemaIndex`` is built from). A new fingerprint drops every kind.
+
+    Args:
+        path: JSON file where the last snapshot is persisted. None disables persistence.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path is not None else None
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[str] = None
+        self._values: Dict[str, object] = {}
+        self._build_seconds: Dict[str, float] = {}
+        # Valores leídos del disco que aún no se han servido (para contar disk_hits)
+        self._from_disk: Set[str] = set()
+        self._loaded_from_disk = False
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Fingerprint of the schema currently held in memory."""
+        return self._fingerprint
+
+    def get(self, engine, reflect: Callable[[], str]) -> str:
+        """
+        Returns the cached table info, calling ``reflect`` only if DDL changed.
+
+        Args:
+            engine: SQLAlchemy engine used for the fingerprint query.
+            reflect: Callable that reflects the schema and returns the table info.
+        """
+        return self.get_for(catalog_fingerprint(engine), reflect)
+
+    def get_for(self, fingerprint: Optional[str], build: Callable[[], object], kind: str = TABLE_INFO):
+        """
+        Same as ``get`` with an already computed fingerprint, for any ``kind``.
+
+        ``build`` runs under the lock, so concurrent misses reflect only once.
+        """
+        with self._lock:
+            found, value = self._lookup(fingerprint, kind)
+            if found:
+                return value
+            start = time.perf_counter()
+            value = build()
+            self._store(fingerprint, kind, value, time.perf_counter() - start)
+            return value
+
+    def lookup(self, fingerprint: Optional[str], kind: str = TABLE_INFO):
+        """``(True, value)`` if ``kind`` is cached for ``fingerprint`` (memory or disk), else ``(False, None)``."""
+        with self._lock:
+            return self._lookup(fingerprint, kind)
+
+    def store(self, fingerprint: Optional[str], kind: str, value, build_seconds: float):
+        """Records a value built outside the cache (the async path builds it over asyncpg)."""
+        with self._lock:
+            self._store(fingerprint, kind, value, build_seconds)
+
+    def invalidate(self):
+        """Drops the in-memory snapshot so the next call re-reflects."""
+        with self._lock:
+            self._fingerprint = None
+            self._values = {}
+            self._build_seconds = {}
+            self._from_disk = set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "last_reflect_s": round(sum(self._build_seconds.values()), 6),
+                "reflect_seconds_saved": round(self.seconds_saved, 6),
+                "fingerprint": self._fingerprint,
+            }
+
+    def _lookup(self, fingerprint: Optional[str], kind: str):
+        if fingerprint is None:
+            self.misses += 1
+            return False, None
+        if not self._loaded_from_disk and not self._values:
+            self._load()
+        if fingerprint == self._fingerprint and kind in self._values:
+            self.hits += 1
+            if kind in self._from_disk:
+                self._from_disk.discard(kind)
+                self.disk_hits += 1
+            self.seconds_saved += self._build_seconds.get(kind, 0.0)
+            return True, self._values[kind]
+        self.misses += 1
+        return False, None
+
+    def _store(self, fingerprint: Optional[str], kind: str, value, build_seconds: float):
+        if fingerprint != self._fingerprint:
+            self._values = {}
+            self._build_seconds = {}
+            self._from_disk = set()
+        self._fingerprint = fingerprint
+        self._values[kind] = value
+        self._build_seconds[kind] = build_seconds
+        self._from_disk.discard(kind)
+        if fingerprint is not None:
+            self._save()
+
+    def _load(self):
+        self._loaded_from_disk = True
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._fingerprint = data["fingerprint"]
+            self._values = dict(data["values"])
+            self._build_seconds = {kind: float(seconds) for kind, seconds in data.get("build_seconds", {}).items()}
+            self._from_disk = set(self._values)
+        except Exception:
+            # Un snapshot corrupto simplemente se ignora y se vuelve a reflejar
+            self._fingerprint = None
+            self._values = {}
+            self._build_seconds = {}
+            self._from_disk = set()
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "fingerprint": self._fingerprint,
+                    "values": self._values,
+                    "build_seconds": self._build_seconds,
+                    "saved_at": time.time(),
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError):
+            pass
+
+
+def schema_cache_path(engine) -> Path:
+    """Per-database snapshot file, named after a hash of the (password-less) URL."""
+    url = engine.url.render_as_string(hide_password=True)
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+    return default_cache_dir() / f"sql_schema_{key}.json"
@@ -0,0 +1,277 @@
+"""
+Relevance-pruned schema context for the SQL generation prompt.
+
+Dumping the DDL of every table works for the three demo tables but not for
+databases with hundreds of them. ``SchemaIndex`` is built from one bulk
+``pg_catalog`` query (tables, columns, comments, keys and foreign keys), so no
+SQLAlchemy reflection is needed. Table names, column names and comments are
+tokenized, folded and stemmed for Spanish and English. Spanish stems are also
+mapped to their English counterparts, so "pedidos" matches ``orders``.
+
+For each question the index ranks tables by TF-IDF weighted overlap with the
+question stems. It keeps the top ``SQL_SCHEMA_TOP_K`` tables plus their
+foreign-key neighbours. If nothing matches, the full schema is kept.
+"""
+import json
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+from src.agents.query_cache import STOPWORDS, fold_text
+from src.utils.config import env_int
+
+SCHEMA_INDEX_SQL = """
+SELECT c.relname,
+       pg_catalog.obj_description(c.oid, 'pg_class'),
+       (SELECT json_agg(json_build_array(a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod),
+                                         a.attnotnull, pg_catalog.col_description(c.oid, a.attnum))
+                        ORDER BY a.attnum)
+          FROM pg_catalog.pg_attribute a
+         WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped),
+       (SELECT json_agg(json_build_array(con.conname, pg_catalog.pg_get_constraintdef(con.oid), f.relname)
+                        ORDER BY con.conname)
+          FROM pg_catalog.pg_constraint con
+          LEFT JOIN pg_catalog.pg_class f ON f.oid = con.confrelid
+         WHERE con.conrelid = c.oid AND con.contype IN ('p', 'u', 'f'))
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+ORDER BY c.relname
+"""
+
+# Sufijos flexivos/derivativos, de más largo a más corto (español e inglés)
+_SUFFIXES = (
+    "amientos", "imientos", "aciones", "iciones", "amiento", "imiento", "ciones", "mente",
+    "ations", "ation", "cion", "ings", "ing", "ores", "es", "ed", "s",
+)
+
+# Vocabulario español -> inglés habitual en nombres de tablas y columnas
+BILINGUAL_WORDS = {
+    "usuario": "user", "cliente": "customer", "pedido": "order", "orden": "order",
+    "articulo": "item", "categoria": "category", "precio": "price", "importe": "amount",
+    "gasto": "amount", "gastado": "amount", "dinero": "amount", "cantidad": "quantity",
+    "fecha": "date", "pago": "payment", "metodo": "method", "estado": "status",
+    "nombre": "name", "correo": "email", "direccion": "address", "ciudad": "city",
+    "pais": "country", "factura": "invoice", "venta": "sale", "compra": "purchase",
+    "proveedor": "supplier", "empleado": "employee", "departamento": "department",
+    "tienda": "store", "almacen": "warehouse", "envio": "shipment", "descripcion": "description",
+    "creacion": "created", "creado": "created", "telefono": "phone", "cuenta": "account",
+    "existencias": "stock", "linea": "line",
+}
+
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def stem(token: str) -> str:
+    """Light suffix-stripping stem for Spanish and English words (already folded)."""
+    if len(token) <= 3:
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)]
+            break
+    # Vocal final del español (usuario/usuari, categoria/categori) para unificar género/número
+    if len(token) > 4 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+BILINGUAL_STEMS = {stem(es): stem(en) for es, en in BILINGUAL_WORDS.items()}
+
+
+def tokenize(value: str) -> List[str]:
+    """Stems of an identifier or sentence, with Spanish stems also mapped to English."""
+    value = _CAMEL_RE.sub(" ", value or "").replace("_", " ")
+    stems = []
+    for token in fold_text(value).split():
+        if token in STOPWORDS or token.isdigit():
+            continue
+        stemmed = stem(token)
+        stems.append(stemmed)
+        english = BILINGUAL_STEMS.get(stemmed)
+        if english and english != stemmed:
+            stems.append(stem(english))
+    return stems
+
+
+def estimate_tokens(value: str) -> int:
+    """Rough LLM token count (~4 characters per token), enough to compare prompt sizes."""
+    return (len(value) + 3) // 4
+
+
+class TableEntry(NamedTuple):
+    name: str
+    ddl: str
+    neighbours: tuple
+
+
+class SchemaSelection(NamedTuple):
+    text: str
+    tables: List[str]
+    tokens_full: int
+    tokens_pruned: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_full - self.tokens_pruned
+
+
+def _json_value(value):
+    # psycopg2 decodifica json; asyncpg lo devuelve como texto
+    if isinstance(value, str):
+        return json.loads(value)
+    return value or []
+
+
+def _render_ddl(name: str, comment: Optional[str], columns: list, constraints: list) -> str:
+    lines = [f"\t{col} {col_type}{' NOT NULL' if not_null else ''}" + (f" -- {col_comment}" if col_comment else "")
+             for col, col_type, not_null, col_comment in columns]
+    lines += [f"\tCONSTRAINT {con_name} {definition}" for con_name, definition, _ in constraints]
+    header = f"-- {comment}\n" if comment else ""
+    return f"{header}CREATE TABLE {name} (\n" + ", \n".join(lines) + "\n)"
+
+
+class SchemaIndex:
+    """
+    Lexical index over the tables of one schema.
+
+    Args:
+        rows: Rows of ``SCHEMA_INDEX_SQL``: ``(table, comment, columns_json, constraints_json)``.
+        fingerprint: Catalog fingerprint the rows belong to.
+    """
+
+    def __init__(self, rows, fingerprint: Optional[str] = None):
+        self.fingerprint = fingerprint
+        self.tables: Dict[str, TableEntry] = {}
+        self.columns: Dict[str, List[str]] = {}
+        self.column_types: Dict[str, Dict[str, str]] = {}
+        self._terms: Dict[str, Counter] = {}
+        outgoing: Dict[str, list] = {}
+        incoming: Dict[str, list] = {}
+        for name, comment, columns, constraints in rows:
+            columns = _json_value(columns)
+            constraints = _json_value(constraints)
+            terms = Counter()
+            # El nombre de la tabla pesa más que los de las columnas
+            for token in tokenize(name):
+                terms[token] += 3
+            for token in tokenize(comment or ""):
+                terms[token] += 1
+            for col, _, _, col_comment in columns:
+                terms.update(tokenize(col))
+                terms.update(tokenize(col_comment or ""))
+            self._terms[name] = terms
+            self.columns[name] = [col for col, _, _, _ in columns]
+            self.column_types[name] = {col: col_type for col, col_type, _, _ in columns}
+            for _, _, target in constraints:
+                if target and target != name:
+                    outgoing.setdefault(name, []).append(target)
+                    incoming.setdefault(target, []).append(name)
+            self.tables[name] = TableEntry(name, _render_ddl(name, comment, columns, constraints), ())
+        for name, entry in self.tables.items():
+            # Primero las tablas referenciadas (necesarias para los JOIN), después las que la referencian
+            neighbours = list(dict.fromkeys(sorted(outgoing.get(name, [])) + sorted(incoming.get(name, []))))
+            self.tables[name] = entry._replace(neighbours=tuple(t for t in neighbours if t in self.tables))
+
+        document_frequency = Counter()
+        for terms in self._terms.values():
+            document_frequency.update(terms.keys())
+        total = max(len(self.tables), 1)
+        self._idf = {term: math.log(1 + total / df) for term, df in document_frequency.items()}
+        self.full_text = self._render(list(self.tables))
+        self.full_tokens = estimate_tokens(self.full_text)
+
+    def _render(self, names: List[str]) -> str:
+        return "\n\n".join(self.tables[name].ddl for name in names)
+
+    def rank(self, question: str) -> List[tuple]:
+        """``(score, table)`` pairs with a positive score, best first."""
+        stems = set(tokenize(question))
+        scores = []
+        for name, terms in self._terms.items():
+            score = sum(terms[s] * self._idf[s] for s in stems if s in terms)
+            if score > 0:
+                scores.append((score, name))
+        scores.sort(key=lambda item: (-item[0], item[1]))
+        return scores
+
+    def select(self, question: str, top_k: Optional[int] = None,
+               max_neighbours: Optional[int] = None) -> SchemaSelection:
+        """
+        Schema text for ``question``: top-k tables plus FK neighbours, or everything if nothing matches.
+
+        Args:
+            question: User question.
+            top_k: Tables kept by relevance (``SQL_SCHEMA_TOP_K``).
+            max_neighbours: Extra FK neighbour tables at most (``SQL_SCHEMA_MAX_NEIGHBOURS``).
+        """
+        top_k = top_k if top_k is not None else env_int("SQL_SCHEMA_TOP_K", 5)
+        max_neighbours = max_neighbours if max_neighbours is not None else env_int("SQL_SCHEMA_MAX_NEIGHBOURS", 10)
+        ranked = [name for _, name in self.rank(question)[:max(top_k, 1)]]
+        if not ranked:
+            return SchemaSelection(self.full_text, list(self.tables), self.full_tokens, self.full_tokens)
+        selected = set(ranked)
+        extra = 0
+        for name in ranked:
+            for neighbour in self.tables[name].neighbours:
+                if extra >= max_neighbours:
+                    break
+                if neighbour not in selected:
+                    selected.add(neighbour)
+                    extra += 1
+        # Orden estable del catálogo para que el prompt no dependa del ranking
+        names = [name for name in self.tables if name in selected]
+        pruned_text = self._render(names)
+        return SchemaSelection(pruned_text, names, self.full_tokens, estimate_tokens(pruned_text))
+
+
+def _plain_rows(rows) -> list:
+    # Listas JSON normales: el índice se persiste en el snapshot de SQLSchemaCache
+    return [[name, comment, _json_value(columns), _json_value(constraints)]
+            for name, comment, columns, constraints in rows]
+
+
+def fetch_index_rows(engine) -> list:
+    """Rows of ``SCHEMA_INDEX_SQL`` (one catalog query on a PostgreSQL engine), JSON-serializable."""
+    # Import local: el camino rápido usa el tokenizador de este módulo también con MongoDB
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return _plain_rows(conn.execute(text(SCHEMA_INDEX_SQL)).fetchall())
+
+
+async def afetch_index_rows(async_engine) -> list:
+    """Async ``fetch_index_rows`` for an ``AsyncEngine``."""
+    from sqlalchemy import text
+    async with async_engine.connect() as conn:
+        return _plain_rows((await conn.execute(text(SCHEMA_INDEX_SQL))).fetchall())
+
+
+class PruningStats:
+    """Thread-safe counters of prompt tokens saved by schema pruning."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.tokens_full = 0
+        self.tokens_pruned = 0
+
+    def record(self, selection: SchemaSelection):
+        with self._lock:
+            self.questions += 1
+            self.tokens_full += selection.tokens_full
+            self.tokens_pruned += selection.tokens_pruned
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            saved = self.tokens_full - self.tokens_pruned
+            return {
+                "questions": self.questions,
+                "tokens_full": self.tokens_full,
+                "tokens_pruned": self.tokens_pruned,
+                "tokens_saved": saved,
+                "avg_tokens_saved": round(saved / self.questions, 1) if self.questions else 0.0,
+            }
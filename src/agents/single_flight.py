@@ -0,0 +1,354 @@
+"""
+Single-flight deduplication of identical questions that are in flight at once.
+
+A dashboard refresh or several analysts asking the same thing at the same time
+used to run the whole generate-execute-interpret pipeline once per request,
+multiplying the load on Ollama. ``coalesce`` / ``acoalesce`` key each request
+by ``(backend, normalized question, schema fingerprint)``: the first request
+(the leader) runs the pipeline and every identical request that arrives before
+it finishes attaches to that execution instead of starting its own.
+
+Every event the leader produces is kept in the flight, so a request that
+attaches mid-stream first replays what it missed and then receives the
+remaining events (query, rows, answer tokens) as they arrive. Followers get a
+shallow copy of the final result with ``coalesced: True``; nested lists are
+shared with the leader and must be treated as read-only.
+
+The flight closes when its ``DONE`` event is produced: later requests run a
+new pipeline (and usually hit the query and result caches). If the leader's
+consumer stops reading, the rest of the pipeline moves to a background thread
+(so ``close()`` returns at once) and keeps running for the followers; it is
+closed only when nobody is left. ``SingleFlightStats`` counts executions,
+coalesced requests and the LLM calls and seconds they did not repeat.
+
+The fingerprint is the one the process last saw for the database, read
+without a round trip; the leader still checks the current schema itself.
+``SINGLE_FLIGHT=0`` disables the layer.
+"""
+import asyncio
+import threading
+from collections import Counter
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from src.agents.query_cache import fold_text
+from src.agents.streaming import DONE, event
+from src.utils.config import env_int
+
+
+def single_flight_enabled() -> bool:
+    return env_int("SINGLE_FLIGHT", 1) != 0
+
+
+def flight_key(question: str, fingerprint: Optional[str], *scope) -> tuple:
+    """
+    Key under which identical requests are coalesced.
+
+    Args:
+        question: Question in natural language; case, accents, punctuation and
+            spacing are ignored (stopwords are not: "no" changes the question).
+        fingerprint: Schema fingerprint last seen for the database, if any.
+        *scope: Anything else that changes the result (database URI, options).
+    """
+    return (fold_text(question), fingerprint) + scope
+
+
+def llm_spans(result: Optional[dict]) -> List[dict]:
+    """LLM spans (``*_llm``) of the trace attached to ``result``."""
+    trace = (result or {}).get("trace") or {}
+    return [span for span in trace.get("spans", []) if span["name"].endswith("_llm")]
+
+
+class Flight:
+    """One pipeline execution and the events it has produced so far."""
+
+    def __init__(self, backend: str, key: tuple, condition):
+        self.backend = backend
+        self.key = key
+        self.condition = condition
+        self.events: List[dict] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        # Peticiones leyendo eventos (el líder incluido) y las que se unieron a él
+        self.subscribers = 1
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlightStats:
+    """Thread-safe executions / coalesced-request counters per backend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.executions = Counter()
+        self.coalesced = Counter()
+        self.llm_calls_saved = Counter()
+        self.llm_seconds_saved: Dict[str, float] = {}
+
+    def record_execution(self, backend: str):
+        with self._lock:
+            self.executions[backend] += 1
+
+    def record_coalesced(self, backend: str):
+        with self._lock:
+            self.coalesced[backend] += 1
+
+    def record_landing(self, backend: str, followers: int, result: Optional[dict]):
+        """Credits the followers of a finished flight with the LLM work they did not repeat."""
+        spans = llm_spans(result)
+        with self._lock:
+            self.llm_calls_saved[backend] += len(spans) * followers
+            self.llm_seconds_saved[backend] = (
+                self.llm_seconds_saved.get(backend, 0.0)
+                + sum(span["duration_ms"] for span in spans) / 1000 * followers
+            )
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                backend: {
+                    "executions": total,
+                    "coalesced": self.coalesced[backend],
+                    "llm_calls_saved": self.llm_calls_saved[backend],
+                    "llm_seconds_saved": round(self.llm_seconds_saved.get(backend, 0.0), 3),
+                }
+                for backend, total in self.executions.items()
+            }
+
+
+class SingleFlight:
+    """
+    Registry of in-flight executions for the sync and async pipelines.
+
+    Async flights are kept apart and keyed by event loop as well: their
+    pipelines use engines and clients bound to that loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[tuple, Flight] = {}
+        self._aflights: Dict[tuple, Flight] = {}
+        self.stats = SingleFlightStats()
+
+    # --- registro ---
+
+    def _join(self, flights: Dict[tuple, Flight], backend: str, key: tuple, condition):
+        """``(flight, is_leader)``: attaches to the flight for ``key`` or opens a new one."""
+        with self._lock:
+            flight = flights.get(key)
+            if flight is not None:
+                flight.subscribers += 1
+                flight.followers += 1
+                leader = False
+            else:
+                flight = Flight(backend, key, condition())
+                flights[key] = flight
+                leader = True
+        if leader:
+            self.stats.record_execution(backend)
+        else:
+            self.stats.record_coalesced(backend)
+        return flight, leader
+
+    def _land(self, flights: Dict[tuple, Flight], flight: Flight, result: Optional[dict] = None):
+        """Stops new requests from joining ``flight``; with ``result``, records what its followers saved."""
+        with self._lock:
+            if flights.get(flight.key) is not flight:
+                return
+            del flights[flight.key]
+            followers = flight.followers
+        if result is not None and followers:
+            self.stats.record_landing(flight.backend, followers, result)
+
+    def _leave(self, flight: Flight):
+        with self._lock:
+            flight.subscribers -= 1
+
+    def _abandoned(self, flights: Dict[tuple, Flight], flight: Flight) -> bool:
+        """True (and the flight is closed to newcomers) when nobody reads its events any more."""
+        with self._lock:
+            if flight.subscribers > 0:
+                return False
+            if flights.get(flight.key) is flight:
+                del flights[flight.key]
+            return True
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights) + len(self._aflights)
+
+    # --- API síncrona ---
+
+    def stream(self, backend: str, key: tuple, start: Callable[[], Iterator[dict]]) -> Iterator[dict]:
+        """
+        Events of the pipeline for ``key``, run by this call or shared with an identical one.
+
+        Args:
+            backend: Backend name for the statistics (``postgres``, ``mongo``).
+            key: Result of ``flight_key``.
+            start: Starts the pipeline; only called by the leader.
+        """
+        flight, leader = self._join(self._flights, backend, key, threading.Condition)
+        if leader:
+            yield from self._lead(flight, start)
+        else:
+            try:
+                yield from self._follow(flight)
+            finally:
+                self._leave(flight)
+
+    def _lead(self, flight: Flight, start: Callable[[], Iterator[dict]]) -> Iterator[dict]:
+        listening = True
+        handed_off = False
+        events = None
+        try:
+            events = start()
+            for ev in events:
+                self._publish(flight, ev)
+                try:
+                    yield ev
+                except GeneratorExit:
+                    # El consumidor del líder se fue: si alguien más espera, el resto del pipeline
+                    # sigue en otro hilo para que close() no bloquee a quien lo llamó
+                    listening = False
+                    self._leave(flight)
+                    if not self._abandoned(self._flights, flight):
+                        threading.Thread(target=self._drain, args=(flight, events),
+                                         name="single-flight", daemon=True).start()
+                        handed_off = True
+                    return
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            if not handed_off:
+                self._finish(flight, events)
+            if listening:
+                self._leave(flight)
+
+    def _drain(self, flight: Flight, events: Iterator[dict]):
+        """Runs the rest of a pipeline whose leader stopped reading, while followers remain."""
+        try:
+            for ev in events:
+                self._publish(flight, ev)
+                if self._abandoned(self._flights, flight):
+                    break
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(flight, events)
+
+    def _publish(self, flight: Flight, ev: dict):
+        if ev["type"] == DONE:
+            self._land(self._flights, flight, ev["result"])
+        with flight.condition:
+            flight.events.append(ev)
+            flight.condition.notify_all()
+
+    def _finish(self, flight: Flight, events: Optional[Iterator[dict]]):
+        if events is not None:
+            events.close()
+        self._land(self._flights, flight)
+        with flight.condition:
+            flight.finished = True
+            flight.condition.notify_all()
+
+    def _follow(self, flight: Flight) -> Iterator[dict]:
+        seen = 0
+        while True:
+            with flight.condition:
+                while seen >= len(flight.events) and not flight.finished:
+                    flight.condition.wait()
+                batch = flight.events[seen:]
+                finished = flight.finished
+            seen += len(batch)
+            for ev in batch:
+                yield _coalesced(ev)
+                if ev["type"] == DONE:
+                    return
+            if finished:
+                if flight.error is not None:
+                    raise flight.error
+                raise RuntimeError("La ejecución compartida terminó sin resultado")
+
+    # --- API asíncrona ---
+
+    async def astream(self, backend: str, key: tuple, start: Callable[[], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+        """
+        Async counterpart of ``stream``.
+
+        The pipeline runs in a task of the current event loop rather than in
+        the leader's coroutine, so cancelling any one request (a timeout) does
+        not cancel the others attached to it.
+        """
+        key = (id(asyncio.get_running_loop()),) + key
+        flight, leader = self._join(self._aflights, backend, key, asyncio.Condition)
+        if leader:
+            # Referencia en el vuelo: el loop solo guarda referencias débiles a sus tareas
+            flight.task = asyncio.get_running_loop().create_task(self._aproduce(flight, start()))
+        try:
+            seen = 0
+            while True:
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: seen < len(flight.events) or flight.finished)
+                    batch = flight.events[seen:]
+                    finished = flight.finished
+                seen += len(batch)
+                for ev in batch:
+                    yield ev if leader else _coalesced(ev)
+                    if ev["type"] == DONE:
+                        return
+                if finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    raise RuntimeError("La ejecución compartida terminó sin resultado")
+        finally:
+            self._leave(flight)
+
+    async def _aproduce(self, flight: Flight, events: AsyncIterator[dict]):
+        try:
+            async for ev in events:
+                if ev["type"] == DONE:
+                    self._land(self._aflights, flight, ev["result"])
+                async with flight.condition:
+                    flight.events.append(ev)
+                    flight.condition.notify_all()
+                if self._abandoned(self._aflights, flight):
+                    break
+        except Exception as e:
+            flight.error = e
+        finally:
+            await events.aclose()
+            self._land(self._aflights, flight)
+            async with flight.condition:
+                flight.finished = True
+                flight.condition.notify_all()
+
+
+def _coalesced(ev: dict) -> dict:
+    """What a follower receives: the leader's event, with ``coalesced: True`` on the final result."""
+    if ev["type"] != DONE:
+        return ev
+    return event(DONE, result=dict(ev["result"], coalesced=True))
+
+
+_registry = SingleFlight()
+
+
+def coalesce(backend: str, key: tuple, start: Callable[[], Iterator[dict]]) -> Iterator[dict]:
+    """Events of ``start()``, shared with any identical in-flight request (see ``SingleFlight.stream``)."""
+    if not single_flight_enabled():
+        return start()
+    return _registry.stream(backend, key, start)
+
+
+def acoalesce(backend: str, key: tuple, start: Callable[[], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+    """Async counterpart of ``coalesce``."""
+    if not single_flight_enabled():
+        return start()
+    return _registry.astream(backend, key, start)
+
+
+def single_flight_stats() -> dict:
+    """Executions and coalesced requests per backend since the process started."""
+    in_flight = _registry.in_flight()
+    return _registry.stats.snapshot() | ({"in_flight": in_flight} if in_flight else {})
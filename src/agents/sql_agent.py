@@ -1,133 +1,414 @@
 # IMPORTANTE: Importar el fix ANTES de cualquier otra cosa
 from src.utils import psycopg2_fix
 
-from langchain_community.utilities import SQLDatabase
-from langchain_ollama import ChatOllama
+import hashlib
 import os
 import re
-from src.utils.encoding_utils import safe_load_dotenv
-from sqlalchemy import create_engine
+from functools import partial
+from src.utils.config import load_config
+from src.agents.sql_context import QueryCostError, format_rows, get_sql_context, known_schema_fingerprint
+from src.agents.result_compaction import compact_result
+from src.agents.query_cache import get_query_cache
+from src.agents.example_store import format_examples, get_example_store
+from src.agents.sql_validation import validation_errors
+from src.agents.fast_path import (
+    answers_question, fast_path_enabled, fast_path_events, get_matcher, record_fast_path, sql_column_kinds, to_sql,
+)
+from src.agents.streaming import DONE, QUERY_GENERATED, ROWS_FETCHED, acollect_result, atraced, collect_result, event, traced
+from src.agents.pipeline import Io, answer_tokens, arun_steps, invoke, run_steps
+from src.agents.single_flight import acoalesce, coalesce, flight_key
+from src.agents.tracing import Trace, usage_attributes
+from src.agents.result_cache import (
+    ensure_postgres_listener, get_result_cache, normalize_sql, postgres_scope, sql_is_volatile, sql_tables,
+)
 
-safe_load_dotenv()
+load_config()
+
+def build_generation_prompt(table_context: str, query: str, examples=()) -> str:
+    """Prompt asking the LLM for a single PostgreSQL query, with retrieved few-shot examples."""
+    return (
+        f"Tu tarea es generar una consulta SQL para PostgreSQL basada en la pregunta del usuario y el esquema proporcionado.\n"
+        f"ESQUEMA:\n{table_context}\n\n"
+        f"{format_examples(examples, 'sql')}"
+        f"PREGUNTA: {query}\n\n"
+        "INSTRUCCIONES:\n"
+        "1. Responde SOLAMENTE con el código SQL dentro de un bloque markdown ```sql ... ```.\n"
+        "2. No des explicaciones, solo el SQL.\n"
+        "3. Para uniones (JOIN), usa las claves foráneas correctas (ej: users.id = orders.user_id).\n"
+        "4. Para calcular dinero total, suma 'total_amount' en la tabla 'orders'.\n"
+    )
+
+def extract_sql(content_gen: str) -> str:
+    """Extracts the SQL statement from the LLM response ('' if none was found)."""
+    # Todo el bloque: puede empezar por WITH (CTE); la validación local decide si es de solo lectura
+    sql_match = re.search(r"```sql\s*(.*?)```", content_gen, re.IGNORECASE | re.DOTALL)
+    if not sql_match or not sql_match.group(1).strip():
+        # Fallback regex
+        sql_match = re.search(r"((?:WITH\s.*?\s)?SELECT\s.*?\sFROM\s.*?(?:;|$))", content_gen, re.IGNORECASE | re.DOTALL)
+    return sql_match.group(1).strip() if sql_match else ""
+
+def build_cheaper_prompt(table_context: str, query: str, generated_sql: str, reason: str) -> str:
+    """Prompt asking the LLM for a cheaper equivalent of a query rejected by the cost gate."""
+    return (
+        f"La siguiente consulta SQL para PostgreSQL es demasiado costosa según el planificador ({reason}).\n"
+        f"ESQUEMA:\n{table_context}\n\n"
+        f"PREGUNTA: {query}\n\n"
+        f"CONSULTA RECHAZADA:\n{generated_sql}\n\n"
+        "INSTRUCCIONES:\n"
+        "1. Escribe una consulta equivalente que responda a la misma pregunta con mucho menos coste.\n"
+        "2. Evita productos cartesianos: cada tabla del FROM/JOIN debe unirse por su clave foránea.\n"
+        "3. Filtra y agrega lo antes posible y devuelve solo las columnas necesarias.\n"
+        "4. Responde SOLAMENTE con el código SQL dentro de un bloque markdown ```sql ... ```.\n"
+    )
+
+def build_repair_prompt(table_context: str, query: str, generated_sql: str, errors) -> str:
+    """Prompt asking the LLM to fix a query rejected by local validation, quoting every error."""
+    error_lines = "\n".join(f"- {error}" for error in errors)
+    return (
+        f"La siguiente consulta SQL para PostgreSQL no es válida para el esquema proporcionado.\n"
+        f"ESQUEMA:\n{table_context}\n\n"
+        f"PREGUNTA: {query}\n\n"
+        f"CONSULTA RECHAZADA:\n{generated_sql}\n\n"
+        f"ERRORES:\n{error_lines}\n\n"
+        "INSTRUCCIONES:\n"
+        "1. Corrige todos los errores usando únicamente tablas y columnas del esquema.\n"
+        "2. La consulta debe ser de solo lectura (SELECT, opcionalmente con WITH).\n"
+        "3. Responde SOLAMENTE con el código SQL dentro de un bloque markdown ```sql ... ```.\n"
+    )
+
+def build_interpretation_prompt(query: str, generated_sql: str, raw_result, truncated: bool = False,
+                                more_rows: bool = False) -> str:
+    """Prompt asking the LLM to explain the (possibly compacted) query result in Spanish."""
+    prompt = (
+        f"Pregunta Original: {query}\n"
+        f"Consulta SQL: {generated_sql}\n"
+        f"Resultado de la Base de Datos: {raw_result}\n\n"
+        "INSTRUCCIONES:\n"
+        "1. Responde a la pregunta original basándote en el resultado.\n"
+        "2. Responde en ESPAÑOL.\n"
+        "3. Explica DETALLADAMENTE los resultados. No hagas resúmenes breves. Si hay lista de datos, menciona los detalles importantes de cada uno.\n"
+    )
+    if truncated:
+        prompt += "4. El resultado está TRUNCADO: usa las estadísticas por columna para totales y conteos y no inventes filas que no se muestran.\n"
+    if more_rows:
+        prompt += "5. La consulta devolvió más filas de las recuperadas (límite de filas alcanzado): indícalo y no presentes el resultado como completo.\n"
+    return prompt
+
+def _cache_value(rows, columns, more_rows):
+    """Full result string, row count, compacted prompt text and the more-rows flag, computed once per execution."""
+    raw_result = format_rows(rows)
+    compacted = compact_result(rows, raw_result, format_rows, columns)
+    return raw_result, len(rows), compacted, more_rows
+
+def _cache_size(value) -> int:
+    raw_result, _, compacted, _ = value
+    size = len(raw_result.encode("utf-8"))
+    if compacted.truncated:
+        size += len(compacted.text.encode("utf-8"))
+    return size
+
+def _record_schema(span, schema, fingerprint):
+    span.set(**{
+        "schema.chars": len(schema.text),
+        "schema.fingerprint": fingerprint,
+        "schema.tables": len(schema.tables) or None,
+        "schema.tokens_full": schema.tokens_full,
+        "schema.tokens_pruned": schema.tokens_pruned,
+        "schema.tokens_saved": schema.tokens_saved,
+    })
+
+def _record_cost(span, cost):
+    if span is not None and cost is not None:
+        span.set(**{"db.plan_cost": cost.total_cost, "db.plan_rows": cost.plan_rows})
+
+def _record_rows(span, value, from_cache: bool):
+    if span is not None:
+        raw_result, row_count, compacted, more_rows = value
+        span.set(**{
+            "db.rows": row_count,
+            "db.more_rows": more_rows,
+            "db.result_bytes": len(raw_result.encode("utf-8")),
+            "result_cache.hit": from_cache,
+            "prompt.result_bytes": len(compacted.text.encode("utf-8")),
+            "prompt.result_truncated": compacted.truncated,
+        })
+
+def cached_sql_steps(ctx, sql: str, span=None):
+    """
+    Pipeline steps (``src.agents.pipeline``) that execute ``sql`` through the shared result cache.
+
+    Args:
+        ctx: Shared ``SQLAgentContext``.
+        sql: Query to execute.
+        span: Optional tracing span that receives row count and result size.
+
+    Returns:
+        Tuple ``(raw_result, compacted, more_rows, from_cache)`` where ``compacted``
+        is the ``CompactedResult`` to use in the interpretation prompt and
+        ``more_rows`` tells whether the row cap (``SQL_MAX_ROWS``) cut the result.
+
+    Raises:
+        QueryCostError: If the statement is not cached and ``EXPLAIN`` puts it
+            over the cost thresholds; it is not executed.
+    """
+    result_cache = get_result_cache()
+    ensure_postgres_listener(ctx.engine)
+    # Una entrada por base de datos: dos URIs nunca comparten resultados ni versiones
+    scope = postgres_scope(ctx.engine)
+    key = normalize_sql(sql)
+    tables = sql_tables(sql)
+    found, value = result_cache.get(scope, key, tables)
+    if not found:
+        # Guarda de coste: EXPLAIN antes de ejecutar (un acierto de la caché no llega a la base de datos)
+        _record_cost(span, (yield Io(partial(ctx.check_cost, sql), partial(ctx.acheck_cost, sql))))
+        # Versiones tomadas antes de ejecutar: un cambio concurrente deja la entrada ya obsoleta
+        versions = result_cache.version_snapshot(scope, tables)
+        # Las filas solo viven hasta compactarlas; la caché guarda el texto completo y el resumen
+        value = _cache_value(*(yield Io(partial(ctx.run, sql), partial(ctx.arun, sql))))
+        # NOW(), CURRENT_DATE, random()...: caducan por TTL aunque la tabla tenga NOTIFY
+        result_cache.put(scope, key, versions, value, _cache_size(value), sql_is_volatile(sql))
+    _record_rows(span, value, found)
+    return value[0], value[2], value[3], found
+
+def _fast_path_match(ctx, query: str, fingerprint, trace):
+    """Fast-path match for ``query`` (None off PostgreSQL or if it needs the LLM)."""
+    column_types = ctx.schema_column_types()
+    with trace.span("fast_path") as span:
+        match = None
+        if column_types:
+            matcher = get_matcher("postgres", fingerprint, lambda: sql_column_kinds(column_types))
+            match = matcher.match(query)
+        span.set(**{"fast_path.hit": match is not None, "fast_path.intent": match.intent if match else None})
+    return match
+
+def _too_expensive_result(generated_sql: str, error: QueryCostError) -> dict:
+    return {
+        "answer": f"La consulta generada es demasiado costosa y no se ha ejecutado ({error}). Prueba a acotar la pregunta.",
+        "sql_queries": [generated_sql],
+        "raw_results": [],
+        "error": f"Query Too Expensive: {error}"
+    }
+
+def _invalid_sql_result(generated_sql: str, errors) -> dict:
+    return {
+        "answer": "La consulta generada no es válida: " + "; ".join(errors),
+        "sql_queries": [generated_sql],
+        "raw_results": [],
+        "error": "SQL Validation Failed: " + "; ".join(errors)
+    }
 
 def run_sql_agent(query: str):
     """
     Executes a natural language query against PostgreSQL using a deterministic
     generate-execute-interpret pipeline instead of an Agent loop.
     """
+    return collect_result(stream_sql_agent(query))
+
+def stream_sql_agent(query: str):
+    """
+    Streaming variant of ``run_sql_agent``: yields the events described in
+    ``src.agents.streaming`` while the pipeline runs, ending with ``DONE``.
+    An identical question already in flight is shared instead of run again
+    (``src.agents.single_flight``).
+    """
+    return coalesce("postgres", _flight_key(query), lambda: _stream_sql_agent(query))
+
+async def arun_sql_agent(query: str):
+    """
+    Async counterpart of ``run_sql_agent``. Database I/O goes through asyncpg
+    and the LLM through ``ainvoke`` / ``astream``, so many questions can be
+    awaited concurrently from a single event loop.
+    """
+    return await acollect_result(astream_sql_agent(query))
+
+def astream_sql_agent(query: str):
+    """Async generator yielding the same events as ``stream_sql_agent``, also coalescing identical questions."""
+    return acoalesce("postgres", _flight_key(query), lambda: _astream_sql_agent(query))
+
+def _flight_key(query: str) -> tuple:
+    # Huella conocida sin consultar el catálogo; el líder comprueba el esquema actual
+    db_uri = os.getenv("POSTGRES_URI")
+    return flight_key(query, known_schema_fingerprint(db_uri) if db_uri else None, db_uri)
+
+def _stream_sql_agent(query: str):
+    trace = Trace("sql_agent", **{"db.system": "postgresql", "question": query})
+    yield from traced(trace, run_steps(_sql_steps(query, trace)))
+
+async def _astream_sql_agent(query: str):
+    trace = Trace("sql_agent", **{"db.system": "postgresql", "question": query})
+    async for ev in atraced(trace, arun_steps(_sql_steps(query, trace))):
+        yield ev
+
+def _sql_steps(query: str, trace: Trace):
+    """The SQL pipeline as steps (``src.agents.pipeline``): the sync API runs them with psycopg2, the async one with asyncpg."""
     db_uri = os.getenv("POSTGRES_URI")
     if not db_uri:
-        return {"error": "Error: POSTGRES_URI environment variable not set."}
+        yield event(DONE, result={"error": "Error: POSTGRES_URI environment variable not set."})
+        return
     
     try:
-        # 1. Setup - Conexión robusta con manejo de encoding
-        from sqlalchemy import event
-        from sqlalchemy.pool import Pool
-        import warnings
-        
-        # Crear engine con configuración básica
-        # El problema de encoding se maneja a nivel de configuración de PostgreSQL
-        engine_args = {
-            'pool_pre_ping': True,
-            'connect_args': {
-                'client_encoding': 'utf8'
-            }
-        }
+        # 1. Setup - Contexto compartido (engine pool, listener de sesión y LLM creados una sola vez)
+        with trace.span("setup"):
+            # La primera creación conecta de forma síncrona: en la ruta async va a un hilo
+            ctx = yield Io(partial(get_sql_context, db_uri))
+        llm = ctx.llm
         
-        engine = create_engine(db_uri, **engine_args)
+        # 2. Get Schema (índice del catálogo por huella; solo las tablas relevantes y sus vecinas por FK)
+        with trace.span("schema_load") as span:
+            schema, schema_fingerprint = yield Io(partial(ctx.get_schema_context, query),
+                                                  partial(ctx.aget_schema_context, query))
+            table_context = schema.text
+            _record_schema(span, schema, schema_fingerprint)
+
+        # 2b. Camino rápido: agregados simples resueltos con una plantilla, sin llamadas al LLM
+        if fast_path_enabled():
+            match = _fast_path_match(ctx, query, schema_fingerprint, trace)
+            if match is not None:
+                fast_sql = to_sql(match)
+                try:
+                    with trace.span("db_execution", **{"db.statement": fast_sql}) as span:
+                        _record_cost(span, (yield Io(partial(ctx.check_cost, fast_sql),
+                                                     partial(ctx.acheck_cost, fast_sql))))
+                        rows, _, _ = yield Io(partial(ctx.run, fast_sql), partial(ctx.arun, fast_sql))
+                    value = rows[0][0] if rows else None
+                    if not answers_question(match, value):
+                        # Filtro sin filas: quizá el valor está escrito de otra forma; mejor que decida el LLM
+                        match = None
+                except Exception:
+                    # Si falla (tipo inesperado, coste...) la pregunta sigue por la ruta del LLM
+                    match = None
+            record_fast_path("postgres", match)
+            if match is not None:
+                yield from fast_path_events(match, fast_sql, format_rows(rows), value)
+                return
         
-        # Event listener para configurar la sesión después de conectar
-        @event.listens_for(engine, "connect")
-        def set_session_config(dbapi_connection, connection_record):
-            """Configura la sesión para usar UTF-8 y locale C"""
-            cursor = dbapi_connection.cursor()
+        # 3. Question-to-query cache: un acierto salta la llamada de generación al LLM
+        query_cache = get_query_cache()
+        cache_scope = schema_fingerprint or hashlib.sha256(table_context.encode("utf-8")).hexdigest()
+        with trace.span("query_cache_lookup") as span:
+            cached = yield Io(partial(query_cache.lookup, "postgres", cache_scope, query))
+            span.set(**{"query_cache.hit": cached is not None})
+        if cached:
+            generated_sql = cached.query
             try:
-                cursor.execute("SET CLIENT_ENCODING TO 'UTF8'")
-                cursor.execute("SET lc_messages TO 'C'")
-                cursor.execute("SET lc_monetary TO 'C'")
-                cursor.execute("SET lc_numeric TO 'C'")
-                cursor.execute("SET lc_time TO 'C'")
-            except:
-                pass
-            finally:
-                cursor.close()
-        
-        db = SQLDatabase(engine, sample_rows_in_table_info=0)
-        llm = ChatOllama(model="llama3", temperature=0)
-        
-        # 2. Get Schema
-        table_context = db.get_table_info()
-        
-        # 3. Generate SQL (Explicit Chain Step 1)
-        generation_prompt = (
-            f"Tu tarea es generar una consulta SQL para PostgreSQL basada en la pregunta del usuario y el esquema proporcionado.\n"
-            f"ESQUEMA:\n{table_context}\n\n"
-            f"PREGUNTA: {query}\n\n"
-            "INSTRUCCIONES:\n"
-            "1. Responde SOLAMENTE con el código SQL dentro de un bloque markdown ```sql ... ```.\n"
-            "2. No des explicaciones, solo el SQL.\n"
-            "3. Para uniones (JOIN), usa las claves foráneas correctas (ej: users.id = orders.user_id).\n"
-            "4. Para calcular dinero total, suma 'total_amount' en la tabla 'orders'.\n"
-        )
-        
-        response_gen = llm.invoke(generation_prompt)
-        content_gen = response_gen.content if hasattr(response_gen, 'content') else str(response_gen)
-        
-        # Extract SQL using Regex
-        generated_sql = ""
-        sql_match = re.search(r"```sql\s*(SELECT.*?)```", content_gen, re.IGNORECASE | re.DOTALL)
-        if not sql_match:
-            # Fallback regex
-            sql_match = re.search(r"(SELECT\s.*?\sFROM\s.*?(?:;|$))", content_gen, re.IGNORECASE | re.DOTALL)
-            
-        if sql_match:
-            generated_sql = sql_match.group(1).strip()
-        else:
-            return {
-                "answer": "No pude generar una consulta SQL válida para tu pregunta.",
-                "sql_queries": [],
-                "raw_results": [],
-                "error": "SQL Extraction Failed"
-            }
-
-        # 4. Execute SQL (Explicit Step 2)
-        try:
-            raw_result = db.run(generated_sql)
-        except Exception as e:
-            return {
-                "answer": f"Error al ejecutar la consulta SQL: {str(e)}",
-                "sql_queries": [generated_sql],
-                "raw_results": [f"Error: {str(e)}"],
-                "error": str(e)
-            }
-
-        # 5. Interpret Result (Explicit Step 3)
-        interpretation_prompt = (
-            f"Pregunta Original: {query}\n"
-            f"Consulta SQL: {generated_sql}\n"
-            f"Resultado de la Base de Datos: {raw_result}\n\n"
-            "INSTRUCCIONES:\n"
-            "1. Responde a la pregunta original basándote en el resultado.\n"
-            "2. Responde en ESPAÑOL.\n"
-            "3. Explica DETALLADAMENTE los resultados. No hagas resúmenes breves. Si hay lista de datos, menciona los detalles importantes de cada uno.\n"
-        )
-        
-        response_int = llm.invoke(interpretation_prompt)
-        final_answer = response_int.content if hasattr(response_int, 'content') else str(response_int)
+                with trace.span("db_execution", **{"db.statement": generated_sql}) as span:
+                    raw_result, compacted, more_rows, from_cache = yield from cached_sql_steps(ctx, generated_sql, span)
+                yield event(QUERY_GENERATED, query=generated_sql, query_cache_hit=True)
+            except Exception:
+                # La consulta cacheada ya no es válida: se descarta y se genera de nuevo
+                yield Io(partial(query_cache.discard, "postgres", cache_scope, query, generated_sql))
+                yield Io(partial(get_example_store().discard, "postgres", generated_sql))
+                cached = None
+
+        if not cached:
+            # 3b. Generate SQL (Explicit Chain Step 1)
+            # Ejemplos verificados más parecidos a la pregunta (few-shot)
+            example_store = get_example_store()
+            with trace.span("examples_retrieval") as span:
+                examples = example_store.search("postgres", query)
+                span.set(**{"examples.count": len(examples), "examples.index_size": example_store.size("postgres")})
+            prompt = build_generation_prompt(table_context, query, examples)
+            with trace.span("generation_llm", **{"llm.prompt_chars": len(prompt)}) as span:
+                response_gen = yield invoke(llm, prompt)
+                span.set(**usage_attributes(response_gen))
+            content_gen = response_gen.content if hasattr(response_gen, 'content') else str(response_gen)
+
+            with trace.span("extraction"):
+                generated_sql = extract_sql(content_gen)
+            if not generated_sql:
+                yield event(DONE, result={
+                    "answer": "No pude generar una consulta SQL válida para tu pregunta.",
+                    "sql_queries": [],
+                    "raw_results": [],
+                    "error": "SQL Extraction Failed"
+                })
+                return
+
+            # 3c. Validación local (sqlglot contra el esquema en caché, sin ir a la base de datos)
+            schema_columns = ctx.schema_columns()
+            with trace.span("validation") as span:
+                errors = validation_errors(generated_sql, schema_columns)
+                span.set(**{"sql.valid": not errors, "sql.validation_errors": len(errors)})
+            attempt = 0
+            while errors and attempt < ctx.validation_retries:
+                # Los errores concretos vuelven al LLM para que corrija la consulta
+                attempt += 1
+                prompt = build_repair_prompt(table_context, query, generated_sql, errors)
+                with trace.span("repair_llm", **{"llm.prompt_chars": len(prompt), "repair.attempt": attempt}) as span:
+                    response_fix = yield invoke(llm, prompt)
+                    span.set(**usage_attributes(response_fix))
+                repaired_sql = extract_sql(response_fix.content if hasattr(response_fix, 'content') else str(response_fix))
+                if not repaired_sql:
+                    continue
+                generated_sql = repaired_sql
+                with trace.span("validation") as span:
+                    errors = validation_errors(generated_sql, schema_columns)
+                    span.set(**{"sql.valid": not errors, "sql.validation_errors": len(errors)})
+            if errors:
+                yield event(DONE, result=_invalid_sql_result(generated_sql, errors))
+                return
+            yield event(QUERY_GENERATED, query=generated_sql, query_cache_hit=False)
+
+            # 4. Execute SQL (Explicit Step 2) - con guarda de coste previa (EXPLAIN)
+            try:
+                try:
+                    with trace.span("db_execution", **{"db.statement": generated_sql}) as span:
+                        raw_result, compacted, more_rows, from_cache = yield from cached_sql_steps(ctx, generated_sql, span)
+                except QueryCostError as e:
+                    if ctx.cost_action != "rewrite":
+                        raise
+                    # 4b. Un único intento de pedir al LLM una variante más barata
+                    prompt = build_cheaper_prompt(table_context, query, generated_sql, str(e))
+                    with trace.span("rewrite_llm", **{"llm.prompt_chars": len(prompt)}) as span:
+                        response_rw = yield invoke(llm, prompt)
+                        span.set(**usage_attributes(response_rw))
+                    cheaper_sql = extract_sql(response_rw.content if hasattr(response_rw, 'content') else str(response_rw))
+                    if not cheaper_sql or validation_errors(cheaper_sql, schema_columns):
+                        raise
+                    generated_sql = cheaper_sql
+                    yield event(QUERY_GENERATED, query=generated_sql, query_cache_hit=False, rewritten=True)
+                    with trace.span("db_execution", **{"db.statement": generated_sql}) as span:
+                        raw_result, compacted, more_rows, from_cache = yield from cached_sql_steps(ctx, generated_sql, span)
+            except QueryCostError as e:
+                yield event(DONE, result=_too_expensive_result(generated_sql, e))
+                return
+            except Exception as e:
+                yield event(DONE, result={
+                    "answer": f"Error al ejecutar la consulta SQL: {str(e)}",
+                    "sql_queries": [generated_sql],
+                    "raw_results": [f"Error: {str(e)}"],
+                    "error": str(e)
+                })
+                return
+            yield Io(partial(query_cache.store, "postgres", cache_scope, query, generated_sql))
+            yield Io(partial(example_store.add, "postgres", query, generated_sql))
+
+        yield event(ROWS_FETCHED, raw_result=str(raw_result), from_cache=from_cache, more_rows=more_rows)
+
+        # 5. Interpret Result (Explicit Step 3) - la respuesta se emite token a token
+        prompt = build_interpretation_prompt(query, generated_sql, compacted.text, compacted.truncated, more_rows)
+        with trace.span("interpretation_llm", **{"llm.prompt_chars": len(prompt)}) as span:
+            answer_parts = yield answer_tokens(llm, prompt, span)
+        final_answer = "".join(answer_parts)
 
-        return {
+        yield event(DONE, result={
             "answer": final_answer,
             "sql_queries": [generated_sql],
             "raw_results": [str(raw_result)],
+            "raw_results_from_cache": [from_cache],
+            "raw_results_truncated_in_prompt": [compacted.truncated],
+            "more_rows_available": [more_rows],
+            "query_cache_hit": cached is not None,
+            "fast_path": False,
             "error": None
-        }
+        })
 
     except Exception as e:
         import traceback
         error_msg = f"{str(e)}\n\nTraceback:\n{traceback.format_exc()}"
-        return {
+        yield event(DONE, result={
             "answer": "Ocurrió un error inesperado.",
             "sql_queries": [],
             "raw_results": [],
             "error": error_msg
-        }
+        })
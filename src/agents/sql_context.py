@@ -0,0 +1,615 @@
+"""
+Long-lived, thread-safe execution context for the SQL agent.
+
+Creating the SQLAlchemy engine, registering the session listener, reflecting
+the schema and building the LLM client used to happen on every question. This
+module builds those objects once per database URI and shares them between the
+CLI loop, the GUI worker threads and the evaluation script.
+
+The async API (``arun_sql_agent``) gets a second, lazily created engine on
+asyncpg that shares the same schema cache and LLM client.
+
+Before a generated statement runs, ``check_cost`` asks PostgreSQL for its plan
+(``EXPLAIN (FORMAT JSON)``, nothing is executed) and rejects it when the
+estimated cost or row count is over ``SQL_MAX_PLAN_COST`` /
+``SQL_MAX_PLAN_ROWS``. Every statement also runs under ``SET LOCAL
+statement_timeout`` (``SQL_STATEMENT_TIMEOUT_MS``).
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from src.agents.llm_context import get_llm
+from src.agents.schema_cache import (
+    INDEX_ROWS, SQLSchemaCache, acatalog_fingerprint, catalog_fingerprint, schema_cache_path,
+)
+from src.agents.schema_index import (
+    PruningStats, SchemaIndex, SchemaSelection, afetch_index_rows, estimate_tokens, fetch_index_rows,
+)
+from src.utils.config import env_int
+
+
+def _set_session_config(dbapi_connection, connection_record):
+    """Configura la sesión para usar UTF-8 y locale C (una vez por conexión física)."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SET CLIENT_ENCODING TO 'UTF8'")
+        cursor.execute("SET lc_messages TO 'C'")
+        cursor.execute("SET lc_monetary TO 'C'")
+        cursor.execute("SET lc_numeric TO 'C'")
+        cursor.execute("SET lc_time TO 'C'")
+    except Exception:
+        pass
+    finally:
+        cursor.close()
+
+
+def format_rows(rows, max_string_length: int = 300) -> str:
+    """Formats fetched rows exactly like ``SQLDatabase.run`` so both paths share cache entries."""
+    if not rows:
+        return ""
+    return str([
+        tuple(truncate_word(value, length=max_string_length) for value in row)
+        for row in rows
+    ])
+
+
+_READ_QUERY_RE = re.compile(r"^\s*(?:SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+_TOP_LEVEL_LIMIT_RE = re.compile(r"\b(?:LIMIT|FETCH\s+(?:FIRST|NEXT))\b", re.IGNORECASE)
+_LOCKING_CLAUSE_RE = re.compile(r"\bFOR\s+(?:UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b", re.IGNORECASE)
+
+
+def _quoted_end(sql: str, start: int) -> int:
+    """Index just past the literal or quoted identifier opened at ``start`` (doubled quotes escape)."""
+    quote, end, n = sql[start], start + 1, len(sql)
+    while end < n:
+        if sql[end] == quote:
+            if end + 1 < n and sql[end + 1] == quote:
+                end += 2
+                continue
+            break
+        end += 1
+    return end + 1
+
+
+def strip_statement_end(sql: str) -> str:
+    """``sql`` without its trailing semicolons, comments and whitespace."""
+    end = 0
+    i, n = 0, len(sql)
+    while i < n:
+        if sql.startswith("--", i):
+            newline = sql.find("\n", i)
+            i = n if newline == -1 else newline
+            continue
+        if sql.startswith("/*", i):
+            close = sql.find("*/", i + 2)
+            i = n if close == -1 else close + 2
+            continue
+        if sql[i] in ("'", '"'):
+            i = end = min(_quoted_end(sql, i), n)
+            continue
+        if not sql[i].isspace() and sql[i] != ";":
+            end = i + 1
+        i += 1
+    return sql[:end]
+
+
+def top_level_sql(sql: str) -> str:
+    """``sql`` with comments, literals, quoted identifiers and parenthesized parts blanked out."""
+    out = []
+    depth = 0
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        if sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        if ch in ("'", '"'):
+            i = _quoted_end(sql, i)
+            out.append(" ")
+            continue
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def inject_limit(sql: str, limit: int) -> str:
+    """
+    Appends ``LIMIT limit`` to a read query that has no top-level LIMIT/FETCH.
+
+    Statements that are not SELECT/WITH/VALUES/TABLE, or that end in a locking
+    clause, are returned unchanged.
+    """
+    if not _READ_QUERY_RE.match(sql):
+        return sql
+    outer = top_level_sql(sql)
+    if _TOP_LEVEL_LIMIT_RE.search(outer) or _LOCKING_CLAUSE_RE.search(outer):
+        return sql
+    # Sin el ';' ni los comentarios finales: "...; -- todos" dejaría el LIMIT fuera de la sentencia
+    return f"{strip_statement_end(sql)}\nLIMIT {int(limit)}"
+
+
+class QueryCost(NamedTuple):
+    total_cost: float
+    plan_rows: int
+    node_type: str
+
+
+class QueryCostError(RuntimeError):
+    """The planner estimate of a statement is over the configured thresholds."""
+
+    def __init__(self, message: str, cost: QueryCost):
+        super().__init__(message)
+        self.cost = cost
+
+
+def plan_cost(explain_output) -> QueryCost:
+    """
+    Summarizes ``EXPLAIN (FORMAT JSON)`` output.
+
+    ``plan_rows`` is the largest row estimate of any node that is not below a
+    ``Limit``: a cross join under ``LIMIT`` only produces the limited rows, but
+    one under an aggregate is processed in full.
+    """
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    if isinstance(explain_output, list):
+        explain_output = explain_output[0]
+    root = explain_output["Plan"]
+    max_rows = 0
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        max_rows = max(max_rows, int(node.get("Plan Rows", 0)))
+        if node.get("Node Type") != "Limit":
+            pending.extend(node.get("Plans", []))
+    return QueryCost(float(root.get("Total Cost", 0.0)), max_rows, root.get("Node Type", ""))
+
+
+def async_db_uri(db_uri: str) -> str:
+    """Same database URI with the asyncpg driver (``postgresql+asyncpg://``)."""
+    url = make_url(db_uri)
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
+
+class PoolStats:
+    """Thread-safe counters for connection checkouts from the pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            avg = self.total_wait / self.checkouts if self.checkouts else 0.0
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_s": round(self.total_wait, 6),
+                "avg_wait_s": round(avg, 6),
+                "max_wait_s": round(self.max_wait, 6),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that measures how long callers wait to check out a connection."""
+
+    stats: Optional[PoolStats] = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            conn = super().connect()
+        except Exception:
+            if self.stats is not None:
+                self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        if self.stats is not None:
+            self.stats.record(time.perf_counter() - start)
+        return conn
+
+
+class SQLAgentContext:
+    """
+    Shared engine pool, SQLDatabase wrapper and LLM client for one database URI.
+
+    Pool size, overflow and checkout timeout are read from ``SQL_POOL_SIZE``,
+    ``SQL_MAX_OVERFLOW`` and ``SQL_POOL_TIMEOUT`` unless given explicitly; the
+    per-query row cap and cursor batch size from ``SQL_MAX_ROWS`` and
+    ``SQL_FETCH_SIZE``; the cost gate from ``SQL_MAX_PLAN_COST``,
+    ``SQL_MAX_PLAN_ROWS`` and ``SQL_COST_ACTION`` (``rewrite`` asks the LLM
+    for a cheaper query, ``refuse`` rejects it directly) and the per-query
+    timeout from ``SQL_STATEMENT_TIMEOUT_MS``. A threshold of 0 disables it.
+    ``SQL_SCHEMA_PRUNING=0`` sends the full schema instead of the tables
+    relevant to each question; ``SQL_VALIDATION_RETRIES`` is how many times
+    the LLM may repair a query rejected by local validation.
+    """
+
+    def __init__(self, db_uri: str, pool_size: Optional[int] = None,
+                 max_overflow: Optional[int] = None, pool_timeout: Optional[int] = None):
+        self.db_uri = db_uri
+        self.pool_size = pool_size if pool_size is not None else env_int("SQL_POOL_SIZE", 5)
+        self.max_overflow = max_overflow if max_overflow is not None else env_int("SQL_MAX_OVERFLOW", 10)
+        self.pool_timeout = pool_timeout if pool_timeout is not None else env_int("SQL_POOL_TIMEOUT", 30)
+        self.max_rows = max(1, env_int("SQL_MAX_ROWS", 1000))
+        self.fetch_size = max(1, env_int("SQL_FETCH_SIZE", 500))
+        self.max_plan_cost = env_int("SQL_MAX_PLAN_COST", 1000000)
+        self.max_plan_rows = env_int("SQL_MAX_PLAN_ROWS", 10000000)
+        self.cost_action = (os.getenv("SQL_COST_ACTION") or "rewrite").strip().lower()
+        self.statement_timeout_ms = env_int("SQL_STATEMENT_TIMEOUT_MS", 30000)
+        self.schema_pruning = env_int("SQL_SCHEMA_PRUNING", 1) != 0
+        self.validation_retries = max(0, env_int("SQL_VALIDATION_RETRIES", 1))
+        self.pruning_stats = PruningStats()
+        self._schema_index: Optional[SchemaIndex] = None
+        self.stats = PoolStats()
+
+        self.engine = create_engine(
+            db_uri,
+            poolclass=TimedQueuePool,
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_pre_ping=True,
+            connect_args={'client_encoding': 'utf8'},
+        )
+        self.engine.pool.stats = self.stats
+        # Listener registrado una sola vez: los SET se ejecutan por conexión física, no por pregunta
+        event.listen(self.engine, "connect", _set_session_config)
+
+        # Reflexión diferida: el esquema lo sirve SQLSchemaCache y solo se refleja si cambió el DDL
+        self.db = SQLDatabase(self.engine, sample_rows_in_table_info=0, lazy_table_reflection=True)
+        self.schema_cache = SQLSchemaCache(schema_cache_path(self.engine))
+        # Cliente del modelo compartido con el agente MongoDB (ver src.agents.llm_context)
+        self.llm = get_llm()
+        self._async_engine = None
+        self._async_lock = threading.Lock()
+
+    @property
+    def async_engine(self):
+        """AsyncEngine on asyncpg with the same pool settings, created on first use."""
+        if self._async_engine is None:
+            with self._async_lock:
+                if self._async_engine is None:
+                    # Import diferido: asyncpg solo hace falta si se usa la API async
+                    from sqlalchemy.ext.asyncio import create_async_engine
+                    engine = create_async_engine(
+                        async_db_uri(self.db_uri),
+                        pool_size=self.pool_size,
+                        max_overflow=self.max_overflow,
+                        pool_timeout=self.pool_timeout,
+                        pool_pre_ping=True,
+                    )
+                    event.listen(engine.sync_engine, "connect", _set_session_config)
+                    self._async_engine = engine
+        return self._async_engine
+
+    def get_table_info(self) -> str:
+        """Schema DDL for the generation prompt, served from the fingerprinted cache."""
+        return self.schema_cache.get(self.engine, self._reflect_table_info)
+
+    async def aget_table_info(self) -> str:
+        """Async ``get_table_info``: fingerprint over asyncpg, reflection (rare) in a worker thread."""
+        fingerprint = await acatalog_fingerprint(self.async_engine)
+        return await asyncio.to_thread(self.schema_cache.get_for, fingerprint, self._reflect_table_info)
+
+    def get_schema_context(self, question: str):
+        """
+        Schema text for the generation prompt of ``question``.
+
+        On PostgreSQL a ``SchemaIndex`` is rebuilt with one catalog query
+        whenever the fingerprint changes; it also feeds ``schema_columns`` for
+        SQL validation. Unless ``SQL_SCHEMA_PRUNING=0``, only the relevant
+        tables and their FK neighbours are included.
+
+        Returns:
+            Tuple ``(SchemaSelection, fingerprint)``.
+        """
+        if not self.is_postgres:
+            return self._full_selection(self.get_table_info()), self.schema_fingerprint
+        fingerprint = catalog_fingerprint(self.engine)
+        index = self._schema_index
+        if index is None or index.fingerprint != fingerprint:
+            # Filas del índice desde el snapshot persistido; el catálogo solo se vuelca si cambió la huella
+            rows = self.schema_cache.get_for(fingerprint, lambda: fetch_index_rows(self.engine), INDEX_ROWS)
+            index = SchemaIndex(rows, fingerprint)
+            self._schema_index = index
+        if not self.schema_pruning:
+            table_info = self.schema_cache.get_for(fingerprint, self._reflect_table_info)
+            return self._full_selection(table_info), fingerprint
+        return self._select(index, question), fingerprint
+
+    async def aget_schema_context(self, question: str):
+        """Async ``get_schema_context`` (catalog queries over asyncpg)."""
+        if not self.is_postgres:
+            return self._full_selection(await self.aget_table_info()), self.schema_fingerprint
+        fingerprint = await acatalog_fingerprint(self.async_engine)
+        index = self._schema_index
+        if index is None or index.fingerprint != fingerprint:
+            found, rows = await asyncio.to_thread(self.schema_cache.lookup, fingerprint, INDEX_ROWS)
+            if not found:
+                start = time.perf_counter()
+                rows = await afetch_index_rows(self.async_engine)
+                self.schema_cache.store(fingerprint, INDEX_ROWS, rows, time.perf_counter() - start)
+            index = SchemaIndex(rows, fingerprint)
+            self._schema_index = index
+        if not self.schema_pruning:
+            table_info = await asyncio.to_thread(self.schema_cache.get_for, fingerprint, self._reflect_table_info)
+            return self._full_selection(table_info), fingerprint
+        return self._select(index, question), fingerprint
+
+    def schema_columns(self) -> Optional[Dict[str, List[str]]]:
+        """Column names per table from the last schema index (None before it is loaded or off PostgreSQL)."""
+        index = self._schema_index
+        return index.columns if index is not None else None
+
+    def schema_column_types(self) -> Optional[Dict[str, Dict[str, str]]]:
+        """PostgreSQL type of every column per table from the last schema index (same availability as ``schema_columns``)."""
+        index = self._schema_index
+        return index.column_types if index is not None else None
+
+    def invalidate_schema(self):
+        """Drops the cached schema text and index so the next question reloads them."""
+        self.schema_cache.invalidate()
+        self._schema_index = None
+
+    @staticmethod
+    def _full_selection(table_info: str) -> SchemaSelection:
+        tokens = estimate_tokens(table_info)
+        return SchemaSelection(table_info, [], tokens, tokens)
+
+    def _select(self, index: SchemaIndex, question: str) -> SchemaSelection:
+        selection = index.select(question)
+        self.pruning_stats.record(selection)
+        return selection
+
+    @property
+    def is_postgres(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    def _timeout_sql(self) -> Optional[str]:
+        if not self.is_postgres or self.statement_timeout_ms <= 0:
+            return None
+        # SET no admite parámetros enlazados; el valor es un entero de la configuración
+        return f"SET LOCAL statement_timeout = {int(self.statement_timeout_ms)}"
+
+    def _explain_sql(self, sql: str) -> str:
+        return f"EXPLAIN (FORMAT JSON) {strip_statement_end(inject_limit(sql, self.max_rows + 1))}"
+
+    def _check_plan(self, explain_output) -> QueryCost:
+        cost = plan_cost(explain_output)
+        reasons = []
+        if self.max_plan_cost > 0 and cost.total_cost > self.max_plan_cost:
+            reasons.append(f"coste estimado {cost.total_cost:.0f} > {self.max_plan_cost}")
+        if self.max_plan_rows > 0 and cost.plan_rows > self.max_plan_rows:
+            reasons.append(f"filas estimadas {cost.plan_rows} > {self.max_plan_rows}")
+        if reasons:
+            raise QueryCostError("; ".join(reasons), cost)
+        return cost
+
+    def check_cost(self, sql: str) -> Optional[QueryCost]:
+        """
+        Plans ``sql`` (as ``run`` would execute it) and checks the estimate against the thresholds.
+
+        Returns:
+            The ``QueryCost``, or None if the backend has no JSON EXPLAIN.
+
+        Raises:
+            QueryCostError: If the estimated cost or rows are over the limits.
+        """
+        if not self.is_postgres:
+            return None
+        with self.engine.begin() as conn:
+            timeout_sql = self._timeout_sql()
+            if timeout_sql:
+                conn.exec_driver_sql(timeout_sql)
+            explain_output = conn.execute(text(self._explain_sql(sql))).scalar()
+        return self._check_plan(explain_output)
+
+    async def acheck_cost(self, sql: str) -> Optional[QueryCost]:
+        """Async ``check_cost`` on the asyncpg engine."""
+        if not self.is_postgres:
+            return None
+        async with self.async_engine.begin() as conn:
+            timeout_sql = self._timeout_sql()
+            if timeout_sql:
+                await conn.exec_driver_sql(timeout_sql)
+            explain_output = (await conn.execute(text(self._explain_sql(sql)))).scalar()
+        return self._check_plan(explain_output)
+
+    def run(self, sql: str):
+        """
+        Executes ``sql`` through a server-side cursor, fetching at most ``max_rows``.
+
+        Read queries without a LIMIT get ``LIMIT max_rows + 1`` injected; the
+        extra row only tells whether more rows exist and is never returned.
+        The statement runs under ``statement_timeout_ms``.
+
+        Returns:
+            Tuple ``(rows, columns, more_rows)``; ``format_rows(rows)`` is the
+            string ``db.run`` would return.
+        """
+        with self.engine.begin() as conn:
+            timeout_sql = self._timeout_sql()
+            if timeout_sql:
+                # SET LOCAL: solo dura la transacción, la conexión vuelve al pool sin el límite
+                conn.exec_driver_sql(timeout_sql)
+            # yield_per -> cursor con nombre en psycopg2: las filas llegan por lotes de fetch_size
+            result = conn.execution_options(yield_per=self.fetch_size).execute(
+                text(inject_limit(sql, self.max_rows + 1))
+            )
+            if not result.returns_rows:
+                return [], [], False
+            columns = list(result.keys())
+            rows = result.fetchmany(self.max_rows + 1)
+            result.close()
+        return self._cap(rows, columns)
+
+    async def arun(self, sql: str):
+        """Async ``run`` on the asyncpg engine (streamed cursor); same ``(rows, columns, more_rows)`` tuple."""
+        async with self.async_engine.begin() as conn:
+            timeout_sql = self._timeout_sql()
+            if timeout_sql:
+                await conn.exec_driver_sql(timeout_sql)
+            result = await conn.stream(
+                text(inject_limit(sql, self.max_rows + 1)),
+                execution_options={"yield_per": self.fetch_size},
+            )
+            columns = list(result.keys())
+            rows = await result.fetchmany(self.max_rows + 1)
+            await result.close()
+        return self._cap(rows, columns)
+
+    def _cap(self, rows, columns):
+        more_rows = len(rows) > self.max_rows
+        return rows[:self.max_rows], columns, more_rows
+
+    @property
+    def schema_fingerprint(self):
+        """Catalog fingerprint of the schema last returned by ``get_table_info``."""
+        return self.schema_cache.fingerprint
+
+    def _reflect_table_info(self) -> str:
+        # Un SQLDatabase nuevo para no arrastrar tablas reflejadas antes del cambio de DDL
+        db = SQLDatabase(self.engine, sample_rows_in_table_info=0)
+        self.db = db
+        return db.get_table_info()
+
+    def pool_stats(self) -> dict:
+        """Returns checkout wait statistics together with the current pool occupancy."""
+        pool = self.engine.pool
+        stats = self.stats.snapshot()
+        stats.update({
+            "pool_size": pool.size(),
+            "max_overflow": self.max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+        return stats
+
+    def dispose(self):
+        """Closes every pooled connection."""
+        self.engine.dispose()
+        if self._async_engine is not None:
+            # Fuera del event loop no se pueden cerrar conexiones asyncpg; se descarta el pool
+            self._async_engine.sync_engine.dispose(close=False)
+
+    async def adispose(self):
+        """Closes the async engine's connections from inside the event loop."""
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+
+
+_contexts: Dict[str, SQLAgentContext] = {}
+_contexts_lock = threading.Lock()
+
+
+def get_sql_context(db_uri: str) -> SQLAgentContext:
+    """Returns the process-wide context for ``db_uri``, creating it on first use."""
+    ctx = _contexts.get(db_uri)
+    if ctx is not None:
+        return ctx
+    with _contexts_lock:
+        ctx = _contexts.get(db_uri)
+        if ctx is None:
+            ctx = SQLAgentContext(db_uri)
+            _contexts[db_uri] = ctx
+        return ctx
+
+
+def known_schema_fingerprint(db_uri: str) -> Optional[str]:
+    """Catalog fingerprint last seen for ``db_uri``, without querying it (None before the first question)."""
+    ctx = _contexts.get(db_uri)
+    if ctx is None:
+        return None
+    index = ctx._schema_index
+    return index.fingerprint if index is not None else ctx.schema_fingerprint
+
+
+def sql_pool_stats() -> Dict[str, dict]:
+    """Pool statistics for every live context, keyed by URI (password hidden)."""
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+    return {
+        ctx.engine.url.render_as_string(hide_password=True): ctx.pool_stats()
+        for ctx in contexts
+    }
+
+
+def sql_schema_pruning_stats() -> Dict[str, dict]:
+    """Prompt tokens saved by schema pruning for every live context, keyed by URI (password hidden)."""
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+    return {
+        ctx.engine.url.render_as_string(hide_password=True): ctx.pruning_stats.snapshot()
+        for ctx in contexts
+        if ctx.pruning_stats.questions
+    }
+
+
+def sql_schema_cache_stats() -> Dict[str, dict]:
+    """Schema cache hit/miss counters for every live context, keyed by URI (password hidden)."""
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+    return {
+        ctx.engine.url.render_as_string(hide_password=True): ctx.schema_cache.stats()
+        for ctx in contexts
+    }
+
+
+async def adispose_sql_contexts():
+    """Closes the asyncpg connections of every context; call before the event loop ends."""
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+    for ctx in contexts:
+        try:
+            await ctx.adispose()
+        except Exception:
+            pass
+
+
+def shutdown_sql_contexts():
+    """Disposes every shared engine. Safe to call more than once."""
+    with _contexts_lock:
+        contexts = list(_contexts.values())
+        _contexts.clear()
+    for ctx in contexts:
+        try:
+            ctx.dispose()
+        except Exception:
+            pass
@@ -0,0 +1,166 @@
+"""
+Local validation of generated SQL, before any database round trip.
+
+The statement is parsed with sqlglot (PostgreSQL dialect) and must be a
+single read-only query: SELECT, set operations or VALUES, optionally with
+CTEs. The following are rejected:
+
+- writes anywhere in the tree (including data-modifying CTEs);
+- ``SELECT ... INTO``;
+- row locks;
+- server-side functions with side effects.
+
+Tables are checked against the cached schema (``SchemaIndex.columns``), and
+columns are resolved with sqlglot's ``qualify``. Error messages are in
+Spanish and name the offending identifier plus close matches, so they can be
+pasted back into a repair prompt for the model.
+"""
+import difflib
+import re
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import OptimizeError, ParseError
+from sqlglot.optimizer.qualify import qualify
+
+DIALECT = "postgres"
+CATALOG_SCHEMAS = {"pg_catalog", "information_schema"}
+
+READ_ROOTS = tuple(
+    node for node in (getattr(exp, name, None) for name in ("Select", "Union", "Except", "Intersect", "Values"))
+    if node is not None
+)
+# Los nombres cambian entre versiones de sqlglot (AlterTable -> Alter, etc.)
+WRITE_NODES = tuple(
+    node for node in (getattr(exp, name, None) for name in (
+        "Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "AlterTable",
+        "TruncateTable", "Command", "Grant", "Set", "Copy", "Use",
+    ))
+    if node is not None
+)
+# Funciones con efectos fuera de la consulta (bloqueos, ficheros, procesos, secuencias)
+UNSAFE_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_terminate_backend", "pg_cancel_backend",
+    "pg_reload_conf", "pg_rotate_logfile", "pg_read_file", "pg_read_binary_file", "pg_ls_dir",
+    "lo_import", "lo_export", "dblink", "dblink_exec", "set_config", "nextval", "setval",
+    "pg_advisory_lock", "pg_advisory_xact_lock", "txid_current",
+}
+
+# Mensajes de OptimizeError de qualify (varían entre versiones de sqlglot)
+_UNRESOLVED_COLUMN_RE = re.compile(
+    r"Column '([^']+)' could not be resolved(?: for table: '([^']+)')?|Unknown column: ([^\s,]+)"
+)
+
+
+def _suggest(name: str, candidates) -> str:
+    matches = difflib.get_close_matches(name, list(candidates), n=3, cutoff=0.6)
+    return f" (¿quizá {', '.join(matches)}?)" if matches else ""
+
+
+def _parse_message(error: ParseError) -> str:
+    details = getattr(error, "errors", None) or []
+    if details:
+        first = details[0]
+        return f"línea {first.get('line')}, columna {first.get('col')}: {first.get('description')}"
+    return str(error).splitlines()[0]
+
+
+def _function_name(func: exp.Func) -> str:
+    if isinstance(func, exp.Anonymous):
+        return str(func.name).lower()
+    return func.sql_name().lower()
+
+
+def _read_only_errors(tree: exp.Expression) -> List[str]:
+    if not isinstance(tree, READ_ROOTS):
+        return [f"Solo se permiten consultas de lectura (SELECT o WITH ... SELECT); se recibió {tree.key.upper()}"]
+    errors = [
+        f"Operación de escritura no permitida dentro de la consulta: {node.key.upper()}"
+        for node in tree.find_all(*WRITE_NODES)
+    ]
+    if tree.find(exp.Into):
+        errors.append("SELECT ... INTO crea una tabla y no está permitido")
+    if tree.find(exp.Lock):
+        errors.append("FOR UPDATE / FOR SHARE bloquea filas y no está permitido")
+    for func in tree.find_all(exp.Func):
+        name = _function_name(func)
+        if name in UNSAFE_FUNCTIONS:
+            errors.append(f"Función no permitida: {name}()")
+    return errors
+
+
+def _column_error(message: str, columns: Dict[str, List[str]], referenced: List[str]) -> Optional[str]:
+    match = _UNRESOLVED_COLUMN_RE.search(message)
+    if not match:
+        return None
+    column = (match.group(1) or match.group(3)).strip('"').split(".")[-1].strip('"')
+    table = (match.group(2) or "").strip('"')
+    if table in columns:
+        return f"La columna '{column}' no existe en la tabla '{table}'{_suggest(column, columns[table])}"
+    # Sugerencias solo entre las columnas de las tablas usadas en la consulta
+    candidates = {f"{t}.{c}": c for t in referenced for c in columns[t]}
+    close = difflib.get_close_matches(column, set(candidates.values()), n=3, cutoff=0.6)
+    hint = f" (¿quizá {', '.join(sorted(q for q, c in candidates.items() if c in close))}?)" if close else ""
+    return f"La columna '{column}' no existe en ninguna de las tablas de la consulta{hint}"
+
+
+def _schema_errors(tree: exp.Expression, schema: Dict[str, List[str]]) -> List[str]:
+    columns = {table.lower(): [c.lower() for c in cols] for table, cols in schema.items()}
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    errors = []
+    referenced = []
+    reads_catalog = False
+    for table in tree.find_all(exp.Table):
+        if not isinstance(table.this, exp.Identifier):
+            continue  # funciones de tabla (generate_series, unnest...)
+        name = table.name.lower()
+        if table.db and table.db.lower() in CATALOG_SCHEMAS:
+            reads_catalog = True
+            continue
+        if name in columns and name not in ctes:
+            referenced.append(name)
+        if name in ctes or name in columns:
+            continue
+        errors.append(
+            f"La tabla '{table.name}' no existe{_suggest(name, columns)}. "
+            f"Tablas disponibles: {', '.join(sorted(columns))}"
+        )
+    if errors or reads_catalog:
+        return errors
+
+    mapping = {table: {col: "UNKNOWN" for col in cols} for table, cols in columns.items()}
+    try:
+        qualify(tree.copy(), dialect=DIALECT, schema=mapping, validate_qualify_columns=True,
+                quote_identifiers=False, identify=False)
+    except OptimizeError as e:
+        error = _column_error(str(e), columns, sorted(set(referenced)))
+        if error:
+            errors.append(error)
+    except Exception:
+        # Construcciones que qualify no entiende: no se puede afirmar que la consulta sea incorrecta
+        pass
+    return errors
+
+
+def validation_errors(sql: str, schema: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """
+    Problems found in ``sql``; an empty list means it can run.
+
+    Args:
+        sql: Generated statement.
+        schema: Column names per table (``SQLAgentContext.schema_columns``).
+            None only checks syntax and that the statement is read-only.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=DIALECT) if s is not None]
+    except ParseError as e:
+        return [f"Error de sintaxis en {_parse_message(e)}"]
+    if len(statements) != 1:
+        return [f"Se esperaba una única sentencia SQL y hay {len(statements)}"]
+    tree = statements[0]
+    errors = _read_only_errors(tree)
+    if not errors and schema:
+        errors = _schema_errors(tree, schema)
+    return errors
+
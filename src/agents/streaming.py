@@ -0,0 +1,85 @@
+"""
+Structured events emitted by the streaming variants of the agent pipelines.
+
+``stream_sql_agent`` / ``stream_mongo_agent`` yield plain dicts with a ``type``
+key, in this order:
+
+- ``QUERY_GENERATED``: ``{"query": str, "query_cache_hit": bool}``; emitted
+  again with ``rewritten=True`` when the SQL cost gate swaps in a cheaper query,
+  and carrying ``fast_path=True`` when no LLM was involved (``src.agents.fast_path``)
+- ``ROWS_FETCHED``: ``{"raw_result": str, "from_cache": bool, "more_rows": bool}``
+- ``ANSWER_TOKEN``: ``{"text": str}`` (one per chunk of the interpretation)
+- ``DONE``: ``{"result": dict}`` with the same shape ``run_*_agent`` returns,
+  including the request ``trace`` (see ``src.agents.tracing``)
+
+Only ``DONE`` is guaranteed; errors end the stream early with a ``DONE``
+event whose result has ``error`` set. ``astream_sql_agent`` /
+``astream_mongo_agent`` yield the same events from an async generator.
+"""
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from src.agents.tracing import usage_attributes
+
+QUERY_GENERATED = "query_generated"
+ROWS_FETCHED = "rows_fetched"
+ANSWER_TOKEN = "answer_token"
+DONE = "done"
+
+
+def event(event_type: str, **data) -> dict:
+    data["type"] = event_type
+    return data
+
+
+def collect_result(events: Iterable[dict]) -> dict:
+    """Drains an event stream and returns the final result dict."""
+    result = None
+    for ev in events:
+        if ev["type"] == DONE:
+            result = ev["result"]
+    return result
+
+
+def stream_answer(llm, prompt: str, span=None) -> Iterator[str]:
+    """Yields the LLM answer chunk by chunk, recording token usage on ``span`` if given."""
+    for chunk in llm.stream(prompt):
+        if span is not None:
+            span.set(**usage_attributes(chunk))
+        text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        if text:
+            yield text
+
+
+async def acollect_result(events: AsyncIterable[dict]) -> dict:
+    """Async counterpart of ``collect_result``."""
+    result = None
+    async for ev in events:
+        if ev["type"] == DONE:
+            result = ev["result"]
+    return result
+
+
+async def astream_answer(llm, prompt: str, span=None) -> AsyncIterator[str]:
+    """Yields the LLM answer chunk by chunk without blocking the event loop."""
+    async for chunk in llm.astream(prompt):
+        if span is not None:
+            span.set(**usage_attributes(chunk))
+        text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        if text:
+            yield text
+
+
+def traced(trace, events: Iterable[dict]) -> Iterator[dict]:
+    """Passes pipeline events through, attaching the finished trace to the ``DONE`` result."""
+    for ev in events:
+        if ev["type"] == DONE:
+            ev["result"]["trace"] = trace.finish(ev["result"])
+        yield ev
+
+
+async def atraced(trace, events: AsyncIterable[dict]) -> AsyncIterator[dict]:
+    """Async counterpart of ``traced``."""
+    async for ev in events:
+        if ev["type"] == DONE:
+            ev["result"]["trace"] = trace.finish(ev["result"])
+        yield ev
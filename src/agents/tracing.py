@@ -0,0 +1,189 @@
+"""
+Lightweight per-request tracing for the agent pipelines.
+
+Every ``run_*_agent`` / ``stream_*_agent`` call builds a ``Trace`` with a root
+span and nested child spans (schema load, cache lookup, LLM calls, execution)
+that carry timestamps plus attributes such as token counts, row counts and
+byte sizes. The finished trace is returned under the ``trace`` key of the
+result dict and, if ``TRACE_FILE`` is set, appended to that file as one
+OTLP/JSON ``resourceSpans`` document per line, so it can be replayed into any
+OpenTelemetry collector.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+SERVICE_NAME = "proyecto_pbd_ia"
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+_file_lock = threading.Lock()
+
+
+class Span:
+    """One timed operation inside a trace."""
+
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str] = None, **attributes):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.status = STATUS_OK
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter_ns()
+        self.end_ns = None
+
+    def set(self, **attributes):
+        """Adds attributes; None values are skipped."""
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def fail(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else self.start_ns + (time.perf_counter_ns() - self._start_perf)
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": dict(self.attributes),
+            "status": self.status,
+            "status_message": self.status_message,
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.status_message or ""} if self.status == STATUS_ERROR else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Trace:
+    """
+    Spans of one agent request. Not shared between requests, so concurrent
+    threads or coroutines never see each other's span stack.
+
+    Args:
+        name: Name of the root span (e.g. ``sql_agent``).
+        **attributes: Attributes of the root span.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(self.trace_id, name, **attributes)
+        self.spans: List[Span] = [self.root]
+        self._stack: List[Span] = [self.root]
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Child span of the innermost open span; exceptions mark it as failed."""
+        span = Span(self.trace_id, name, parent_id=self._stack[-1].span_id, **attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(str(e) or type(e).__name__)
+            raise
+        finally:
+            span.end()
+            if self._stack and self._stack[-1] is span:
+                self._stack.pop()
+
+    def finish(self, result: Optional[dict] = None) -> dict:
+        """Ends every open span, exports the trace and returns its dict form."""
+        if result and result.get("error"):
+            self.root.fail(str(result["error"]).splitlines()[0])
+        for span in self.spans:
+            span.end()
+        export_trace(self)
+        return self.to_dict()
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def to_otlp(self) -> dict:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp() for span in self.spans],
+                }],
+            }]
+        }
+
+
+def export_trace(trace: Trace, path: Optional[str] = None):
+    """Appends the trace as one OTLP/JSON line to ``path`` (default ``TRACE_FILE``)."""
+    path = path or os.getenv("TRACE_FILE")
+    if not path:
+        return
+    line = json.dumps(trace.to_otlp(), ensure_ascii=False)
+    try:
+        with _file_lock:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError:
+        pass
+
+
+def usage_attributes(message) -> dict:
+    """Prompt/completion token counts reported by the model (empty if unavailable)."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    metadata = getattr(message, "response_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", metadata.get("prompt_eval_count"))
+    completion_tokens = usage.get("output_tokens", metadata.get("eval_count"))
+    attributes = {}
+    if prompt_tokens is not None:
+        attributes["llm.prompt_tokens"] = int(prompt_tokens)
+    if completion_tokens is not None:
+        attributes["llm.completion_tokens"] = int(completion_tokens)
+    return attributes
@@ -0,0 +1,384 @@
+"""
+HTTP service mode: the SQL and MongoDB pipelines for many clients in one process.
+
+Each analyst running ``main.py`` / ``gui.py`` loads their own Ollama model,
+connection pools and caches. ``python main.py --serve`` (or ``python -m
+src.server``) starts one process that keeps all of that warm. The model, the
+SQL engine, the Mongo client, the schema caches and the query/result caches are
+the same process-wide objects the CLI uses.
+
+Endpoints:
+
+- ``POST /query``: ``{"question": "...", "db": "postgres" | "mongo", "explain": false}``.
+  Responds with the result dict as JSON (``answer``, ``sql_queries``,
+  ``raw_results``, ``error``, ``trace``...).
+- ``POST /query/stream``: same body, answered as server-sent events. There is
+  one ``event:`` per pipeline event (``query_generated``, ``rows_fetched``,
+  ``answer_token``) and a final ``done`` carrying the result.
+- ``GET /health``: model state, loaded backends, queue occupancy and
+  single-flight counters (``src.agents.single_flight``).
+
+At most ``SERVE_MAX_CONCURRENT`` questions run at once, and up to
+``SERVE_MAX_QUEUE`` more wait for a slot (for ``SERVE_QUEUE_TIMEOUT_S`` at
+most). Beyond that the server answers ``429`` with ``Retry-After``. On SIGINT
+or SIGTERM it stops accepting connections and waits up to
+``SERVE_DRAIN_TIMEOUT_S`` for in-flight questions. It then closes the pools.
+
+For tests, ``create_server`` takes a ``runner`` (in-process fake pipelines),
+and ``src.agents.llm_context.set_llm`` swaps in a stub LLM in front of real
+databases.
+"""
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Optional
+
+from src.agents.backends import BACKENDS, backend_load_times, load_backend, shutdown_backends
+from src.agents.streaming import DONE
+from src.utils.config import env_int, load_config
+
+MAX_BODY_BYTES = 64 * 1024
+
+# (backend, pregunta, opciones) -> eventos del pipeline terminados en DONE
+Runner = Callable[[str, str, dict], Iterator[dict]]
+
+
+class ServerBusy(Exception):
+    """Every slot and queue position is taken (HTTP 429)."""
+
+
+class ServerClosing(Exception):
+    """The server is shutting down and takes no new questions (HTTP 503)."""
+
+
+class AdmissionGate:
+    """
+    Concurrency limit plus bounded waiting line.
+
+    Args:
+        max_concurrent: Questions running at once (``SERVE_MAX_CONCURRENT``).
+        max_queue: Questions waiting for a slot (``SERVE_MAX_QUEUE``).
+        queue_timeout: Seconds a question may wait before it is rejected (``SERVE_QUEUE_TIMEOUT_S``).
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queue = max(max_queue, 0)
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self.served = 0
+        self.rejected = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Takes a slot, waiting in line if needed.
+
+        Raises:
+            ServerBusy: The line is full or the wait timed out.
+            ServerClosing: The server is shutting down.
+        """
+        with self._cond:
+            if self.closed:
+                raise ServerClosing("El servidor se está cerrando")
+            if self.running < self.max_concurrent:
+                self.running += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise ServerBusy(f"{self.running} consultas en curso y {self.waiting} en cola")
+            self.waiting += 1
+            try:
+                # Las ya encoladas siguen esperando durante el cierre: el drenado las atiende
+                admitted = self._cond.wait_for(lambda: self.running < self.max_concurrent, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.rejected += 1
+                raise ServerBusy(f"Sin hueco libre tras {self.queue_timeout:.0f}s en cola")
+            self.running += 1
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self.served += 1
+            self._cond.notify_all()
+
+    def close(self):
+        """Rejects new questions; running and queued ones continue."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Blocks until nothing runs or waits; False if ``timeout`` expired first."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.running == 0 and self.waiting == 0, timeout)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "running": self.running, "queued": self.waiting, "served": self.served,
+                "rejected": self.rejected, "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue, "closing": self.closed,
+            }
+
+
+def run_backend(backend: str, question: str, options: dict) -> Iterator[dict]:
+    """Default runner: the streaming agent of ``backend``, loaded on first use."""
+    agent = load_backend(backend)
+    if backend == "mongo" and options.get("explain"):
+        return agent(question, explain=True)
+    return agent(question)
+
+
+def warm_up(backends) -> dict:
+    """
+    Loads the model, the backends and their schemas before the first request.
+
+    Failures (database down, no URI) are reported and left for the requests
+    to surface; the server still starts.
+
+    Returns:
+        Seconds per step, or the error message.
+    """
+    from src.agents.llm_context import start_model_warmup
+
+    report = {}
+    start_model_warmup()
+    for backend in backends:
+        start = time.perf_counter()
+        try:
+            load_backend(backend)
+            if backend == "postgres" and os.getenv("POSTGRES_URI"):
+                from src.agents.sql_context import get_sql_context
+                # El mismo camino que una pregunta: índice de esquema (con poda) o DDL completo
+                get_sql_context(os.getenv("POSTGRES_URI")).get_schema_context("")
+            elif backend == "mongo" and os.getenv("MONGO_URI") and os.getenv("MONGO_DB_NAME"):
+                from src.agents.mongo_schema import get_schema_inferrer
+                get_schema_inferrer(os.getenv("MONGO_URI"), os.getenv("MONGO_DB_NAME")).get_schema()
+            report[backend] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            report[backend] = f"error: {e}"
+    return report
+
+
+def _json_bytes(value) -> bytes:
+    # default=str: fechas, Decimal y ObjectId de los resultados crudos
+    return json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    server_version = "AgenteBD/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/health":
+            return self._send_json(404, {"error": f"Ruta no encontrada: {self.path}"})
+        from src.agents.llm_context import model_status
+        from src.agents.single_flight import single_flight_stats
+        self._send_json(200, {
+            "status": "closing" if self.server.gate.closed else "ok",
+            "uptime_seconds": round(time.time() - self.server.started_at, 1),
+            "backends_loaded": backend_load_times(),
+            "model": model_status(check_resident=False),
+            "queue": self.server.gate.snapshot(),
+            "single_flight": single_flight_stats(),
+        })
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/query", "/query/stream"):
+            return self._send_json(404, {"error": f"Ruta no encontrada: {self.path}"})
+        try:
+            backend, question, options = self._read_request()
+        except ValueError as e:
+            # El cuerpo puede no haberse leído: no reutilizar la conexión
+            return self._send_json(400, {"error": str(e)}, {"Connection": "close"})
+
+        gate = self.server.gate
+        try:
+            gate.acquire()
+        except ServerBusy as e:
+            return self._send_json(429, {"error": f"Servidor ocupado: {e}"}, {"Retry-After": "1"})
+        except ServerClosing as e:
+            return self._send_json(503, {"error": str(e)}, {"Connection": "close"})
+        try:
+            events = self.server.runner(backend, question, options)
+            if path == "/query/stream":
+                self._send_events(events)
+            else:
+                result = None
+                for ev in events:
+                    if ev["type"] == DONE:
+                        result = ev["result"]
+                self._send_json(200, result or {"error": "El agente terminó sin resultado"})
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            gate.release()
+
+    def _read_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            raise ValueError(f"Cuerpo JSON requerido (máximo {MAX_BODY_BYTES} bytes)")
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"JSON no válido: {e}")
+        if not isinstance(body, dict):
+            raise ValueError("El cuerpo debe ser un objeto JSON")
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise ValueError("Falta 'question'")
+        backend = body.get("db", "postgres")
+        if backend not in BACKENDS:
+            raise ValueError(f"'db' debe ser uno de: {', '.join(BACKENDS)}")
+        return backend, question.strip(), {"explain": bool(body.get("explain"))}
+
+    def _send_json(self, status: int, payload, headers: Optional[dict] = None):
+        body = _json_bytes(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, events: Iterator[dict]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        # Sin Content-Length: el final del flujo lo marca el cierre de la conexión
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for ev in events:
+                data = {key: value for key, value in ev.items() if key != "type"}
+                self.wfile.write(f"event: {ev['type']}\ndata: ".encode("utf-8") + _json_bytes(data) + b"\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Cliente desconectado: cerrar el generador libera la conexión a la base de datos
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+        except Exception as e:
+            # Las cabeceras ya se enviaron: el fallo viaja como un evento más
+            self.wfile.write(b"event: error\ndata: " + _json_bytes({"error": f"{type(e).__name__}: {e}"}) + b"\n\n")
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class AgentHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with an ``AdmissionGate`` and graceful shutdown.
+
+    Args:
+        address: ``(host, port)``; port 0 picks a free one.
+        runner: Pipeline runner; ``run_backend`` by default.
+        max_concurrent / max_queue / queue_timeout: See ``AdmissionGate``.
+        quiet: Do not log every request to stderr.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, runner: Optional[Runner] = None, max_concurrent: Optional[int] = None,
+                 max_queue: Optional[int] = None, queue_timeout: Optional[float] = None, quiet: bool = False):
+        super().__init__(address, AgentRequestHandler)
+        self.runner = runner or run_backend
+        self.gate = AdmissionGate(
+            max_concurrent if max_concurrent is not None else env_int("SERVE_MAX_CONCURRENT", 4),
+            max_queue if max_queue is not None else env_int("SERVE_MAX_QUEUE", 16),
+            queue_timeout if queue_timeout is not None else env_int("SERVE_QUEUE_TIMEOUT_S", 30),
+        )
+        self.quiet = quiet
+        self.started_at = time.time()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self, drain_timeout: Optional[float] = None) -> bool:
+        """
+        Stops accepting requests and waits for in-flight ones; call from any thread but ``serve_forever``'s.
+
+        Returns:
+            True if every question finished within ``drain_timeout`` (``SERVE_DRAIN_TIMEOUT_S``).
+        """
+        drain_timeout = drain_timeout if drain_timeout is not None else env_int("SERVE_DRAIN_TIMEOUT_S", 30)
+        self.gate.close()
+        self.shutdown()
+        drained = self.gate.wait_idle(drain_timeout)
+        self.server_close()
+        return drained
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8000, runner: Optional[Runner] = None,
+                  **kwargs) -> AgentHTTPServer:
+    """Builds the server without starting it; ``serve_forever`` in a thread for tests."""
+    return AgentHTTPServer((host, port), runner=runner, **kwargs)
+
+
+def serve(host: Optional[str] = None, port: Optional[int] = None, backends=None, warm: bool = True):
+    """Runs the service until SIGINT/SIGTERM, then drains and closes the shared pools."""
+    load_config(verbose=True)
+    host = host or os.getenv("SERVE_HOST") or "127.0.0.1"
+    port = port if port is not None else env_int("SERVE_PORT", 8000)
+    server = create_server(host, port)
+    if warm:
+        for backend, seconds in warm_up(backends or list(BACKENDS)).items():
+            print(f"[serve] {backend}: {seconds if isinstance(seconds, str) else f'listo en {seconds:.2f}s'}")
+
+    stopper = {}
+
+    def request_stop(signum, frame):
+        # shutdown() espera a serve_forever: debe llamarse desde otro hilo
+        if "thread" in stopper:
+            return
+        print(f"[serve] señal {signum}: dejando de aceptar peticiones y esperando a las que están en curso...")
+        stopper["thread"] = threading.Thread(
+            target=lambda: stopper.__setitem__("drained", server.stop()), name="serve-stop", daemon=True,
+        )
+        stopper["thread"].start()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    print(f"[serve] escuchando en {server.url} (máx. {server.gate.max_concurrent} a la vez, "
+          f"{server.gate.max_queue} en cola)")
+    try:
+        server.serve_forever()
+    finally:
+        if "thread" in stopper:
+            stopper["thread"].join()
+            if not stopper.get("drained"):
+                print("[serve] tiempo de drenado agotado; se cierran los pools con consultas en curso")
+        else:
+            server.server_close()
+        shutdown_backends()
+        print("[serve] detenido")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP del agente de base de datos")
+    parser.add_argument("--host", type=str, default=None, help="Interfaz (SERVE_HOST, por defecto 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=None, help="Puerto (SERVE_PORT, por defecto 8000)")
+    parser.add_argument("--db", action="append", choices=list(BACKENDS),
+                        help="Backend a precargar (repetible; por defecto todos)")
+    parser.add_argument("--no-warmup", action="store_true", help="No precargar modelo ni esquemas al arrancar")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.db, warm=not args.no_warmup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+Virtualized chat history for the GUI.
+
+Creating one ``CTkFrame`` + ``CTkTextbox`` per message and measuring it with a
+synchronous ``update_idletasks()`` gets slow after a few hundred messages. It
+also keeps every bubble alive as a Tk widget. ``ChatView`` instead keeps the
+history in a compact model (``ChatMessage``: text, parsed markdown segments,
+measured height) and lays it out on a single canvas. Only the messages inside
+the visible window, plus some overscan, are drawn. Those bubbles come from a
+bounded pool (``GUI_CHAT_POOL_SIZE``) and are recycled as the user scrolls.
+
+A message is rendered into a bubble only when the bubble last showed something
+else. Heights are measured once per text (``count -update -ypixels``, no global
+update) and cached on the model. Offsets are prefix sums, recomputed only from
+the first message whose height changed.
+"""
+import bisect
+import re
+import sys
+import tkinter
+from typing import Dict, List, Optional, Tuple
+
+import customtkinter as ctk
+
+from src.utils.config import env_int
+
+USER = "user"
+AGENT = "agent"
+CODE = "code"
+SYSTEM = "system"
+ERROR = "error"
+
+# Separación vertical entre burbujas y margen interior del texto (px)
+ROW_GAP = 10
+BUBBLE_PAD_Y = 5
+BUBBLE_PAD_X = 10
+MIN_TEXT_HEIGHT = 30
+MAX_ESTIMATED_HEIGHT = 400
+
+_MARKDOWN_RE = re.compile(r'(```[\s\S]*?```|\*\*.*?\*\*|`[^`\n]+`|###\s.*?$|\*.*?\*)', re.MULTILINE)
+
+Segment = Tuple[str, Optional[str]]
+
+
+def parse_markdown(text: str) -> List[Segment]:
+    """
+    ``(text, tag)`` segments for the subset of markdown the agents produce.
+
+    Tags: ``code_block``, ``bold``, ``code_inline``, ``header``, ``italic``;
+    None for plain text.
+    """
+    segments: List[Segment] = []
+    for token in _MARKDOWN_RE.split(text.replace("\r\n", "\n")):
+        if not token:
+            continue
+        if token.startswith("```") and token.endswith("```") and len(token) >= 6:
+            content = token[3:-3]
+            if content.startswith("\n"):
+                content = content[1:]
+            # Primera línea corta sin espacios = lenguaje del bloque (```sql)
+            first_line_end = content.find("\n")
+            if first_line_end != -1 and first_line_end < 20:
+                language = content[:first_line_end].strip()
+                if language and " " not in language:
+                    content = content[first_line_end + 1:]
+            segments.append((f"\n{content}\n", "code_block"))
+        elif token.startswith("**") and token.endswith("**") and len(token) >= 4:
+            segments.append((token[2:-2], "bold"))
+        elif token.startswith("`") and token.endswith("`") and len(token) >= 2:
+            segments.append((f" {token[1:-1]} ", "code_inline"))
+        elif token.startswith("### "):
+            segments.append((token[4:] + "\n", "header"))
+        elif token.startswith("*") and token.endswith("*") and len(token) >= 2:
+            segments.append((token[1:-1], "italic"))
+        else:
+            segments.append((token, None))
+    return segments
+
+
+class ChatMessage:
+    """
+    One entry of the history; lives in the model whether or not it is on screen.
+
+    Args:
+        kind: ``user``, ``agent``, ``code``, ``system`` or ``error``.
+        text: Message text (markdown unless ``markdown`` is False).
+        markdown: Parse ``text`` as markdown; plain text is used while an answer streams in.
+    """
+
+    __slots__ = ("kind", "text", "markdown", "version", "height", "_segments")
+
+    def __init__(self, kind: str, text: str, markdown: bool = True):
+        self.kind = kind
+        self.text = text
+        self.markdown = markdown
+        self.version = 0
+        self.height: Optional[int] = None
+        self._segments: Optional[List[Segment]] = None
+
+    @property
+    def segments(self) -> List[Segment]:
+        if self._segments is None:
+            self._segments = parse_markdown(self.text) if self.markdown else [(self.text, None)]
+        return self._segments
+
+    def set_text(self, text: str, markdown: bool):
+        self.text = text
+        self.markdown = markdown
+        self.version += 1
+        self._segments = None
+
+    def append_text(self, chunk: str):
+        """Appends plain text; the cached height is kept as a lower bound until re-measured."""
+        self.text += chunk
+        self.version += 1
+        self._segments = None
+
+
+def estimate_height(text: str, chars_per_line: int, line_height: int = 20) -> int:
+    """Text height before it is measured: wrapped line count times line height, capped."""
+    lines = sum(max(1, -(-len(line) // chars_per_line)) for line in text.split("\n"))
+    return max(MIN_TEXT_HEIGHT, min(lines * line_height + 15, MAX_ESTIMATED_HEIGHT))
+
+
+class ChatLayout:
+    """
+    Vertical layout of the history: cumulative offsets and visible-window lookup.
+
+    Row height is ``ChatMessage.height`` (or an estimate) plus padding. Offsets are
+    recomputed lazily from the first message whose height changed.
+    """
+
+    def __init__(self, chars_per_line: Dict[str, int]):
+        self.messages: List[ChatMessage] = []
+        self._chars_per_line = chars_per_line
+        self._offsets: List[int] = [0]
+        self._dirty_from = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, message: ChatMessage) -> int:
+        self.messages.append(message)
+        self.invalidate(len(self.messages) - 1)
+        return len(self.messages) - 1
+
+    def invalidate(self, index: int):
+        self._dirty_from = min(self._dirty_from, index)
+
+    def text_height(self, message: ChatMessage) -> int:
+        if message.height is not None:
+            return message.height
+        return estimate_height(message.text, self._chars_per_line.get(message.kind, 60))
+
+    def row_height(self, message: ChatMessage) -> int:
+        return self.text_height(message) + 2 * BUBBLE_PAD_Y + ROW_GAP
+
+    def _update_offsets(self):
+        if self._dirty_from >= len(self.messages) and len(self._offsets) == len(self.messages) + 1:
+            return
+        start = min(self._dirty_from, len(self.messages))
+        del self._offsets[start + 1:]
+        for message in self.messages[start:]:
+            self._offsets.append(self._offsets[-1] + self.row_height(message))
+        self._dirty_from = len(self.messages)
+
+    def offset(self, index: int) -> int:
+        self._update_offsets()
+        return self._offsets[index]
+
+    @property
+    def total_height(self) -> int:
+        self._update_offsets()
+        return self._offsets[-1]
+
+    def visible_range(self, top: float, bottom: float) -> range:
+        """Indexes of the messages that intersect ``[top, bottom)`` in canvas pixels."""
+        self._update_offsets()
+        if not self.messages:
+            return range(0)
+        first = max(bisect.bisect_right(self._offsets, top) - 1, 0)
+        last = min(bisect.bisect_left(self._offsets, bottom), len(self.messages))
+        return range(first, max(last, first))
+
+
+class _Bubble:
+    """A pooled bubble: frame + textbox on the canvas, re-targeted to any message."""
+
+    def __init__(self, view: "ChatView"):
+        self.frame = ctk.CTkFrame(view.canvas, corner_radius=16)
+        self.textbox = ctk.CTkTextbox(self.frame, height=MIN_TEXT_HEIGHT, fg_color="transparent",
+                                      wrap="word", activate_scrollbars=False)
+        self.textbox.pack(padx=BUBBLE_PAD_X, pady=BUBBLE_PAD_Y)
+        # Tags una sola vez por burbuja, no en cada render
+        text = self.textbox._textbox
+        text.tag_config("bold", font=(view.font_main, 13, "bold"))
+        text.tag_config("italic", font=(view.font_main, 13, "italic"))
+        text.tag_config("header", font=(view.font_main, 16, "bold"))
+        text.tag_config("code_block", font=(view.font_mono, 12), background="#2b2b2b", foreground="#a5d6a7")
+        text.tag_config("code_inline", font=(view.font_mono, 12), background="#333333", foreground="#e0e0e0")
+        self.item = view.canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+        self.kind: Optional[str] = None
+        self.message: Optional[ChatMessage] = None
+        self.version = -1
+        # CTkTextbox.bind ya enlaza el tk.Text interior: no repetirlo
+        for widget in (self.frame, self.textbox):
+            view.bind_scroll(widget)
+
+    def style(self, kind: str, styles: dict):
+        if kind == self.kind:
+            return
+        style = styles[kind]
+        self.frame.configure(fg_color=style["bg"])
+        self.textbox.configure(width=style["width"], text_color=style["fg"], font=style["font"])
+        self.kind = kind
+
+    def render(self, message: ChatMessage, height: int):
+        textbox = self.textbox
+        textbox.configure(state="normal")
+        textbox.delete("1.0", "end")
+        for text, tag in message.segments:
+            if tag:
+                textbox.insert("end", text, tag)
+            else:
+                textbox.insert("end", text)
+        textbox.configure(height=height, state="disabled")
+        self.message = message
+        self.version = message.version
+
+    def append(self, message: ChatMessage, chunk: str):
+        self.textbox.configure(state="normal")
+        self.textbox.insert("end", chunk)
+        self.textbox.configure(state="disabled")
+        self.version = message.version
+
+    def measure(self) -> Optional[int]:
+        """Content height in pixels, or None if the textbox has no width yet."""
+        text = self.textbox._textbox
+        if text.winfo_width() <= 1:
+            return None
+        # -update calcula las líneas de este widget sin un update_idletasks global
+        result = text.count("1.0", "end", "update", "ypixels")
+        pixels = result[0] if isinstance(result, tuple) else result
+        return max(MIN_TEXT_HEIGHT, int(pixels or 0) + 15)
+
+
+class ChatView(ctk.CTkFrame):
+    """
+    Scrollable chat history that only materializes the visible messages.
+
+    Args:
+        master: Parent widget.
+        font_main: Font family for normal text.
+        font_mono: Font family for code.
+        pool_size: Maximum live bubbles (``GUI_CHAT_POOL_SIZE``).
+    """
+
+    def __init__(self, master, font_main: str = "Segoe UI", font_mono: str = "Consolas",
+                 pool_size: Optional[int] = None, **kwargs):
+        kwargs.setdefault("fg_color", "transparent")
+        super().__init__(master, **kwargs)
+        self.font_main = font_main
+        self.font_mono = font_mono
+        self.pool_size = max(pool_size if pool_size is not None else env_int("GUI_CHAT_POOL_SIZE", 40), 4)
+        self.styles = {
+            USER: {"bg": "#1f538d", "fg": "white", "side": "right", "padx": (50, 10),
+                   "font": (font_main, 13), "width": 400},
+            CODE: {"bg": "black", "fg": "#00ff00", "side": "left", "padx": (10, 50),
+                   "font": (font_mono, 13), "width": 500},
+            SYSTEM: {"bg": "transparent", "fg": "gray", "side": "center", "padx": (10, 10),
+                     "font": (font_main, 12, "italic"), "width": 600},
+            ERROR: {"bg": "#c62828", "fg": "white", "side": "left", "padx": (10, 50),
+                    "font": (font_main, 13), "width": 400},
+            AGENT: {"bg": ("#e0e0e0", "#3a3a3a"), "fg": ("black", "white"), "side": "left",
+                    "padx": (10, 50), "font": (font_main, 13), "width": 400},
+        }
+        # ~7 px por carácter con la fuente base: solo para estimar la altura antes de medir
+        self.layout = ChatLayout({kind: style["width"] // 7 for kind, style in self.styles.items()})
+
+        self.canvas = tkinter.Canvas(self, highlightthickness=0, borderwidth=0, yscrollincrement=20,
+                                     bg=self._canvas_color())
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        self._live: Dict[int, _Bubble] = {}
+        self._free: List[_Bubble] = []
+        self._bubbles = 0
+        self._refresh_scheduled = False
+        self._follow = True
+        self.canvas.bind("<Configure>", lambda event: self._schedule_refresh())
+        self.bind_scroll(self.canvas)
+
+    # --- API usada por la aplicación ---
+
+    def add(self, kind: str, text: str, markdown: bool = True) -> int:
+        """Appends a message and returns its handle."""
+        self._follow = self._at_bottom()
+        index = self.layout.append(ChatMessage(kind, text, markdown))
+        self._schedule_refresh()
+        return index
+
+    def append_text(self, handle: int, chunk: str):
+        """Streams ``chunk`` into a plain-text message (the answer while it is generated)."""
+        message = self.layout.messages[handle]
+        bubble = self._live.get(handle)
+        message.append_text(chunk)
+        if bubble is not None and bubble.message is message:
+            bubble.append(message, chunk)
+            self._schedule_measure(handle, bubble)
+        self._follow = self._follow or self._at_bottom()
+        self._schedule_refresh()
+
+    def set_text(self, handle: int, text: str, markdown: bool = True):
+        """Replaces a message's text, e.g. the final markdown render of a streamed answer."""
+        message = self.layout.messages[handle]
+        message.set_text(text, markdown)
+        message.height = None
+        self.layout.invalidate(handle)
+        self._schedule_refresh()
+
+    def scroll_to_end(self):
+        self._follow = True
+        self._schedule_refresh()
+
+    def stats(self) -> dict:
+        return {"messages": len(self.layout), "live_bubbles": len(self._live), "pooled_bubbles": self._bubbles}
+
+    # --- Scroll ---
+
+    def bind_scroll(self, widget):
+        widget.bind("<MouseWheel>", self._on_wheel, add="+")
+        widget.bind("<Button-4>", self._on_wheel, add="+")
+        widget.bind("<Button-5>", self._on_wheel, add="+")
+
+    def _on_wheel(self, event):
+        if sys.platform.startswith("win"):
+            steps = -int(event.delta / 120) or (-1 if event.delta > 0 else 1)
+        elif sys.platform == "darwin":
+            steps = -event.delta
+        else:
+            steps = -1 if event.num == 4 else 1
+        self.canvas.yview_scroll(steps, "units")
+        self._follow = self._at_bottom()
+        self._schedule_refresh()
+        return "break"
+
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self._follow = self._at_bottom()
+        self._schedule_refresh()
+
+    def _at_bottom(self) -> bool:
+        return self.canvas.yview()[1] >= 0.999
+
+    # --- Virtualización ---
+
+    def _schedule_refresh(self):
+        # Varias altas/tokens seguidos producen un único relayout
+        if not self._refresh_scheduled:
+            self._refresh_scheduled = True
+            self.after_idle(self._refresh)
+
+    def _refresh(self):
+        self._refresh_scheduled = False
+        width = max(self.canvas.winfo_width(), 1)
+        viewport = max(self.canvas.winfo_height(), 1)
+        total = self.layout.total_height
+        self.canvas.configure(scrollregion=(0, 0, width, max(total, viewport)))
+        if self._follow:
+            self.canvas.yview_moveto(1.0)
+        top = self.canvas.canvasy(0)
+        overscan = viewport // 2
+        visible = self.layout.visible_range(top - overscan, top + viewport + overscan)
+        wanted = list(visible)[:self.pool_size]
+
+        for index in [i for i in self._live if i not in wanted]:
+            bubble = self._live.pop(index)
+            self.canvas.itemconfigure(bubble.item, state="hidden")
+            self._free.append(bubble)
+
+        for index in wanted:
+            bubble = self._live.get(index) or self._acquire(self.layout.messages[index].kind)
+            if bubble is None:
+                break
+            self._live[index] = bubble
+            self._place(index, bubble, width)
+
+    def _acquire(self, kind: str) -> Optional[_Bubble]:
+        # Preferir una burbuja que ya tenga el estilo: reconfigurar colores y fuente es lo más caro
+        for position, bubble in enumerate(self._free):
+            if bubble.kind == kind:
+                return self._free.pop(position)
+        if self._bubbles < self.pool_size:
+            self._bubbles += 1
+            return _Bubble(self)
+        return self._free.pop() if self._free else None
+
+    def _place(self, index: int, bubble: _Bubble, width: int):
+        message = self.layout.messages[index]
+        style = self.styles[message.kind]
+        bubble.style(message.kind, self.styles)
+        if bubble.message is not message or bubble.version != message.version:
+            bubble.render(message, self.layout.text_height(message))
+            if message.height is None:
+                self._schedule_measure(index, bubble)
+        y = self.layout.offset(index) + ROW_GAP // 2
+        if style["side"] == "right":
+            x, anchor = width - style["padx"][1], "ne"
+        elif style["side"] == "center":
+            x, anchor = width // 2, "n"
+        else:
+            x, anchor = style["padx"][0], "nw"
+        self.canvas.coords(bubble.item, x, y)
+        self.canvas.itemconfigure(bubble.item, anchor=anchor, state="normal")
+
+    def _schedule_measure(self, index: int, bubble: _Bubble):
+        self.after_idle(lambda: self._measure(index, bubble))
+
+    def _measure(self, index: int, bubble: _Bubble, attempts: int = 5):
+        message = self.layout.messages[index]
+        if self._live.get(index) is not bubble or bubble.message is not message:
+            return  # la burbuja se recicló antes de medir; se medirá al volver a mostrarse
+        height = bubble.measure()
+        if height is None:
+            if attempts:
+                self.after(20, lambda: self._measure(index, bubble, attempts - 1))
+            return
+        if height != message.height:
+            message.height = height
+            bubble.textbox.configure(height=height)
+            self.layout.invalidate(index)
+            self._schedule_refresh()
+
+    # --- Apariencia ---
+
+    def _canvas_color(self) -> str:
+        color = self.cget("fg_color")
+        if color == "transparent":
+            color = self.cget("bg_color")
+        return self._apply_appearance_mode(color)
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        if hasattr(self, "canvas"):
+            self.canvas.configure(bg=self._canvas_color())
@@ -0,0 +1,211 @@
+"""
+Bounded background queue of GUI questions.
+
+The GUI used to disable its input until the current answer finished, and
+started an unmanaged thread per question. ``RequestQueue`` runs questions on a
+``ThreadPoolExecutor`` of ``GUI_MAX_CONCURRENT`` workers and accepts up to
+``GUI_MAX_PENDING`` more waiting in line. Each question is a ``QueryJob`` with
+its own state and timestamps, so the window can show a status line and an
+elapsed timer per question.
+
+Workers never touch Tk. They put ``(job, event)`` pairs in one thread-safe
+inbox and call ``notify`` only when the inbox goes from empty to non-empty.
+The UI then ``drain``s it in batches: consecutive answer tokens of the same
+job are merged into one event, and each batch is capped in size and time so a
+burst of results cannot freeze the event loop.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from src.agents.streaming import ANSWER_TOKEN, DONE
+from src.utils.config import env_int
+
+PENDING = "pending"
+RUNNING = "running"
+DONE_STATE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Eventos propios de la cola (además de los del pipeline de src.agents.streaming)
+JOB_STARTED = "job_started"
+JOB_FAILED = "job_failed"
+
+
+class QueueFullError(RuntimeError):
+    """Every worker is busy and the pending line is full."""
+
+
+class QueryJob:
+    """
+    One submitted question and its lifecycle.
+
+    ``stream`` is free for the UI (bubble handles, accumulated text); the queue
+    never reads it.
+    """
+
+    def __init__(self, job_id: int, query: str, backend: str):
+        self.id = job_id
+        self.query = query
+        self.backend = backend
+        self.state = PENDING
+        self.stage = "en cola"
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.future = None
+        self.stream: dict = {}
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE_STATE, FAILED, CANCELLED)
+
+    def waited(self, now: Optional[float] = None) -> float:
+        """Seconds in the pending line."""
+        end = self.started_at or (self.finished_at if self.finished else None) or now or time.monotonic()
+        return end - self.submitted_at
+
+    def elapsed(self, now: Optional[float] = None) -> float:
+        """Seconds since it started running (0 while pending)."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or now or time.monotonic()) - self.started_at
+
+
+class RequestQueue:
+    """
+    Thread pool plus bounded pending line for agent questions.
+
+    Args:
+        run: Called on a worker thread with the job; yields pipeline events
+            (``src.agents.streaming``) ending with ``DONE``.
+        notify: Called from a worker thread when the inbox stops being empty;
+            the UI schedules a ``drain`` from it (``after``).
+        max_workers: Questions running at once (``GUI_MAX_CONCURRENT``).
+        max_pending: Questions waiting for a worker (``GUI_MAX_PENDING``).
+    """
+
+    def __init__(self, run: Callable[[QueryJob], Iterable[dict]], notify: Callable[[], None],
+                 max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        self.max_workers = max(max_workers if max_workers is not None else env_int("GUI_MAX_CONCURRENT", 2), 1)
+        self.max_pending = max(max_pending if max_pending is not None else env_int("GUI_MAX_PENDING", 8), 0)
+        self._run = run
+        self._notify = notify
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="gui-query")
+        self._lock = threading.Lock()
+        self._inbox: deque = deque()
+        self._jobs: List[QueryJob] = []
+        self._ids = itertools.count(1)
+        self._closed = False
+
+    def submit(self, query: str, backend: str) -> QueryJob:
+        """
+        Queues a question; returns at once.
+
+        Raises:
+            QueueFullError: With ``max_workers + max_pending`` questions unfinished.
+        """
+        with self._lock:
+            if self._closed:
+                raise QueueFullError("La cola está cerrada")
+            active = [job for job in self._jobs if not job.finished]
+            if len(active) >= self.max_workers + self.max_pending:
+                raise QueueFullError(
+                    f"Hay {len(active)} consultas en curso o en cola (máximo {self.max_workers + self.max_pending})"
+                )
+            job = QueryJob(next(self._ids), query, backend)
+            self._jobs = active + [job]
+            job.future = self._executor.submit(self._work, job)
+        return job
+
+    def _work(self, job: QueryJob):
+        with self._lock:
+            if job.state == CANCELLED:
+                return
+            job.state = RUNNING
+            job.stage = "iniciando"
+            job.started_at = time.monotonic()
+        self._push(job, {"type": JOB_STARTED})
+        try:
+            for event in self._run(job):
+                if event["type"] == DONE:
+                    job.finished_at = time.monotonic()
+                    job.state = FAILED if event["result"].get("error") else DONE_STATE
+                    job.error = event["result"].get("error")
+                self._push(job, event)
+            if not job.finished:
+                raise RuntimeError("El agente terminó sin resultado")
+        except Exception as e:
+            job.finished_at = time.monotonic()
+            job.state = FAILED
+            job.error = str(e)
+            self._push(job, {"type": JOB_FAILED, "error": str(e)})
+
+    def _push(self, job: QueryJob, event: dict):
+        with self._lock:
+            wake = not self._inbox
+            self._inbox.append((job, event))
+        if wake:
+            self._notify()
+
+    def drain(self, max_events: int = 200, budget_seconds: float = 0.015) -> Tuple[List[tuple], bool]:
+        """
+        Takes a batch of ``(job, event)`` pairs from the inbox for the UI thread.
+
+        ``ANSWER_TOKEN`` events of the same job are merged into one, as long as
+        no other event of that job sits between them; the order of each job's
+        events is preserved.
+
+        Args:
+            max_events: Inbox entries consumed per call at most.
+            budget_seconds: Stop collecting after this much time.
+
+        Returns:
+            The batch and whether entries remain (the caller should drain again soon).
+        """
+        deadline = time.monotonic() + budget_seconds
+        batch: List[tuple] = []
+        # job.id -> posición en el lote de su último ANSWER_TOKEN todavía ampliable
+        open_tokens = {}
+        with self._lock:
+            taken = 0
+            while self._inbox and taken < max_events and time.monotonic() < deadline:
+                job, event = self._inbox.popleft()
+                taken += 1
+                if event["type"] != ANSWER_TOKEN:
+                    open_tokens.pop(job.id, None)
+                    batch.append((job, event))
+                elif job.id in open_tokens:
+                    position = open_tokens[job.id]
+                    previous = batch[position][1]
+                    batch[position] = (job, dict(previous, text=previous["text"] + event["text"]))
+                else:
+                    open_tokens[job.id] = len(batch)
+                    batch.append((job, event))
+            remaining = bool(self._inbox)
+        return batch, remaining
+
+    def active(self) -> List[QueryJob]:
+        """Unfinished jobs in submission order (running and pending)."""
+        with self._lock:
+            return [job for job in self._jobs if not job.finished]
+
+    def counts(self) -> dict:
+        jobs = self.active()
+        return {
+            "running": sum(1 for job in jobs if job.state == RUNNING),
+            "pending": sum(1 for job in jobs if job.state == PENDING),
+        }
+
+    def shutdown(self):
+        """Cancels pending jobs and returns at once; running jobs are left to finish."""
+        with self._lock:
+            self._closed = True
+            for job in self._jobs:
+                if job.state == PENDING and job.future is not None and job.future.cancel():
+                    job.state = CANCELLED
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,39 @@
+"""
+Helpers for reading optional tuning parameters from the environment.
+"""
+import os
+import threading
+from typing import Optional
+
+
+def env_int(name: str, default: int) -> int:
+    """Reads an integer from the environment, falling back to ``default``."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+_config_lock = threading.Lock()
+_config_loaded: Optional[bool] = None
+
+
+def load_config(verbose: bool = False) -> bool:
+    """
+    Loads ``.env`` into the environment the first time it is called; later calls do nothing.
+
+    Entry points (CLI, GUI, evaluation) and the agent modules all call it, so
+    the file is parsed exactly once per process, whichever of them runs first.
+
+    Returns:
+        True if the ``.env`` file was found and loaded.
+    """
+    global _config_loaded
+    with _config_lock:
+        if _config_loaded is None:
+            from src.utils.encoding_utils import safe_load_dotenv
+            _config_loaded = safe_load_dotenv(verbose=verbose)
+    return _config_loaded
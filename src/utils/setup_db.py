@@ -1,11 +1,16 @@
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import os
+import sys
 from dotenv import load_dotenv
 import random
 from datetime import datetime, timedelta
 import pymongo # Added for MongoDB
 
+# Ensure the root directory is in sys.path (se ejecuta como python src/utils/setup_db.py)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.agents.result_cache import NOTIFY_FUNCTION_SQL, notify_trigger_sql
+
 load_dotenv()
 
 # Configuration
@@ -88,6 +93,12 @@ def populate_postgres():
         cursor.execute(tables_sql)
         print("Postgres Schema created.")
 
+        # 2b. Triggers LISTEN/NOTIFY para invalidar la caché de resultados (DDL de src/agents/result_cache.py)
+        cursor.execute(NOTIFY_FUNCTION_SQL)
+        for table in ("users", "products", "orders"):
+            cursor.execute(notify_trigger_sql(table))
+        print("Postgres change-notification triggers created.")
+
         # 3. Seed Users (10 users)
         users = [
             ('alice', 'alice@example.com', 28, 'Madrid', 'Spain'),
@@ -0,0 +1,167 @@
+"""
+Startup timing: phases measured in-process plus an ``-X importtime`` breakdown.
+
+``StartupTimer`` records how long each startup phase takes (entry point
+imports, ``.env`` loading, each backend on first selection). ``main.py
+--startup-report`` prints it.
+
+``import_breakdown`` runs an import statement in a fresh interpreter with
+``python -X importtime`` and adds up the import time of each top-level
+package, so you can see which dependency a regression comes from. Usage:
+
+    python -m src.utils.startup                 # main, postgres and mongo
+    python -m src.utils.startup --max-ms 300    # exit 1 if importing main takes longer
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# Qué se importa para medir cada objetivo
+TARGETS = {
+    "main": "import main",
+    "gui": "import gui",
+    "postgres": "import src.agents.sql_agent",
+    "mongo": "import src.agents.mongo_agent",
+}
+
+# "import time:       self [us] |  cumulative | imported package"
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+class ImportRecord(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+class ImportBreakdown(NamedTuple):
+    statement: str
+    total_ms: float
+    packages: Dict[str, float]
+    records: List[ImportRecord]
+
+    def top(self, limit: int = 10) -> List[tuple]:
+        """``(package, ms)`` pairs, slowest first."""
+        return sorted(self.packages.items(), key=lambda item: -item[1])[:limit]
+
+
+class StartupTimer:
+    """
+    Wall-clock duration of each startup phase, in the order they ran.
+
+    Args:
+        started: ``time.perf_counter()`` at process start; defaults to now.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: List[tuple] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    def report(self) -> List[str]:
+        lines = [f"  {name:<24} {seconds * 1000:8.1f} ms" for name, seconds in self.phases]
+        lines.append(f"  {'total':<24} {(time.perf_counter() - self.started) * 1000:8.1f} ms")
+        return lines
+
+
+def parse_importtime(output: str) -> List[ImportRecord]:
+    """Parses the stderr of ``python -X importtime``; each nesting level is two spaces of indent."""
+    records = []
+    for line in output.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            records.append(ImportRecord(module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return records
+
+
+def summarize(statement: str, records: List[ImportRecord]) -> ImportBreakdown:
+    """
+    Milliseconds per top-level package: the self time of all its modules.
+
+    Self times are attributed to the package that owns each module, so
+    ``langchain_core`` shows up on its own even though ``src`` imported it.
+    The total is the cumulative time of the outermost imports.
+    """
+    packages: Dict[str, float] = {}
+    total_us = 0
+    for record in records:
+        if record.depth == 0:
+            total_us += record.cumulative_us
+        package = record.module.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + record.self_us / 1000
+    return ImportBreakdown(statement, total_us / 1000, packages, records)
+
+
+def import_breakdown(statement: str, cwd: str = ROOT, baseline: bool = True) -> ImportBreakdown:
+    """
+    Runs ``statement`` in a fresh interpreter with ``-X importtime``.
+
+    Args:
+        statement: Python code that performs the imports, e.g. ``"import main"``.
+        cwd: Working directory (the project root by default).
+        baseline: Leave out the modules the bare interpreter already imports at startup.
+
+    Raises:
+        RuntimeError: If the statement fails.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                          cwd=cwd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"'{statement}' falló:\n{proc.stderr[-2000:]}")
+    records = parse_importtime(proc.stderr)
+    if baseline:
+        empty = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"],
+                               cwd=cwd, env=env, capture_output=True, text=True)
+        preloaded = {record.module for record in parse_importtime(empty.stderr)}
+        records = [record for record in records if record.module not in preloaded]
+    return summarize(statement, records)
+
+
+def format_breakdown(name: str, breakdown: ImportBreakdown, limit: int = 10) -> List[str]:
+    lines = [f"{name} ({breakdown.statement}): {breakdown.total_ms:.1f} ms"]
+    lines += [f"  {package:<24} {ms:8.1f} ms" for package, ms in breakdown.top(limit)]
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Desglose del tiempo de importación (python -X importtime)")
+    parser.add_argument("targets", nargs="*", default=["main", "postgres", "mongo"],
+                        help=f"Objetivos a medir ({', '.join(TARGETS)}) o una sentencia import")
+    parser.add_argument("--top", type=int, default=10, help="Paquetes mostrados por objetivo")
+    parser.add_argument("--max-ms", type=float, default=0,
+                        help="Presupuesto para importar 'main'; se sale con código 1 si se supera (0 = sin límite)")
+    args = parser.parse_args(argv)
+
+    exit_code = 0
+    for target in args.targets:
+        breakdown = import_breakdown(TARGETS.get(target, target))
+        print("\n".join(format_breakdown(target, breakdown, args.top)))
+        print()
+        if target == "main" and args.max_ms and breakdown.total_ms > args.max_ms:
+            print(f"REGRESIÓN: importar main tarda {breakdown.total_ms:.1f} ms (máximo {args.max_ms:.0f} ms)")
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
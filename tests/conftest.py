@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# Los tests importan src.* desde la raíz del proyecto, como main.py y evaluation/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+class Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeLLM:
+    """
+    Chat model stub with the sync and async methods the agents use.
+
+    ``invoke`` answers with ``responses`` in order (the last one repeats) and
+    ``stream`` sends ``answer`` in word-sized chunks; every prompt is kept.
+    """
+
+    def __init__(self, responses=("```sql\nSELECT count(*) FROM orders\n```",), answer="Hay 3 pedidos."):
+        self.responses = list(responses)
+        self.answer = answer
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return Message(self.responses.pop(0) if len(self.responses) > 1 else self.responses[0])
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        for word in self.answer.split(" "):
+            yield Message(word + " ")
+
+    async def astream(self, prompt):
+        for chunk in self.stream(prompt):
+            yield chunk
+
+
+@pytest.fixture
+def fresh_caches(tmp_path, monkeypatch):
+    """Process-wide query, example and result caches under ``tmp_path``; call the fixture value to empty them again."""
+    from src.agents import example_store, query_cache, result_cache
+
+    resets = []
+
+    def reset():
+        resets.append(1)
+        monkeypatch.setenv("CACHE_DIR", str(tmp_path / f"cache{len(resets)}"))
+        monkeypatch.setattr(query_cache, "_cache", None)
+        monkeypatch.setattr(example_store, "_store", None)
+        monkeypatch.setattr(result_cache, "_cache", None)
+
+    reset()
+    return reset
+
+
+@pytest.fixture
+def sqlite_agent(tmp_path, monkeypatch, fresh_caches):
+    """
+    ``POSTGRES_URI`` pointing at a small SQLite shop database, with a ``FakeLLM`` in its context.
+
+    SQLite has no catalog fingerprint, EXPLAIN cost or fast path, so the SQL
+    agent runs its plain generate-execute-interpret pipeline.
+    """
+    import sqlalchemy
+    from src.agents import sql_context
+
+    path = tmp_path / "shop.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users(id), total_amount REAL);
+        INSERT INTO users VALUES (1, 'Ana'), (2, 'Luis');
+        INSERT INTO orders VALUES (1, 1, 10.5), (2, 1, 20.0), (3, 2, 7.25);
+    """)
+    conn.close()
+
+    uri = f"sqlite:///{path}"
+    monkeypatch.setenv("POSTGRES_URI", uri)
+    # SQLite no admite client_encoding en connect_args
+    monkeypatch.setattr(sql_context, "create_engine", lambda url, **kwargs: sqlalchemy.create_engine(
+        url, **{key: value for key, value in kwargs.items() if key != "connect_args"}))
+    llm = FakeLLM()
+    monkeypatch.setattr(sql_context, "get_llm", lambda: llm)
+    yield llm
+    sql_context.shutdown_sql_contexts()
@@ -0,0 +1,46 @@
+import subprocess
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+from src.agents import backends
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def test_selecting_a_backend_imports_only_its_stack():
+    # Proceso limpio: en este ya están importados los dos agentes
+    script = (
+        "import sys\n"
+        "from src.agents.backends import backend_load_times, load_backend\n"
+        "assert 'src.agents.sql_agent' not in sys.modules\n"
+        "load_backend('postgres')\n"
+        "print(sorted(backend_load_times()), 'pymongo' in sys.modules, 'src.agents.mongo_agent' in sys.modules)\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip().splitlines()[-1] == "['postgres'] False False"
+
+
+def test_preload_records_the_import_time(monkeypatch):
+    monkeypatch.setattr(backends, "_load_seconds", {})
+    backends.preload_backend("mongo").join(30)
+    assert set(backends.backend_load_times()) == {"mongo"}
+    assert backends.load_backend("mongo").__name__ == "stream_mongo_agent"
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="sqlite"):
+        backends.load_backend("sqlite")
+
+
+def test_shutdown_only_runs_hooks_of_imported_modules(monkeypatch):
+    calls = []
+    loaded = types.ModuleType("loaded_backend")
+    loaded.close = lambda: calls.append("loaded")
+    monkeypatch.setitem(sys.modules, "loaded_backend", loaded)
+    monkeypatch.setattr(backends, "SHUTDOWN_HOOKS", (("never_imported_backend", "close"), ("loaded_backend", "close")))
+
+    backends.shutdown_backends()
+    assert calls == ["loaded"] and "never_imported_backend" not in sys.modules
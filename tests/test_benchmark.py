@@ -0,0 +1,40 @@
+import pytest
+
+from evaluation.benchmark import StageTimer, compare_reports, percentile, summarize_samples
+
+
+def test_percentiles_interpolate_between_samples():
+    samples = [0.4, 0.1, 0.3, 0.2, 1.0]
+    assert percentile(samples, 50) == 0.3
+    assert percentile(samples, 95) == pytest.approx(0.88)
+    assert percentile([], 99) == 0.0
+    summary = summarize_samples(samples)
+    assert (summary["count"], summary["min"], summary["max"], summary["mean"]) == (5, 0.1, 1.0, 0.4)
+    assert summary["p99"] == pytest.approx(0.976)
+
+
+def test_failed_stage_is_still_timed():
+    timer = StageTimer()
+    with pytest.raises(RuntimeError):
+        with timer.stage("db_execution"):
+            raise RuntimeError("timeout")
+    assert len(timer.samples["db_execution"]) == 1
+
+
+def _report(**stages):
+    return {"backends": {"sql": {"stages": {
+        stage: summarize_samples(samples) for stage, samples in stages.items()
+    }}}}
+
+
+def test_compare_flags_only_real_regressions():
+    baseline = _report(generation_llm=[1.0, 1.0, 1.0], extraction=[0.001] * 3, schema_load=[0.1] * 3)
+    current = _report(generation_llm=[1.5, 1.5, 1.5], extraction=[0.002] * 3, schema_load=[0.105] * 3,
+                      total=[3.0] * 3)
+
+    rows, regressions = compare_reports(baseline, current, threshold_pct=10.0)
+
+    # extraction: +100 % pero por debajo del ruido; schema_load: +5 %; total: sin base
+    assert {(row[1], row[2]) for row in regressions} == {("generation_llm", "p50"), ("generation_llm", "p95")}
+    assert regressions[0][5] == 50.0
+    assert {row[1] for row in rows} == {"generation_llm", "extraction", "schema_load"}
@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("customtkinter")
+
+from src.ui.chat_view import (  # noqa: E402
+    AGENT, BUBBLE_PAD_Y, MAX_ESTIMATED_HEIGHT, ROW_GAP, USER, ChatLayout, ChatMessage, estimate_height, parse_markdown,
+)
+
+ROW_PADDING = 2 * BUBBLE_PAD_Y + ROW_GAP
+
+
+class CountingLayout(ChatLayout):
+    def __init__(self):
+        super().__init__({USER: 40, AGENT: 60})
+        self.computed = []
+
+    def row_height(self, message):
+        self.computed.append(message.text)
+        return super().row_height(message)
+
+
+def _layout(count, height=50):
+    layout = CountingLayout()
+    for i in range(count):
+        message = ChatMessage(AGENT, f"m{i}")
+        message.height = height
+        layout.append(message)
+    return layout
+
+
+def test_parse_markdown_segments():
+    assert parse_markdown("Total: **3** pedidos en `orders`\n```sql\nSELECT 1\n```") == [
+        ("Total: ", None), ("3", "bold"), (" pedidos en ", None), (" orders ", "code_inline"),
+        ("\n", None), ("\nSELECT 1\n\n", "code_block"),
+    ]
+
+
+def test_offsets_are_recomputed_from_the_first_changed_row():
+    layout = _layout(1000)
+    assert layout.total_height == 1000 * (50 + ROW_PADDING)
+    assert len(layout.computed) == 1000
+
+    layout.computed.clear()
+    layout.messages[990].height = 80
+    layout.invalidate(990)
+    assert layout.offset(991) == 991 * (50 + ROW_PADDING) + 30
+    assert layout.computed == [f"m{i}" for i in range(990, 1000)]
+
+    layout.computed.clear()
+    layout.append(ChatMessage(USER, "nueva"))
+    assert layout.total_height == layout.offset(1000) + layout.row_height(layout.messages[1000])
+    assert layout.computed[0] == "nueva" and len(layout) == 1001
+
+
+def test_visible_range_covers_only_the_window():
+    layout = _layout(100)
+    row = 50 + ROW_PADDING
+    assert layout.visible_range(0, 1) == range(0, 1)
+    assert layout.visible_range(10 * row + 5, 12 * row) == range(10, 12)
+    assert layout.visible_range(99 * row, 200 * row) == range(99, 100)
+    assert CountingLayout().visible_range(0, 500) == range(0)
+
+
+def test_unmeasured_messages_use_a_capped_estimate():
+    assert estimate_height("a" * 120, chars_per_line=60) == 2 * 20 + 15
+    assert estimate_height("x\n" * 500, chars_per_line=60) == MAX_ESTIMATED_HEIGHT
+    layout = ChatLayout({USER: 40})
+    assert layout.text_height(ChatMessage(USER, "a" * 80)) == estimate_height("a" * 80, 40)
+
+
+def test_message_caches_segments_until_the_text_changes():
+    message = ChatMessage(AGENT, "**Hola**")
+    segments = message.segments
+    assert message.segments is segments
+    message.append_text(" mundo")
+    assert message.version == 1 and message.segments == [("Hola", "bold"), (" mundo", None)]
+    message.set_text("*streaming*", markdown=False)
+    assert message.version == 2 and message.segments == [("*streaming*", None)]
@@ -0,0 +1,30 @@
+from evaluation.evaluate import matches_expected, result_cells
+
+
+def _result(*raw_results):
+    return {"raw_results": list(raw_results)}
+
+
+def test_result_cells_reads_sql_rows_and_mongo_json():
+    assert result_cells("[(Decimal('285.67'),)]") == [285.67]
+    assert result_cells("[('Laptop Pro', 1299.99, datetime.date(2024, 1, 5))]") == [
+        "Laptop Pro", 1299.99, "datetime.date(2024, 1, 5)"]
+    assert result_cells('[{"name": "Bob Jones", "address": {"city": "Madrid"}}]') == ["Bob Jones", "Madrid"]
+    assert result_cells("15") == [15]
+    assert result_cells("Error: timeout") == []
+
+
+def test_numbers_must_be_the_aggregate_value():
+    assert matches_expected(_result("[(10,)]"), [10])
+    assert matches_expected(_result("[(Decimal('285.6667'),)]"), [285.67])
+    assert matches_expected(_result('[{"_id": null, "total": 15}]'), [15])
+    # El 10 aparece, pero en otra fila y columna: no es el resultado
+    assert not matches_expected(_result("[(1, 'a', 10), (2, 'b', 7)]"), [10])
+    assert not matches_expected(_result("[(110,)]"), [10])
+
+
+def test_texts_must_be_whole_cells():
+    raw = "[('Laptop Pro',), ('4K Monitor',)]"
+    assert matches_expected(_result(raw), ["Laptop Pro", "4K Monitor"])
+    assert not matches_expected(_result(raw), ["Laptop"])
+    assert not matches_expected(_result("Error: Laptop Pro"), ["Laptop Pro"])
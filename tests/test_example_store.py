@@ -0,0 +1,31 @@
+from src.agents.example_store import SOURCE_EVALUATION, SOURCE_UNVERIFIED, ExampleStore
+
+
+def test_unverified_examples_are_never_retrieved(tmp_path):
+    store = ExampleStore(tmp_path / "examples.sqlite3", dim=256)
+    store.add("postgres", "¿Cuántos usuarios hay?", "SELECT count(*) FROM users", SOURCE_EVALUATION)
+    store.add("postgres", "¿Cuántos pedidos hay?", "SELECT 42", SOURCE_UNVERIFIED)
+
+    assert [ex.query for ex in store.search("postgres", "¿Cuántos pedidos hay?", min_similarity=0)] == [
+        "SELECT count(*) FROM users"
+    ]
+    store.close()
+
+    reloaded = ExampleStore(tmp_path / "examples.sqlite3", dim=256)
+    assert reloaded.size("postgres") == 1
+
+
+def test_unverified_result_demotes_an_existing_example():
+    store = ExampleStore(dim=256)
+    store.add("mongo", "¿Cuántos pedidos hay?", '{"collection": "orders"}')
+    store.add("mongo", "¿Cuántos pedidos hay?", '{"collection": "users"}', SOURCE_UNVERIFIED)
+    assert store.search("mongo", "¿Cuántos pedidos hay?", min_similarity=0) == []
+
+
+def test_runtime_recording_can_be_disabled():
+    store = ExampleStore(dim=256)
+    store.record_runtime = False
+    store.add("postgres", "¿Cuántos usuarios hay?", "SELECT count(*) FROM users")
+    assert store.size("postgres") == 0
+    store.add("postgres", "¿Cuántos usuarios hay?", "SELECT count(*) FROM users", SOURCE_EVALUATION)
+    assert store.size("postgres") == 1
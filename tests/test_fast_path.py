@@ -0,0 +1,62 @@
+import pytest
+
+from src.agents.fast_path import (
+    COUNT, NUMBER, SUM, TEXT, FastPathMatcher, answers_question, format_answer, to_mongo_spec, to_sql,
+)
+
+KINDS = {
+    "orders": {"id": NUMBER, "user_id": NUMBER, "status": TEXT, "total_amount": NUMBER},
+    "users": {"id": NUMBER, "name": TEXT, "city": TEXT},
+}
+
+
+@pytest.fixture
+def matcher():
+    return FastPathMatcher(KINDS)
+
+
+def test_unfiltered_aggregates(matcher):
+    count = matcher.match("¿Cuántos pedidos hay en total?")
+    assert (count.intent, count.table, count.filters) == (COUNT, "orders", ())
+    total = matcher.match("¿Cuál es el importe total de todos los pedidos?")
+    assert (total.intent, total.column) == (SUM, "total_amount")
+    assert to_sql(total) == "SELECT SUM(total_amount) AS value FROM orders"
+
+
+def test_filter_value_is_taken_literally(matcher):
+    match = matcher.match("¿Cuántos pedidos con estado 'Shipped' hay?")
+    assert match.filters == (("status", "Shipped"),)
+    assert to_sql(match) == "SELECT COUNT(*) AS value FROM orders WHERE CAST(status AS TEXT) ILIKE 'Shipped'"
+    assert to_mongo_spec(match)["filter"] == {"status": {"$regex": "^Shipped$", "$options": "i"}}
+
+
+def test_filter_value_wildcards_are_escaped(matcher):
+    match = matcher.match("¿Cuántos usuarios cuya ciudad es '100%_x'?")
+    assert to_sql(match).endswith("ILIKE '100\\%\\_x'")
+
+
+@pytest.mark.parametrize("question", [
+    "¿Cuántos pedidos hay por estado?",
+    "¿Cuántos pedidos y usuarios hay?",
+    "¿Cuántos pedidos hay desde enero?",
+    "¿Cuántos pedidos no enviados hay?",
+])
+def test_questions_needing_the_llm_do_not_match(matcher, question):
+    assert matcher.match(question) is None
+
+
+def test_empty_filtered_result_is_not_an_answer(matcher):
+    # "enviado" no es el valor guardado ('Shipped'): 0 filas no significa 0 pedidos enviados
+    filtered = matcher.match("¿Cuántos pedidos con estado 'enviado' hay?")
+    assert not answers_question(filtered, 0)
+    assert not answers_question(filtered, None)
+    assert answers_question(filtered, 3)
+
+    average = matcher.match("¿Cuál es el importe medio de los pedidos con estado 'enviado'?")
+    assert not answers_question(average, None)
+
+
+def test_unfiltered_zero_is_an_answer(matcher):
+    match = matcher.match("¿Cuántos pedidos hay en total?")
+    assert answers_question(match, 0)
+    assert format_answer(match, 0) == "Hay 0 pedidos (orders)."
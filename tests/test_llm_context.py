@@ -0,0 +1,91 @@
+import datetime
+import threading
+from types import SimpleNamespace
+
+from src.agents.llm_context import COLD, ERROR, READY, ModelManager, parse_keep_alive
+
+
+class FakeOllama:
+    """``ollama.Client`` stub: ``generate`` fails while ``fail`` is set; ``ps`` lists ``loaded``."""
+
+    def __init__(self, loaded=()):
+        self.loaded = list(loaded)
+        self.calls = []
+        self.fail = False
+        self.refreshed = threading.Event()
+
+    def generate(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.fail:
+            raise ConnectionError("Ollama no responde")
+        if len(self.calls) >= 2:
+            self.refreshed.set()
+
+    def ps(self):
+        return {"models": self.loaded}
+
+
+def _manager(client, **kwargs):
+    manager = ModelManager(model="llama3", keep_alive="10m", **kwargs)
+    manager._client = client
+    manager._llm = object()  # sin importar langchain_ollama
+    return manager
+
+
+def test_keep_alive_accepts_seconds_or_durations():
+    assert parse_keep_alive(None) == "30m"
+    assert parse_keep_alive(" 300 ") == 300
+    assert parse_keep_alive("-1") == -1
+    assert parse_keep_alive("1h") == "1h"
+
+
+def test_load_sends_the_agent_context_size_and_tracks_state():
+    client = FakeOllama()
+    manager = _manager(client, num_ctx=4096)
+    assert manager.state == COLD
+
+    client.fail = True
+    assert not manager.load()
+    assert (manager.state, manager.error) == (ERROR, "Ollama no responde")
+
+    client.fail = False
+    assert manager.load()
+    assert client.calls[-1] == {"model": "llama3", "prompt": "", "keep_alive": "10m", "options": {"num_ctx": 4096}}
+    assert manager.state == READY and manager.error is None
+    first_load = manager.warm_up_seconds
+    assert manager.load()
+    # Un refresco no cuenta como carga
+    assert manager.warm_up_seconds == first_load
+
+
+def test_warm_up_runs_once_and_refreshes_until_shutdown():
+    client = FakeOllama()
+    manager = _manager(client, refresh_seconds=0.01)
+    thread = manager.warm_up()
+    assert manager.warm_up() is thread
+    assert client.refreshed.wait(5)
+    manager.shutdown()
+    thread.join(5)
+    assert not thread.is_alive() and manager.state == READY
+
+
+def test_status_reports_residency():
+    expires = datetime.datetime(2026, 1, 1, 12, 0)
+    client = FakeOllama(loaded=[
+        {"model": "mistral:latest"},
+        SimpleNamespace(model="llama3:latest", expires_at=expires, size_vram=5_000_000_000, context_length=4096),
+    ])
+    manager = _manager(client, refresh_seconds=0)
+    status = manager.status()
+    assert status["state"] == COLD and status["num_ctx"] is None
+    assert (status["resident"], status["expires_at"], status["context_length"]) == (True, expires.isoformat(), 4096)
+
+    client.loaded = []
+    assert manager.status()["resident"] is False
+
+    def unreachable():
+        raise ConnectionError("Ollama no responde")
+
+    client.ps = unreachable
+    assert manager.status()["resident"] is None
+    assert "resident" not in manager.status(check_resident=False)
@@ -0,0 +1,71 @@
+import threading
+
+import mongomock
+
+from src.agents import mongo_schema
+from src.agents.mongo_schema import MongoSchemaInferrer
+
+
+def _db():
+    db = mongomock.MongoClient()["shop"]
+    # Colección heterogénea: cada muestra ve campos distintos
+    db.events.insert_many([{"kind": f"k{i}", f"extra_{i}": i} for i in range(50)])
+    db.users.insert_one({"name": "Ana"})
+    return db
+
+
+def test_fingerprint_ignores_which_documents_were_sampled():
+    db = _db()
+    inferrer = MongoSchemaInferrer(db, sample_size=3, ttl=300)
+    first = inferrer.snapshot()
+    fields = set(first.schema["events"]["fields"])
+    for _ in range(5):
+        inferrer.invalidate()
+        snapshot = inferrer.snapshot()
+        fields |= set(snapshot.schema["events"]["fields"])
+        assert snapshot.fingerprint == first.fingerprint
+    assert len(fields) > 4
+
+    db.users.create_index("name", unique=True)
+    inferrer.invalidate("users")
+    assert inferrer.snapshot().fingerprint != first.fingerprint
+
+    db.create_collection("orders")
+    assert inferrer.snapshot().fingerprint != first.fingerprint
+
+
+def test_snapshot_is_one_refresh_and_is_cached():
+    inferrer = MongoSchemaInferrer(_db(), ttl=300)
+    text, schema, fingerprint = inferrer.snapshot()
+    assert set(schema) == {"events", "users"}
+    assert "users (~1 docs, muestra 1):" in text
+    assert inferrer.snapshot() == (text, schema, fingerprint)
+    assert inferrer.stats()["hits"] == 1 and inferrer.stats()["misses"] == 1
+
+
+def test_sampling_does_not_hold_the_cache_lock(monkeypatch):
+    release, sampling, calls = threading.Event(), threading.Event(), []
+    infer = mongo_schema.infer_collection_schema
+
+    def slow_infer(collection, sample_size, max_time_ms):
+        calls.append(collection.name)
+        sampling.set()
+        release.wait(5)
+        return infer(collection, sample_size, max_time_ms)
+
+    monkeypatch.setattr(mongo_schema, "infer_collection_schema", slow_infer)
+    inferrer = MongoSchemaInferrer(_db(), workers=1, ttl=300)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(inferrer.snapshot())) for _ in range(2)]
+    threads[0].start()
+    assert sampling.wait(2)
+    threads[1].start()
+
+    # Estadísticas e invalidación no esperan al muestreo
+    assert inferrer.stats()["collections"] == 0
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results[0] == results[1]
+    assert sorted(calls) == ["events", "users"]
@@ -0,0 +1,97 @@
+import pytest
+
+from src.agents.mongo_spec import (
+    SpecError, execute_spec, load_spec, max_docs, spec_collections, spec_text, validate_spec,
+)
+
+COLLECTIONS = ["orders", "users"]
+
+
+def test_find_spec_gets_projection_and_capped_limit(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_DOCS", "50")
+    spec = validate_spec({"collection": "orders", "filter": {"status": "pending"}, "limit": 500}, COLLECTIONS)
+    assert spec["projection"] == {"_id": 0}
+    # Por encima del tope: se ejecuta con MONGO_MAX_DOCS
+    assert "limit" not in spec
+
+
+@pytest.mark.parametrize("operator", ["$where", "$function", "$out", "$merge"])
+def test_forbidden_operators_are_rejected(operator):
+    stage = {"$match": {operator: "x"}} if operator in ("$where", "$function") else {operator: "copy"}
+    with pytest.raises(SpecError):
+        validate_spec({"collection": "orders", "operation": "aggregate", "pipeline": [stage]}, COLLECTIONS)
+
+
+def test_unknown_collection_is_rejected():
+    with pytest.raises(SpecError):
+        validate_spec({"collection": "secrets"}, COLLECTIONS)
+
+
+@pytest.mark.parametrize("stage", [
+    {"$lookup": {"from": "secrets", "localField": "a", "foreignField": "b", "as": "s"}},
+    {"$unionWith": "secrets"},
+    {"$unionWith": {"coll": "users", "pipeline": [{"$lookup": {"from": "secrets", "pipeline": [], "as": "s"}}]}},
+    {"$facet": {"x": [{"$graphLookup": {"from": "secrets", "startWith": "$a", "connectFromField": "a",
+                                        "connectToField": "b", "as": "g"}}]}},
+])
+def test_lookup_sources_must_be_known_collections(stage):
+    with pytest.raises(SpecError, match="secrets"):
+        validate_spec({"collection": "orders", "operation": "aggregate", "pipeline": [stage]}, COLLECTIONS)
+
+
+def test_lookup_into_known_collection_is_allowed():
+    spec = validate_spec({"collection": "orders", "operation": "aggregate", "pipeline": [
+        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "_id", "as": "user"}},
+    ]}, COLLECTIONS)
+    assert spec_collections(spec) == ("orders", "users")
+
+
+def test_aggregate_limit_is_enforced_and_capped(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_DOCS", "20")
+    unbounded = validate_spec({"collection": "orders", "operation": "aggregate",
+                               "pipeline": [{"$match": {"status": "pending"}}]}, COLLECTIONS)
+    assert "limit" not in unbounded
+    assert unbounded["pipeline"] == [{"$match": {"status": "pending"}}, {"$project": {"_id": 0}}]
+
+    too_big = validate_spec({"collection": "orders", "operation": "aggregate",
+                             "pipeline": [{"$sort": {"total_amount": -1}}, {"$limit": 5000}]}, COLLECTIONS)
+    assert "limit" not in too_big
+    top5 = validate_spec({"collection": "orders", "operation": "aggregate",
+                          "pipeline": [{"$group": {"_id": "$status", "n": {"$sum": 1}}}, {"$limit": 5}]}, COLLECTIONS)
+    assert top5["limit"] == 5
+    assert top5["pipeline"] == [{"$group": {"_id": "$status", "n": {"$sum": 1}}}]
+
+
+def test_normalized_spec_round_trips_through_text():
+    spec = validate_spec({"collection": "orders", "operation": "aggregate",
+                          "pipeline": [{"$match": {"status": "pending"}}, {"$limit": 3}]}, COLLECTIONS)
+    assert load_spec(spec_text(spec), COLLECTIONS) == spec
+
+
+def test_aggregate_execution_respects_the_cap(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.setenv("MONGO_MAX_DOCS", "3")
+    db = mongomock.MongoClient()["test"]
+    db.orders.insert_many([{"n": i} for i in range(10)])
+    spec = validate_spec({"collection": "orders", "operation": "aggregate",
+                          "pipeline": [{"$sort": {"n": 1}}]}, COLLECTIONS)
+    docs, more_rows = execute_spec(db, spec)
+    assert docs == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert more_rows and max_docs() == 3
+
+
+@pytest.mark.parametrize("spec", [
+    {"collection": "orders", "sort": {"n": 1}, "limit": 3},
+    {"collection": "orders", "operation": "aggregate", "pipeline": [{"$sort": {"n": 1}}, {"$limit": 3}]},
+])
+def test_limit_equal_to_the_cap_does_not_report_more_rows(monkeypatch, spec):
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.setenv("MONGO_MAX_DOCS", "3")
+    db = mongomock.MongoClient()["test"]
+    db.orders.insert_many([{"n": i} for i in range(10)])
+    docs, more_rows = execute_spec(db, validate_spec(spec, COLLECTIONS))
+    assert docs == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert not more_rows
+
+    spec = dict(spec, limit=4) if "limit" in spec else dict(spec, pipeline=[{"$sort": {"n": 1}}, {"$limit": 4}])
+    assert execute_spec(db, validate_spec(spec, COLLECTIONS)) == (docs, True)
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.agents import sql_agent
+from src.agents.pipeline import Io, Stream, arun_steps, run_steps
+from src.agents.sql_context import get_sql_context
+from src.agents.streaming import ANSWER_TOKEN, DONE, event
+
+
+def _fail():
+    raise ValueError("sin conexión")
+
+
+def _steps(log):
+    try:
+        total = yield Io(lambda: 1 + 2, None)
+        yield event("total", value=total)
+        try:
+            yield Io(_fail)
+        except ValueError as e:
+            yield event("recovered", message=str(e))
+        tokens = yield Stream(lambda: iter(["Hay ", "3"]), _atokens, lambda text: event(ANSWER_TOKEN, text=text))
+        yield event(DONE, result={"answer": "".join(tokens)})
+    finally:
+        log.append("closed")
+
+
+async def _atokens():
+    for text in ("Hay ", "3"):
+        yield text
+
+
+EXPECTED = [
+    {"type": "total", "value": 3},
+    {"type": "recovered", "message": "sin conexión"},
+    {"type": ANSWER_TOKEN, "text": "Hay "},
+    {"type": ANSWER_TOKEN, "text": "3"},
+    {"type": DONE, "result": {"answer": "Hay 3"}},
+]
+
+
+def test_sync_driver_sends_results_and_raises_errors_at_the_step():
+    log = []
+    assert list(run_steps(_steps(log))) == EXPECTED
+    assert log == ["closed"]
+
+
+def test_async_driver_runs_the_same_steps():
+    log = []
+
+    async def main():
+        return [ev async for ev in arun_steps(_steps(log))]
+
+    assert asyncio.run(main()) == EXPECTED
+    assert log == ["closed"]
+
+
+def test_async_driver_prefers_acall_and_falls_back_to_a_thread():
+    threads = []
+
+    async def acall():
+        return "async"
+
+    def steps():
+        yield event("a", value=(yield Io(lambda: "sync", acall)))
+        yield event("b", value=(yield Io(lambda: threads.append(threading.get_ident()) or "thread")))
+
+    async def main():
+        return [ev async for ev in arun_steps(steps())]
+
+    assert [ev["value"] for ev in asyncio.run(main())] == ["async", "thread"]
+    assert threads and threads[0] != threading.get_ident()
+
+
+def test_closing_the_driver_closes_the_steps():
+    log = []
+    events = run_steps(_steps(log))
+    next(events)
+    events.close()
+    assert log == ["closed"]
+
+
+@pytest.fixture
+def async_sqlite(sqlite_agent, monkeypatch):
+    """The SQLite context with its async methods served by the sync ones (no asyncpg for SQLite)."""
+    import os
+
+    ctx = get_sql_context(os.environ["POSTGRES_URI"])
+    for name in ("get_schema_context", "check_cost", "run"):
+        sync = getattr(ctx, name)
+
+        async def call(*args, _sync=sync):
+            return _sync(*args)
+
+        monkeypatch.setattr(ctx, "a" + name, call)
+    return sqlite_agent
+
+
+def test_sql_agent_sync_and_async_share_the_pipeline(async_sqlite, fresh_caches):
+    question = "¿Cuántos pedidos hay?"
+    sync_events = list(sql_agent.stream_sql_agent(question))
+
+    fresh_caches()
+
+    async def main():
+        return [ev async for ev in sql_agent.astream_sql_agent(question)]
+
+    async_events = asyncio.run(main())
+
+    assert [ev["type"] for ev in async_events] == [ev["type"] for ev in sync_events]
+    sync_result, async_result = sync_events[-1]["result"], async_events[-1]["result"]
+    assert sync_result["error"] is None
+    assert sync_result["answer"] == async_result["answer"] == "Hay 3 pedidos. "
+    assert sync_result["sql_queries"] == async_result["sql_queries"] == ["SELECT count(*) FROM orders"]
+    assert sync_result["raw_results"] == async_result["raw_results"]
+    assert "3" in sync_result["raw_results"][0]
+    assert ([span["name"] for span in async_result["trace"]["spans"]]
+            == [span["name"] for span in sync_result["trace"]["spans"]])
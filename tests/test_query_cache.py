@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from src.agents import query_cache
+from src.agents.query_cache import QueryCache
+
+SQL = "SELECT u.name FROM users u JOIN orders o ON o.user_id = u.id GROUP BY u.name"
+QUESTION = "Nombres de los usuarios que han hecho pedidos en la tienda online este año"
+
+
+def test_rephrased_question_reuses_the_query():
+    cache = QueryCache(threshold=80)
+    cache.store("postgres", "fp", QUESTION, SQL)
+    hit = cache.lookup("postgres", "fp", "¿Nombres de usuarios que han hecho pedidos en la tienda online este año?")
+    assert hit is not None and hit.query == SQL
+    assert cache.lookup("postgres", "other", QUESTION) is None
+
+
+@pytest.mark.parametrize("question", [
+    "Nombres de los usuarios que no han hecho pedidos en la tienda online este año",
+    "Nombres de los usuarios que han hecho más pedidos en la tienda online este año",
+    "Nombres de los usuarios que han hecho menos pedidos en la tienda online este año",
+])
+def test_negation_or_comparison_needs_a_new_query(question):
+    cache = QueryCache(threshold=80)
+    cache.store("postgres", "fp", QUESTION, SQL)
+    assert cache.lookup("postgres", "fp", question) is None
+
+
+def test_mayor_and_menor_are_not_interchangeable():
+    cache = QueryCache(threshold=80)
+    cache.store("postgres", "fp", "Cliente con el pedido de importe mayor registrado en la tienda online",
+                "SELECT user_id FROM orders ORDER BY total_amount DESC LIMIT 1")
+    assert cache.lookup("postgres", "fp", "Cliente con el pedido de importe menor registrado en la tienda online") is None
+
+
+def test_hits_do_not_commit_until_flushed(tmp_path, monkeypatch):
+    path = tmp_path / "query_cache.sqlite3"
+    cache = QueryCache(path)
+    cache.store("postgres", "fp", QUESTION, SQL)
+    commits = []
+    conn = cache._conn
+    monkeypatch.setattr(cache, "_conn", _CountingConnection(conn, commits))
+
+    for _ in range(query_cache.TOUCH_FLUSH_EVERY - 1):
+        assert cache.lookup("postgres", "fp", QUESTION) is not None
+    assert commits == []
+    assert cache.lookup("postgres", "fp", QUESTION) is not None
+    assert commits == [1]
+
+    cache.lookup("postgres", "fp", QUESTION)
+    cache.close()
+    (last_used,) = sqlite3.connect(path).execute("SELECT last_used FROM query_cache").fetchone()
+    assert last_used > 0 and commits == [1, 1]
+
+
+class _CountingConnection:
+    def __init__(self, conn, commits):
+        self._conn, self._commits = conn, commits
+
+    def commit(self):
+        self._commits.append(1)
+        self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+from src.agents.streaming import ANSWER_TOKEN, DONE, QUERY_GENERATED
+from src.ui.request_queue import (
+    CANCELLED, DONE_STATE, FAILED, JOB_FAILED, JOB_STARTED, PENDING, QueryJob, QueueFullError, RequestQueue,
+)
+
+
+def _token(text):
+    return {"type": ANSWER_TOKEN, "text": text}
+
+
+def _done(error=None):
+    return {"type": DONE, "result": {"answer": "", "error": error}}
+
+
+def _blocking_run(release, started=None):
+    def run(job):
+        if started is not None:
+            started.set()
+        release.wait(5)
+        yield _done()
+    return run
+
+
+def test_drain_merges_consecutive_tokens_of_each_job():
+    wakes = []
+    queue = RequestQueue(lambda job: iter(()), lambda: wakes.append(1), max_workers=1)
+    first, second = QueryJob(1, "a", "postgres"), QueryJob(2, "b", "mongo")
+    for job, event in [(first, _token("Hay ")), (second, _token("Son ")), (first, _token("3 ")),
+                       (second, {"type": QUERY_GENERATED, "query": "{}"}), (second, _token("5")),
+                       (first, _token("pedidos."))]:
+        queue._push(job, event)
+
+    batch, remaining = queue.drain(budget_seconds=1)
+    assert [(job.id, event.get("text", event["type"])) for job, event in batch] == [
+        (1, "Hay 3 pedidos."), (2, "Son "), (2, QUERY_GENERATED), (2, "5"),
+    ]
+    assert not remaining
+    # Solo se avisa a la UI cuando la bandeja pasa de vacía a no vacía
+    assert len(wakes) == 1
+    queue.shutdown()
+
+
+def test_drain_is_capped_per_batch():
+    queue = RequestQueue(lambda job: iter(()), lambda: None, max_workers=1)
+    job = QueryJob(1, "a", "postgres")
+    for _ in range(5):
+        queue._push(job, {"type": QUERY_GENERATED, "query": "SELECT 1"})
+    batch, remaining = queue.drain(max_events=3, budget_seconds=1)
+    assert len(batch) == 3 and remaining
+    assert len(queue.drain(budget_seconds=1)[0]) == 2
+    queue.shutdown()
+
+
+def test_submit_is_bounded_by_workers_plus_pending():
+    release = threading.Event()
+    queue = RequestQueue(_blocking_run(release), lambda: None, max_workers=1, max_pending=1)
+    jobs = [queue.submit("a", "postgres"), queue.submit("b", "postgres")]
+    with pytest.raises(QueueFullError, match="máximo 2"):
+        queue.submit("c", "postgres")
+    assert jobs[1].state == PENDING
+
+    release.set()
+    for job in jobs:
+        job.future.result(5)
+    assert [job.state for job in jobs] == [DONE_STATE, DONE_STATE]
+    assert queue.submit("c", "postgres").future.result(5) is None
+    queue.shutdown()
+
+
+def test_failures_are_reported_as_events():
+    def run(job):
+        if job.query == "sin resultado":
+            yield _token("...")
+            return
+        if job.query == "error del agente":
+            yield _done(error="timeout")
+            return
+        raise ConnectionError("sin conexión")
+
+    queue = RequestQueue(run, lambda: None, max_workers=1)
+    jobs = [queue.submit(query, "mongo") for query in ("sin resultado", "error del agente", "excepción")]
+    for job in jobs:
+        job.future.result(5)
+    events = queue.drain(budget_seconds=1)[0]
+
+    assert [job.state for job in jobs] == [FAILED, FAILED, FAILED]
+    assert [job.error for job in jobs] == ["El agente terminó sin resultado", "timeout", "sin conexión"]
+    assert [event["type"] for job, event in events if job is jobs[2]] == [JOB_STARTED, JOB_FAILED]
+    assert queue.active() == []
+    queue.shutdown()
+
+
+def test_shutdown_cancels_pending_jobs():
+    release, started = threading.Event(), threading.Event()
+    queue = RequestQueue(_blocking_run(release, started), lambda: None, max_workers=1, max_pending=2)
+    running, pending = queue.submit("a", "postgres"), queue.submit("b", "postgres")
+    assert started.wait(5)
+    queue.shutdown()
+    assert pending.state == CANCELLED
+    with pytest.raises(QueueFullError):
+        queue.submit("c", "postgres")
+    release.set()
+    running.future.result(5)
+    assert running.state == DONE_STATE
@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+from src.agents.result_compaction import TRUNCATED_MARKER, column_statistics, compact_result
+from src.agents.sql_context import format_rows
+
+TOTALS = [12345.67, 99999.99, 5432.10] * 100
+
+
+def test_numeric_summary_keeps_sums_and_extremes_exact():
+    assert column_statistics("total_amount", TOTALS, 5) == (
+        "- total_amount: 300 valores, min 5432.1, max 99999.99, suma 11777776.00, media 39259.25"
+    )
+    decimals = [Decimal("12345.67"), Decimal("99999.99"), Decimal("5432.10")] * 100
+    assert column_statistics("total_amount", decimals + [None], 5) == (
+        "- total_amount: 300 valores, 1 nulos, min 5432.10, max 99999.99, suma 11777776.00, media 39259.25"
+    )
+    assert column_statistics("views", [10 ** 18, 7, 3], 5) == (
+        "- views: 3 valores, min 3, max 1000000000000000000, suma 1000000000000000010, "
+        "media 333333333333333336.67"
+    )
+
+
+def test_large_result_is_truncated_with_whole_result_statistics():
+    rows = [(i, "completed" if i % 3 else "pending", total) for i, total in enumerate(TOTALS)]
+    full = format_rows(rows)
+
+    compacted = compact_result(rows, full, format_rows, ["id", "status", "total_amount"],
+                               max_rows=50, max_bytes=4000, head_rows=2, top_k=2)
+
+    assert compacted.truncated and compacted.total_rows == 300
+    assert compacted.text.startswith(f"[{TRUNCATED_MARKER}: 300 filas en total; se muestran las primeras 2]")
+    assert "Primeras filas: [(0, 'pending', 12345.67), (1, 'completed', 99999.99)]" in compacted.text
+    assert "- id: 300 valores, min 0, max 299, suma 44850, media 149.50" in compacted.text
+    assert "- status: 300 valores, 2 distintos; más frecuentes: completed (200), pending (100)" in compacted.text
+    assert "suma 11777776.00" in compacted.text
+
+
+def test_small_result_is_passed_verbatim():
+    rows = [(1, 12.5)]
+    assert compact_result(rows, format_rows(rows), format_rows) == (format_rows(rows), False, 1)
@@ -0,0 +1,79 @@
+from src.agents.schema_cache import INDEX_ROWS, TABLE_INFO, SQLSchemaCache
+from src.agents.schema_index import SchemaIndex, _plain_rows
+
+# Filas como las devuelve SCHEMA_INDEX_SQL vía asyncpg (JSON como texto)
+CATALOG_ROWS = [
+    ("orders", "Pedidos", '[["id", "integer", true, null], ["user_id", "integer", false, null],'
+                          ' ["status", "character varying(20)", false, null]]',
+     '[["orders_pkey", "PRIMARY KEY (id)", null], ["orders_user_id_fkey", "FOREIGN KEY (user_id) REFERENCES users(id)", "users"]]'),
+    ("users", None, '[["id", "integer", true, null], ["username", "character varying(50)", false, null]]',
+     '[["users_pkey", "PRIMARY KEY (id)", null]]'),
+]
+
+
+def test_index_rows_survive_a_cold_start(tmp_path):
+    path = tmp_path / "schema.json"
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return _plain_rows(CATALOG_ROWS)
+
+    warm = SQLSchemaCache(path)
+    rows = warm.get_for("fp1", fetch, INDEX_ROWS)
+
+    cold = SQLSchemaCache(path)
+    cached = cold.get_for("fp1", fetch, INDEX_ROWS)
+
+    assert calls == [1]
+    assert cached == rows
+    assert cold.stats()["hits"] == 1 and cold.stats()["disk_hits"] == 1 and cold.stats()["misses"] == 0
+    index = SchemaIndex(cached, "fp1")
+    assert index.columns == SchemaIndex(CATALOG_ROWS, "fp1").columns
+    assert index.select("¿Cuántos pedidos hay?").tables == ["orders", "users"]
+
+
+def test_both_kinds_share_one_fingerprint(tmp_path):
+    cache = SQLSchemaCache(tmp_path / "schema.json")
+    cache.get_for("fp1", lambda: "CREATE TABLE orders (...)", TABLE_INFO)
+    cache.get_for("fp1", lambda: [["orders", None, [], []]], INDEX_ROWS)
+
+    reloaded = SQLSchemaCache(tmp_path / "schema.json")
+    assert reloaded.lookup("fp1", TABLE_INFO) == (True, "CREATE TABLE orders (...)")
+    assert reloaded.lookup("fp1", INDEX_ROWS)[0]
+    assert reloaded.stats()["disk_hits"] == 2
+
+
+def test_new_fingerprint_drops_every_kind(tmp_path):
+    cache = SQLSchemaCache(tmp_path / "schema.json")
+    cache.get_for("fp1", lambda: "old ddl", TABLE_INFO)
+    cache.store("fp2", INDEX_ROWS, [], 0.1)
+    assert cache.lookup("fp2", TABLE_INFO) == (False, None)
+    assert cache.lookup("fp1", TABLE_INFO) == (False, None)
+    assert cache.stats()["misses"] == 3
+
+
+def test_schema_is_reflected_only_when_the_fingerprint_changes(tmp_path, monkeypatch):
+    from src.agents import schema_cache
+
+    fingerprints = iter(["fp1", "fp1", "fp2", "fp2"])
+    monkeypatch.setattr(schema_cache, "catalog_fingerprint", lambda engine: next(fingerprints))
+    reflections = []
+
+    def reflect():
+        reflections.append(1)
+        return f"ddl {len(reflections)}"
+
+    cache = SQLSchemaCache(tmp_path / "schema.json")
+    assert [cache.get(None, reflect) for _ in range(3)] == ["ddl 1", "ddl 1", "ddl 2"]
+    assert cache.stats()["fingerprint"] == "fp2"
+    # Arranque en frío: el snapshot del disco evita reflejar de nuevo
+    assert SQLSchemaCache(tmp_path / "schema.json").get(None, reflect) == "ddl 2"
+    assert len(reflections) == 2
+
+
+def test_corrupt_snapshot_is_rebuilt(tmp_path):
+    path = tmp_path / "schema.json"
+    path.write_text("{no es json", encoding="utf-8")
+    assert SQLSchemaCache(path).get_for("fp1", lambda: "ddl") == "ddl"
+    assert SQLSchemaCache(path).lookup("fp1") == (True, "ddl")
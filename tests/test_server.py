@@ -0,0 +1,110 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.agents.streaming import DONE, event
+from src.server import AdmissionGate, ServerBusy, ServerClosing, create_server
+
+
+def test_gate_rejects_when_slots_and_queue_are_full():
+    gate = AdmissionGate(max_concurrent=1, max_queue=0, queue_timeout=1)
+    gate.acquire()
+    with pytest.raises(ServerBusy):
+        gate.acquire()
+    gate.release()
+    gate.acquire()
+    assert gate.snapshot() == {
+        "running": 1, "queued": 0, "served": 1, "rejected": 1,
+        "max_concurrent": 1, "max_queue": 0, "closing": False,
+    }
+
+
+def test_gate_queue_times_out():
+    gate = AdmissionGate(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+    gate.acquire()
+    with pytest.raises(ServerBusy, match="en cola"):
+        gate.acquire()
+    assert gate.snapshot()["queued"] == 0
+
+
+def test_queued_request_gets_the_released_slot():
+    gate = AdmissionGate(max_concurrent=1, max_queue=1, queue_timeout=5)
+    gate.acquire()
+    admitted = threading.Event()
+    waiter = threading.Thread(target=lambda: (gate.acquire(), admitted.set()))
+    waiter.start()
+    assert not admitted.wait(0.05)
+    gate.release()
+    assert admitted.wait(2)
+    waiter.join()
+
+
+def test_closed_gate_rejects_new_requests_and_drains():
+    gate = AdmissionGate(max_concurrent=2, max_queue=0, queue_timeout=1)
+    gate.acquire()
+    gate.close()
+    with pytest.raises(ServerClosing):
+        gate.acquire()
+    assert not gate.wait_idle(0.01)
+    gate.release()
+    assert gate.wait_idle(0.01)
+
+
+@pytest.fixture
+def blocking_server():
+    release = threading.Event()
+    started = threading.Event()
+
+    def runner(backend, question, options):
+        started.set()
+        release.wait(5)
+        yield event(DONE, result={"answer": f"{backend}: {question}", "error": None})
+
+    server = create_server(port=0, runner=runner, max_concurrent=1, max_queue=0, queue_timeout=1, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, started, release
+    release.set()
+    server.stop(drain_timeout=2)
+    thread.join(2)
+
+
+def _post(server, question):
+    request = urllib.request.Request(
+        server.url + "/query", data=json.dumps({"question": question, "db": "postgres"}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, dict(response.headers), json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), json.loads(e.read())
+
+
+def test_http_answers_429_when_busy(blocking_server):
+    server, started, release = blocking_server
+    first = {}
+    client = threading.Thread(target=lambda: first.update(zip(("status", "headers", "body"), _post(server, "uno"))))
+    client.start()
+    assert started.wait(2)
+
+    status, headers, body = _post(server, "dos")
+    assert status == 429
+    assert headers["Retry-After"] == "1"
+    assert body["error"].startswith("Servidor ocupado")
+
+    release.set()
+    client.join(5)
+    assert first["status"] == 200 and first["body"]["answer"] == "postgres: uno"
+    assert server.gate.snapshot()["rejected"] == 1
+
+
+def test_http_answers_503_while_closing(blocking_server):
+    server, _, _ = blocking_server
+    server.gate.close()
+    status, headers, body = _post(server, "uno")
+    assert status == 503
+    assert headers["Connection"] == "close"
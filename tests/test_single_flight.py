@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+from src.agents.single_flight import SingleFlight, flight_key
+from src.agents.streaming import ANSWER_TOKEN, DONE, QUERY_GENERATED, event
+
+KEY = flight_key("¿Cuántos pedidos hay?", "fp", "postgres://test")
+
+
+class Pipeline:
+    """Fake pipeline: one query event, then waits for ``release`` before answering."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.starts = 0
+        self.closed = False
+
+    def __call__(self):
+        self.starts += 1
+        return self._events()
+
+    def _events(self):
+        try:
+            yield event(QUERY_GENERATED, query="SELECT count(*) FROM orders")
+            self.release.wait(5)
+            yield event(ANSWER_TOKEN, text="Hay 3 pedidos.")
+            yield event(DONE, result={
+                "answer": "Hay 3 pedidos.",
+                "trace": {"spans": [{"name": "query_generation_llm", "duration_ms": 1500.0}]},
+            })
+        finally:
+            self.closed = True
+
+
+def pipeline_never_called():
+    raise AssertionError("un seguidor no debe lanzar el pipeline")
+
+
+def _follow(flights, sink):
+    thread = threading.Thread(target=lambda: sink.extend(flights.stream("postgres", KEY, pipeline_never_called)))
+    thread.start()
+    return thread
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_flight_key_ignores_case_accents_and_punctuation():
+    assert flight_key("¿CUÁNTOS pedidos hay", "fp", "postgres://test") == KEY
+    assert flight_key("¿Cuántos pedidos hay?", "other", "postgres://test") != KEY
+
+
+def test_identical_requests_share_one_execution():
+    flights, pipeline = SingleFlight(), Pipeline()
+    leader = flights.stream("postgres", KEY, pipeline)
+    first = next(leader)
+
+    followed = []
+    follower = _follow(flights, followed)
+    _wait_for(lambda: flights.stats.coalesced["postgres"] == 1)
+    pipeline.release.set()
+    led = [first, *leader]
+    follower.join(2)
+
+    assert pipeline.starts == 1
+    assert [ev["type"] for ev in followed] == [ev["type"] for ev in led]
+    assert followed[-1]["result"]["coalesced"] is True
+    assert "coalesced" not in led[-1]["result"]
+    assert flights.stats.snapshot() == {"postgres": {
+        "executions": 1, "coalesced": 1, "llm_calls_saved": 1, "llm_seconds_saved": 1.5,
+    }}
+    assert flights.in_flight() == 0
+
+
+def test_finished_flight_is_not_joined():
+    flights, pipeline = SingleFlight(), Pipeline()
+    pipeline.release.set()
+    list(flights.stream("postgres", KEY, pipeline))
+    list(flights.stream("postgres", KEY, pipeline))
+    assert pipeline.starts == 2
+
+
+def test_leader_disconnect_does_not_block_and_followers_finish():
+    flights, pipeline = SingleFlight(), Pipeline()
+    leader = flights.stream("postgres", KEY, pipeline)
+    next(leader)
+    followed = []
+    follower = _follow(flights, followed)
+    _wait_for(lambda: flights.stats.coalesced["postgres"] == 1)
+
+    started = time.monotonic()
+    leader.close()
+    assert time.monotonic() - started < 1.0
+    assert not pipeline.closed
+
+    pipeline.release.set()
+    follower.join(2)
+    assert followed[-1]["type"] == DONE and followed[-1]["result"]["answer"] == "Hay 3 pedidos."
+    _wait_for(lambda: pipeline.closed)
+
+
+def test_leader_disconnect_without_followers_stops_the_pipeline():
+    flights, pipeline = SingleFlight(), Pipeline()
+    leader = flights.stream("postgres", KEY, pipeline)
+    next(leader)
+    leader.close()
+    assert pipeline.closed
+    assert flights.in_flight() == 0
+
+
+def test_async_requests_share_one_execution():
+    flights = SingleFlight()
+    starts = []
+
+    async def pipeline():
+        starts.append(1)
+        yield event(QUERY_GENERATED, query="SELECT count(*) FROM orders")
+        await asyncio.sleep(0.05)
+        yield event(DONE, result={"answer": "Hay 3 pedidos."})
+
+    async def ask():
+        return [ev async for ev in flights.astream("postgres", KEY, pipeline)]
+
+    async def main():
+        return await asyncio.gather(ask(), ask())
+
+    led, followed = asyncio.run(main())
+    assert len(starts) == 1
+    assert led[-1]["result"] == {"answer": "Hay 3 pedidos."}
+    assert followed[-1]["result"]["coalesced"] is True
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from src.agents import sql_agent, sql_context
+from src.agents.sql_context import QueryCost, QueryCostError, SQLAgentContext, get_sql_context, inject_limit, plan_cost
+from src.agents.streaming import QUERY_GENERATED
+
+
+def test_questions_share_one_context_pool_and_llm(sqlite_agent, monkeypatch):
+    sessions = []
+    monkeypatch.setattr(sql_context, "_set_session_config", lambda *args: sessions.append(1))
+
+    for question in ("¿Cuántos pedidos hay?", "¿Cuántos pedidos se han hecho?", "Número de pedidos"):
+        assert sql_agent.run_sql_agent(question)["error"] is None
+
+    uri = os.environ["POSTGRES_URI"]
+    ctx = get_sql_context(uri)
+    assert list(sql_context._contexts) == [uri]
+    assert ctx.llm is sqlite_agent
+    # Los SET de sesión corren una vez por conexión física, no por pregunta
+    assert len(sessions) == 1
+    assert ctx.pool_stats()["checkouts"] >= 3
+
+
+def test_inject_limit_drops_trailing_semicolon_and_comments():
+    assert inject_limit("SELECT * FROM orders; -- todos", 100) == "SELECT * FROM orders\nLIMIT 100"
+    assert inject_limit("SELECT * FROM orders /* todos */;\n", 100) == "SELECT * FROM orders\nLIMIT 100"
+    assert inject_limit("SELECT '--;' AS note FROM orders;", 100) == "SELECT '--;' AS note FROM orders\nLIMIT 100"
+    assert inject_limit("SELECT * FROM orders LIMIT 5; -- ya limitada", 100) == "SELECT * FROM orders LIMIT 5; -- ya limitada"
+
+
+def _plan(node_type, rows, cost=10.0, children=()):
+    return {"Node Type": node_type, "Plan Rows": rows, "Total Cost": cost, "Plans": list(children)}
+
+
+def test_plan_cost_ignores_rows_below_a_limit():
+    cross_join = _plan("Nested Loop", 10 ** 9, cost=5e7)
+    limited = [{"Plan": _plan("Limit", 101, cost=3.2, children=[cross_join])}]
+    assert plan_cost(limited) == QueryCost(3.2, 101, "Limit")
+    # Bajo un agregado el producto cartesiano se procesa entero
+    counted = json.dumps([{"Plan": _plan("Aggregate", 1, cost=5e7, children=[cross_join])}])
+    assert plan_cost(counted) == QueryCost(5e7, 10 ** 9, "Aggregate")
+
+
+def test_check_plan_rejects_costly_plans(sqlite_agent):
+    ctx = get_sql_context(os.environ["POSTGRES_URI"])
+    ctx.max_plan_cost, ctx.max_plan_rows = 1000, 100
+    assert ctx._check_plan([{"Plan": _plan("Seq Scan", 50, cost=20.0)}]) == QueryCost(20.0, 50, "Seq Scan")
+    with pytest.raises(QueryCostError, match="coste estimado 5000 > 1000; filas estimadas 500 > 100") as info:
+        ctx._check_plan([{"Plan": _plan("Seq Scan", 500, cost=5000.0)}])
+    assert info.value.cost.plan_rows == 500
+
+
+def _reject_joins(monkeypatch):
+    def check_cost(self, sql):
+        if "users" in sql:
+            raise QueryCostError("coste estimado 5000000 > 1000000", QueryCost(5e6, 10 ** 8, "Nested Loop"))
+        return None
+
+    monkeypatch.setattr(SQLAgentContext, "check_cost", check_cost)
+
+
+def test_costly_query_is_rewritten_once(sqlite_agent, monkeypatch):
+    _reject_joins(monkeypatch)
+    sqlite_agent.responses = ["```sql\nSELECT count(*) FROM orders, users\n```",
+                              "```sql\nSELECT count(*) FROM orders\n```"]
+    events = list(sql_agent.stream_sql_agent("¿Cuántos pedidos hay?"))
+
+    generated = [ev for ev in events if ev["type"] == QUERY_GENERATED]
+    assert [ev["query"] for ev in generated] == ["SELECT count(*) FROM orders, users", "SELECT count(*) FROM orders"]
+    assert generated[1]["rewritten"]
+    assert "coste estimado 5000000 > 1000000" in sqlite_agent.prompts[1]
+    result = events[-1]["result"]
+    assert result["error"] is None and result["sql_queries"] == ["SELECT count(*) FROM orders"]
+
+
+def test_costly_query_is_refused_without_rewrite(sqlite_agent, monkeypatch):
+    _reject_joins(monkeypatch)
+    monkeypatch.setenv("SQL_COST_ACTION", "reject")
+    sqlite_agent.responses = ["```sql\nSELECT count(*) FROM orders, users\n```"]
+    result = sql_agent.run_sql_agent("¿Cuántos pedidos hay?")
+    assert result["error"].startswith("Query Too Expensive: coste estimado")
+    assert result["raw_results"] == []
@@ -0,0 +1,56 @@
+import pytest
+
+from src.agents.sql_validation import validation_errors
+
+SCHEMA = {
+    "users": ["id", "name", "email"],
+    "orders": ["id", "user_id", "total", "status"],
+}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT name FROM users",
+    "SELECT u.name, count(*) FROM users u JOIN orders o ON o.user_id = u.id GROUP BY u.name",
+    "WITH t AS (SELECT id FROM users) SELECT id FROM t",
+    "SELECT id FROM users UNION SELECT user_id FROM orders",
+    "SELECT * FROM generate_series(1, 3)",
+    "SELECT table_name FROM information_schema.tables",
+])
+def test_read_only_queries_pass(sql):
+    assert validation_errors(sql, SCHEMA) == []
+
+
+@pytest.mark.parametrize("sql, fragment", [
+    ("DELETE FROM users", "se recibió DELETE"),
+    ("WITH d AS (DELETE FROM users RETURNING *) SELECT * FROM d", "escritura no permitida"),
+    ("SELECT * INTO copia FROM users", "SELECT ... INTO"),
+    ("SELECT * FROM users FOR UPDATE", "FOR UPDATE"),
+    ("SELECT pg_sleep(5)", "pg_sleep()"),
+])
+def test_writes_and_side_effects_are_rejected(sql, fragment):
+    errors = validation_errors(sql, SCHEMA)
+    assert len(errors) == 1 and fragment in errors[0]
+
+
+def test_only_one_statement_is_accepted():
+    assert validation_errors("SELECT 1; SELECT 2") == ["Se esperaba una única sentencia SQL y hay 2"]
+
+
+def test_syntax_errors_report_the_position():
+    [error] = validation_errors("SELEC 1")
+    assert error.startswith("Error de sintaxis en línea 1")
+
+
+def test_unknown_table_suggests_close_names():
+    [error] = validation_errors("SELECT * FROM user", SCHEMA)
+    assert "'user' no existe (¿quizá users?)" in error
+    assert "Tablas disponibles: orders, users" in error
+
+
+def test_unknown_column_suggests_columns_of_referenced_tables():
+    [error] = validation_errors("SELECT u.nam FROM users u", SCHEMA)
+    assert "'nam'" in error and "users.name" in error
+
+
+def test_schema_is_optional():
+    assert validation_errors("SELECT anything FROM anywhere") == []
@@ -0,0 +1,53 @@
+from conftest import Message
+
+from src.agents import sql_agent
+from src.agents.streaming import ANSWER_TOKEN, DONE, QUERY_GENERATED, ROWS_FETCHED, collect_result, stream_answer
+from src.agents.tracing import Trace
+
+
+class UsageLLM:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.sent = 0
+
+    def stream(self, prompt):
+        for text in self.chunks:
+            self.sent += 1
+            message = Message(text)
+            message.usage_metadata = {"input_tokens": 120, "output_tokens": self.sent}
+            yield message
+
+
+def test_stream_answer_skips_empty_chunks_and_records_usage():
+    llm = UsageLLM(["Hay ", "", "3 pedidos."])
+    trace = Trace("test")
+    with trace.span("interpretation_llm") as span:
+        assert list(stream_answer(llm, "prompt", span)) == ["Hay ", "3 pedidos."]
+    assert span.attributes == {"llm.prompt_tokens": 120, "llm.completion_tokens": 3}
+
+
+def test_tokens_are_emitted_while_the_llm_streams(sqlite_agent):
+    sqlite_agent.answer = "Hay tres pedidos en total."
+    stream = sqlite_agent.stream
+    sent = []
+
+    def counting_stream(prompt):
+        for chunk in stream(prompt):
+            sent.append(chunk)
+            yield chunk
+
+    sqlite_agent.stream = counting_stream
+    events = sql_agent.stream_sql_agent("¿Cuántos pedidos hay?")
+    types = []
+    for ev in events:
+        types.append(ev["type"])
+        if ev["type"] == ANSWER_TOKEN:
+            # Cada trozo sale antes de que el modelo genere el siguiente
+            assert len(sent) == types.count(ANSWER_TOKEN)
+        if ev["type"] == DONE:
+            result = ev["result"]
+
+    assert types[:2] == [QUERY_GENERATED, ROWS_FETCHED] and types[-1] == DONE
+    assert types.count(ANSWER_TOKEN) == 5
+    assert result["answer"] == "Hay tres pedidos en total. "
+    assert collect_result(sql_agent.stream_sql_agent("¿Cuántos pedidos hay?"))["answer"] == result["answer"]
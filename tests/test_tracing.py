@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from src.agents import sql_agent
+from src.agents.tracing import STATUS_ERROR, STATUS_OK, Trace
+
+
+def test_spans_nest_and_record_failures():
+    trace = Trace("sql_agent", question="¿Cuántos pedidos hay?", skipped=None)
+    with trace.span("db_execution", **{"db.statement": "SELECT 1"}) as outer:
+        with trace.span("explain") as inner:
+            inner.set(**{"db.plan_cost": 12.5, "db.plan_rows": None})
+    with pytest.raises(ValueError):
+        with trace.span("interpretation_llm"):
+            raise ValueError("modelo caído")
+
+    data = trace.finish({"error": "modelo caído\ntraceback"})
+    spans = {span["name"]: span for span in data["spans"]}
+    assert spans["sql_agent"]["attributes"] == {"question": "¿Cuántos pedidos hay?"}
+    assert spans["explain"]["parent_span_id"] == outer.span_id
+    assert spans["db_execution"]["parent_span_id"] == trace.root.span_id
+    assert spans["explain"]["attributes"] == {"db.plan_cost": 12.5}
+    assert spans["db_execution"]["status"] == STATUS_OK
+    assert (spans["interpretation_llm"]["status"], spans["interpretation_llm"]["status_message"]) == (
+        STATUS_ERROR, "modelo caído")
+    assert spans["sql_agent"]["status_message"] == "modelo caído"
+    assert all(span["end_time_unix_nano"] >= span["start_time_unix_nano"] for span in data["spans"])
+
+
+def test_trace_is_exported_as_otlp_json(tmp_path, monkeypatch):
+    path = tmp_path / "traces" / "otlp.jsonl"
+    monkeypatch.setenv("TRACE_FILE", str(path))
+    trace = Trace("mongo_agent")
+    with trace.span("db_execution") as span:
+        span.set(**{"db.rows": 3, "result_cache.hit": False})
+    trace.finish()
+
+    document = json.loads(path.read_text(encoding="utf-8"))
+    otlp_spans = document["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [span["name"] for span in otlp_spans] == ["mongo_agent", "db_execution"]
+    assert otlp_spans[1]["parentSpanId"] == otlp_spans[0]["spanId"]
+    assert otlp_spans[1]["attributes"] == [
+        {"key": "db.rows", "value": {"intValue": "3"}},
+        {"key": "result_cache.hit", "value": {"boolValue": False}},
+    ]
+
+
+def test_agent_result_carries_its_trace(sqlite_agent):
+    result = sql_agent.run_sql_agent("¿Cuántos pedidos hay?")
+    names = [span["name"] for span in result["trace"]["spans"]]
+    assert names[0] == "sql_agent"
+    assert {"setup", "schema_load", "query_cache_lookup", "generation_llm", "db_execution",
+            "interpretation_llm"} <= set(names)
+    db_span = next(span for span in result["trace"]["spans"] if span["name"] == "db_execution")
+    assert db_span["attributes"]["db.statement"] == "SELECT count(*) FROM orders"
+    assert db_span["attributes"]["db.rows"] == 1